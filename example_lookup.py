@@ -1,11 +1,11 @@
 """Quick example: loading and inspecting saved OHLCV data from data.zip."""
 
-import io
 import zipfile
-from pathlib import PurePosixPath
 
 import pandas as pd
 
+from src.dataset import count_markets, iter_frames, list_event_slugs
+
 ARCHIVE = "data.zip"
 
 
@@ -15,16 +15,8 @@ def _open_zip():
 
 def load_event(event_slug: str) -> pd.DataFrame:
     """Load all market parquet files for an event into a single DataFrame."""
-    prefix = f"data/{event_slug}/"
-    frames = []
     with _open_zip() as zf:
-        for name in zf.namelist():
-            normalized = name.replace("\\", "/")
-            if normalized.startswith(prefix) and normalized.endswith(".parquet"):
-                stem = PurePosixPath(normalized).stem
-                df = pd.read_parquet(io.BytesIO(zf.read(name)))
-                df["market"] = stem
-                frames.append(df)
+        frames = [df.drop(columns=["event_slug"]) for df in iter_frames(zf, event_slug)]
 
     if not frames:
         raise FileNotFoundError(f"No data for event: {event_slug}")
@@ -36,15 +28,8 @@ def load_event(event_slug: str) -> pd.DataFrame:
 
 def list_events() -> list[str]:
     """List all event slugs that have saved data."""
-    events = set()
     with _open_zip() as zf:
-        for name in zf.namelist():
-            # Normalize backslashes (Windows zips) to forward slashes
-            parts = name.replace("\\", "/").split("/")
-            # data/{event_slug}/{market}.parquet
-            if len(parts) == 3 and parts[2].endswith(".parquet") and parts[1] != "unknown":
-                events.add(parts[1])
-    return sorted(events)
+        return list_event_slugs(zf.namelist())
 
 
 if __name__ == "__main__":
@@ -52,11 +37,9 @@ if __name__ == "__main__":
     print(f"Available events ({len(events)}):")
 
     with _open_zip() as zf:
-        all_names = [n.replace("\\", "/") for n in zf.namelist()]
-    for e in events:
-        prefix = f"data/{e}/"
-        n_files = sum(1 for n in all_names if n.startswith(prefix) and n.endswith(".parquet"))
-        print(f"  {e} ({n_files} markets)")
+        for e in events:
+            n_markets = count_markets(zf, e)
+            print(f"  {e} ({n_markets} markets)")
 
     event_slug = events[9] if len(events) > 9 else events[0] if events else None
     if not event_slug:
@@ -1,10 +1,8 @@
 """Aggregate volume summary from data.zip."""
 
-import io
 import zipfile
-from pathlib import PurePosixPath
 
-import pandas as pd
+from src.dataset import iter_frames
 
 ARCHIVE = "data.zip"
 
@@ -14,22 +12,16 @@ total_volume = 0.0
 volume_rows = []
 
 with zipfile.ZipFile(ARCHIVE, "r") as zf:
-    parquet_files = [
-        n for n in zf.namelist()
-        if n.endswith(".parquet") and "unknown" not in n.replace("\\", "/").split("/")
-    ]
-
-    for name in parquet_files:
-        df = pd.read_parquet(io.BytesIO(zf.read(name)))
-        total_candles += len(df)
-        total_trades += df["trade_count"].sum()
-        total_volume += df["volume"].sum()
-
-        trades = df[df["trade_count"] > 0]
-        if len(trades) > 0:
-            p = PurePosixPath(name)
-            label = f"{p.parent.name}/{p.stem}"
-            volume_rows.append((label, len(trades), trades["volume"].sum()))
+    for frame in iter_frames(zf):
+        for (event_slug, market), df in frame.groupby(["event_slug", "market"]):
+            total_candles += len(df)
+            total_trades += df["trade_count"].sum()
+            total_volume += df["volume"].sum()
+
+            trades = df[df["trade_count"] > 0]
+            if len(trades) > 0:
+                label = f"{event_slug}/{market}"
+                volume_rows.append((label, len(trades), trades["volume"].sum()))
 
 print(f"Total candles: {total_candles}")
 print(f"Total trades: {total_trades}")
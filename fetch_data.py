@@ -1,11 +1,12 @@
 """Fetch data.zip from a remote server and load all OHLCV data into a DataFrame."""
 
-import io
 import subprocess
 import zipfile
 
 import pandas as pd
 
+from src.dataset import iter_frames
+
 
 def fetch_zip(host: str, remote_path: str, local_path: str = "data.zip", port: int | None = None):
     """SCP the data archive from a remote server."""
@@ -23,19 +24,10 @@ def load_zip(zip_path: str = "data.zip") -> pd.DataFrame:
     """Load all parquet files from a zip into a single DataFrame.
 
     Adds 'event_slug' and 'market' columns derived from the file paths.
+    Works with every storage layout (see src.dataset.parse_member).
     """
-    frames = []
     with zipfile.ZipFile(zip_path, "r") as zf:
-        for name in zf.namelist():
-            parts = name.replace("\\", "/").split("/")
-            if len(parts) != 3 or not parts[2].endswith(".parquet") or parts[1] == "unknown":
-                continue
-            event_slug = parts[1]
-            market = parts[2].removesuffix(".parquet")
-            df = pd.read_parquet(io.BytesIO(zf.read(name)))
-            df["event_slug"] = event_slug
-            df["market"] = market
-            frames.append(df)
+        frames = list(iter_frames(zf))
 
     if not frames:
         raise FileNotFoundError(f"No parquet data found in {zip_path}")
@@ -0,0 +1,114 @@
+"""Replay captured WebSocket frames (capture_frames in config.yaml) into a new dataset.
+
+Frames go through the same path as live data - WebSocketOrderBook.on_message, the
+FrameRouter, OHLCVAggregator and ParquetStorage - with the clock driven by the
+capture's receive timestamps, so a replay of the same capture produces the same
+candles. Run as fast as possible (the default) for throughput benchmarks, or at
+``--speed N`` times real time; ``--interval`` regenerates candles at another size.
+
+    python replay.py --capture captures --data-dir data_replay --interval 300
+"""
+
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from src.capture import load_markets, read_frames
+from src.config import load_config
+from src.ohlcv_aggregator import OHLCVAggregator
+from src.rollup import CandleRollup, MultiResolutionStorage
+from src.storage import ParquetStorage
+from src.websocket_orderbook import FrameRouter, WebSocketOrderBook
+
+
+def main():
+    config = load_config()
+    parser = argparse.ArgumentParser(description="Replay captured WebSocket frames into parquet candles")
+    parser.add_argument("--capture", default=config.capture_dir, help="Capture directory or a single frames-*.log.gz file")
+    parser.add_argument("--data-dir", default="data_replay", help="Output data directory")
+    parser.add_argument("--interval", type=int, default=config.candle_interval_seconds, help="Candle interval in seconds")
+    parser.add_argument("--speed", type=float, default=0.0, help="Times real time; 0 replays as fast as possible")
+    parser.add_argument("--layout", default=config.storage_layout, help="Storage layout of the output")
+    parser.add_argument("--archive", default=None, help="Also write a zip of the output, e.g. data_replay.zip")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, config.log_level),
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+    logger = logging.getLogger("replay")
+
+    capture = Path(args.capture)
+    markets = load_markets(capture if capture.is_dir() else capture.parent)
+    if not markets:
+        logger.warning("No market snapshot in the capture; candles are keyed by asset id only")
+
+    aggregator = OHLCVAggregator(
+        args.interval,
+        tracked_assets=markets or None,
+        market_lookup=markets,
+        l2_books=config.l2_books,
+        depth_ticks=config.depth_ticks,
+        fill_empty=config.fill_empty_candles,
+        allowed_lateness=config.allowed_lateness_seconds,
+    )
+    # rollups that are still coarser multiples of the (possibly overridden) interval
+    intervals = [i for i in config.rollup_intervals if i > args.interval and i % args.interval == 0]
+    rollup = CandleRollup(args.interval, intervals, delay=config.allowed_lateness_seconds) if intervals else None
+    storage = MultiResolutionStorage(
+        ParquetStorage(args.data_dir, market_lookup=markets, layout=args.layout), rollup
+    )
+    router = FrameRouter(batch_callback=aggregator.on_messages, decoder=config.json_decoder)
+    # never connected: only its on_message entry point is used
+    ws = WebSocketOrderBook("market", "replay", [], None, None, False, router=router, name="replay")
+
+    def advance(now: float):
+        aggregator.flush_stale_candles(now)
+        completed = aggregator.drain_completed_candles()
+        if completed:
+            storage.append_candles(completed)
+        storage.finalize_rollups(now)
+
+    frames = 0
+    first = last = None
+    next_deadline = None
+    last_flush = None
+    started = time.perf_counter()
+    for received, frame in read_frames(capture):
+        if first is None:
+            first = last_flush = received
+            next_deadline = aggregator.next_deadline(received)
+        if args.speed > 0:
+            delay = (received - first) / args.speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        if received >= next_deadline:
+            advance(received)
+            next_deadline = aggregator.next_deadline(received)
+        ws.on_message(None, frame)
+        frames += 1
+        last = received
+        if received - last_flush >= config.flush_interval_seconds:
+            storage.flush_to_disk()
+            last_flush = received
+
+    if last is None:
+        logger.error(f"No frames found in {capture}")
+        return
+    # close every window the capture reached
+    advance(last + args.interval + config.allowed_lateness_seconds)
+    storage.flush_to_disk()
+    if args.archive:
+        storage.archive(args.archive)
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Replayed {frames} frames covering {last - first:.0f}s in {elapsed:.2f}s "
+        f"({frames / elapsed if elapsed > 0 else 0:.0f} frames/s, {(last - first) / elapsed if elapsed > 0 else 0:.1f}x real time), "
+        f"late ticks={aggregator.late_ticks}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,27 @@ import time
 import logging
 import threading
 
+from src.capture import FrameRecorder
+from src.compaction import CompactionService
 from src.config import load_config
+from src.connection_manager import ShardedConnectionManager
+from src.discovery_cache import DiscoveryCache
+from src.discovery_worker import DiscoveryWorker
+from src.ingest import IngestPipeline
+from src.lifecycle import MarketLifecycle
 from src.market_discovery import MarketDiscovery
 from src.ohlcv_aggregator import OHLCVAggregator
-from src.storage import ParquetStorage
-from src.websocket_orderbook import WebSocketOrderBook, MARKET_CHANNEL
+from src.rollup import CandleRollup, MultiResolutionStorage
+from src.snapshot import load_snapshot, save_snapshot
+from src.storage import LAYOUT_EVENT, LAYOUT_SEGMENTED, ParquetStorage
+from src.trade_tape import TradeTape
+from src.websocket_orderbook import FrameRouter
 
 WS_URL = "wss://ws-subscriptions-clob.polymarket.com"
+# wake this long after a candle boundary so the candles ending on it have expired
+BOUNDARY_SLACK_SECONDS = 0.005
+# while the ingest queue holds frames from before a deadline, re-check this often
+BACKLOG_POLL_SECONDS = 0.05
 
 
 def main():
@@ -22,73 +36,206 @@ def main():
     )
     logger = logging.getLogger("main")
 
-    discovery = MarketDiscovery()
+    discovery_cache = DiscoveryCache(
+        config.discovery_cache_path,
+        max_entries=config.discovery_cache_max_entries,
+        ttl_seconds=config.discovery_cache_ttl_seconds,
+        negative_ttl_seconds=config.discovery_cache_negative_ttl_seconds,
+    )
+    discovery = MarketDiscovery(
+        max_workers=config.discovery_workers,
+        max_per_host=config.discovery_max_per_host,
+        cache=discovery_cache,
+        base_url=config.gamma_api_url,
+    )
+    tape = None
+    if config.trade_tape:
+        tape = TradeTape(config.trade_tape_dir, market_lookup=discovery.known_assets)
     aggregator = OHLCVAggregator(
         config.candle_interval_seconds,
         tracked_assets=discovery.known_assets,
         market_lookup=discovery.known_assets,
+        l2_books=config.l2_books,
+        depth_ticks=config.depth_ticks,
+        fill_empty=config.fill_empty_candles,
+        allowed_lateness=config.allowed_lateness_seconds,
+        tape=tape,
     )
-    storage = ParquetStorage(config.data_dir, market_lookup=discovery.known_assets)
-
-    logger.info("Running initial market discovery...")
-    initial_markets = discovery.discover(config.market_queries)
-    if not initial_markets:
-        logger.error("No markets found. Check your config.yaml market_queries.")
-        sys.exit(1)
-
-    asset_ids = [m.asset_id for m in initial_markets]
-    event_count = len(set(m.event_slug for m in initial_markets))
-    logger.info(f"Discovered {len(asset_ids)} assets across {event_count} events")
-
-    ws = WebSocketOrderBook(
-        channel_type=MARKET_CHANNEL,
-        url=WS_URL,
-        data=asset_ids,
-        auth=None,
+    # base candles plus the coarser resolutions rolled up from them, one dataset each
+    rollup = None
+    if config.rollup_intervals:
+        # base candles arrive allowed_lateness after their interval; wait for the last one
+        rollup = CandleRollup(
+            config.candle_interval_seconds, config.rollup_intervals, delay=config.allowed_lateness_seconds
+        )
+    storage = MultiResolutionStorage(
+        ParquetStorage(
+            config.data_dir,
+            market_lookup=discovery.known_assets,
+            layout=config.storage_layout,
+            wal_dir=config.wal_dir if config.candle_wal else None,
+        ),
+        rollup,
+    )
+
+    snapshot = load_snapshot(config.state_dir) if config.warm_restart else None
+    if snapshot is not None and snapshot.subscriptions:
+        # subscribe straight from the snapshot; discovery refreshes in the background
+        # candles the WAL recovered were finalized after the snapshot was taken
+        restored = snapshot.restore(
+            discovery, aggregator, emitted=storage.base.buffered_candles(),
+            rollup=storage.rollup, emitted_rollups=storage.recovered_rollups(),
+            flushed=storage.base.flushed_candles(),
+        )
+        asset_ids = snapshot.subscriptions
+        storage.append_gaps(snapshot.gap_records())
+        logger.info(
+            f"Warm restart: {len(asset_ids)} assets and {restored} open candles from the snapshot "
+            f"taken {time.time() - snapshot.created_at:.0f}s ago"
+        )
+    else:
+        snapshot = None
+        logger.info("Running initial market discovery...")
+        initial_markets = discovery.discover(config.market_queries)
+        if not initial_markets:
+            logger.error("No markets found. Check your config.yaml market_queries.")
+            sys.exit(1)
+
+        asset_ids = [m.asset_id for m in initial_markets]
+        event_count = len(set(m.event_slug for m in initial_markets))
+        logger.info(f"Discovered {len(asset_ids)} assets across {event_count} events")
+
+    router = FrameRouter(
         message_callback=aggregator.on_message,
         verbose=config.verbose,
-        new_market_callback=lambda msg: _on_new_market(msg, discovery, ws, aggregator, logger),
+        new_market_callback=lambda msg: _on_new_market(msg, discovery, discovery_worker),
+        batch_callback=aggregator.on_messages,
+        decoder=config.json_decoder,
+        resolved_callback=lambda msg: lifecycle.on_resolved(msg),
     )
+    logger.info(f"WebSocket frames decoded with {router.decoder_name}")
 
-    def _on_new_market(msg: dict, discovery: MarketDiscovery, ws: WebSocketOrderBook,
-                       aggregator: OHLCVAggregator, logger: logging.Logger) -> None:
-        """Handle a new_market push event by immediately subscribing to the new asset."""
-        token_id = msg.get("asset_id") or msg.get("token_id")
-        if not token_id or token_id in discovery.known_assets:
+    # Raw frames go through a bounded queue so parsing/aggregation never stalls socket reads.
+    pipeline = IngestPipeline(
+        router.handle_frame,
+        maxsize=config.ingest_queue_size,
+        workers=config.ingest_workers,
+        overflow=config.ingest_overflow,
+        l2_books=config.l2_books,
+    )
+    frame_callback = pipeline.put
+    recorder = None
+    if config.capture_frames:
+        recorder = FrameRecorder(
+            config.capture_dir,
+            rotate_bytes=config.capture_rotate_mb * 1024 * 1024,
+            maxsize=config.capture_queue_size,
+        )
+        recorder.write_markets(discovery.known_assets)
+
+        def frame_callback(frame, _put=pipeline.put):
+            recorder.put(frame)
+            _put(frame)
+
+    # Every shard feeds the same pipeline and router.
+    connections = ShardedConnectionManager(
+        WS_URL,
+        router,
+        frame_callback=frame_callback,
+        max_assets_per_connection=config.ws_max_assets_per_connection,
+        verbose=config.verbose,
+        gap_callback=storage.append_gaps,
+        backoff_initial=config.ws_backoff_initial_seconds,
+        backoff_max=config.ws_backoff_max_seconds,
+        resubscribe_chunk_size=config.ws_resubscribe_chunk_size,
+    )
+
+    # set on shutdown or when work is queued for the main loop, which otherwise sleeps
+    # until the next candle boundary
+    wake_event = threading.Event()
+    lifecycle = MarketLifecycle(discovery, aggregator, storage, connections, wake=wake_event)
+
+    def _subscribe_new(new_markets):
+        new_ids = [m.asset_id for m in new_markets]
+        logger.info(f"Subscribing to {len(new_ids)} new assets")
+        if recorder is not None:
+            recorder.write_markets(discovery.known_assets)
+        connections.subscribe(new_ids)
+
+    def save_state():
+        if not config.warm_restart:
             return
-        # Trigger a full Gamma discovery pass so MarketInfo is populated properly.
-        # This runs in the WS thread; it's a short network call and is acceptable.
         try:
-            new_markets = discovery.discover(config.market_queries)
+            # restore re-folds the WAL's base candles into the rollups, so their open
+            # candles are only saved while the WAL holds nothing they already include
+            rollup = storage.rollup if storage.base.get_buffer_size() == 0 else None
+            save_snapshot(config.state_dir, discovery, aggregator, connections.assets(), rollup=rollup)
         except Exception:
-            logger.exception("new_market discovery failed")
-            new_markets = []
-        new_ids = [m.asset_id for m in new_markets]
-        if new_ids:
-            logger.info(f"new_market push: subscribing to {len(new_ids)} assets immediately")
-            ws.subscribe_to_tokens_ids(new_ids)
+            logger.exception("Error saving state snapshot")
+
+    discovery_worker = DiscoveryWorker(
+        discovery,
+        config.market_queries,
+        on_new_markets=_subscribe_new,
+        interval_seconds=config.discovery_interval_seconds,
+        on_closed_markets=lifecycle.retire,
+    )
+
+    def _on_new_market(msg: dict, discovery: MarketDiscovery, worker: DiscoveryWorker) -> None:
+        """Handle a new_market push event by scheduling a discovery pass on the discovery thread."""
+        token_id = msg.get("asset_id") or msg.get("token_id")
+        if not token_id or token_id in discovery.known_assets:
+            return
+        # A full Gamma discovery pass populates MarketInfo properly; it runs on the
+        # discovery worker so the ingest thread is never blocked on HTTP.
+        worker.request(f"new_market {token_id}")
 
     shutdown_event = threading.Event()
 
     def signal_handler(sig, frame):
         logger.info("Shutdown signal received")
         shutdown_event.set()
-        ws.stop()
+        wake_event.set()
+        connections.stop()
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    ws_thread = threading.Thread(target=ws.run, daemon=True, name="websocket")
-    ws_thread.start()
-    logger.info("WebSocket thread started")
+    if recorder is not None:
+        recorder.start()
+    pipeline.start()
+    connections.start(asset_ids)
+
+    compactions = []
+    if config.storage_layout in (LAYOUT_SEGMENTED, LAYOUT_EVENT):
+        for dataset in storage.all_storages():
+            compaction = CompactionService(
+                dataset,
+                interval_seconds=config.compaction_interval_seconds,
+                fan_in=config.compaction_fan_in,
+                max_age_seconds=config.compaction_max_age_seconds,
+            )
+            compaction.start()
+            compactions.append(compaction)
+
+    discovery_worker.start()
+    if snapshot is not None:
+        discovery_worker.request("warm restart")
 
-    last_discovery = time.time()
     last_flush = time.time()
 
     while not shutdown_event.is_set():
+        # cleared before the work it signals is picked up, so a set() landing during
+        # this pass wakes the next wait instead of being lost
+        wake_event.clear()
         now = time.time()
+        # queued frames may still hold ticks for windows that are due by the clock
+        horizon = pipeline.received_through(now)
 
-        aggregator.flush_stale_candles()
+        aggregator.flush_stale_candles(horizon)
+        if lifecycle.process():
+            # retired assets must not come back from an older snapshot
+            save_state()
 
         completed = aggregator.drain_completed_candles()
         if completed:
@@ -96,30 +243,61 @@ def main():
             logger.info(
                 f"Buffered {count} candles (buffer size: {storage.get_buffer_size()})"
             )
+        storage.finalize_rollups(horizon)
+        # one fsync per log for everything buffered in this pass
+        storage.sync_wal()
 
         if now - last_flush >= config.flush_interval_seconds:
             storage.flush_to_disk()
-            storage.archive()
+            # right after the flush: the longer an older snapshot outlives it, the more
+            # a crash has to reconcile
+            save_state()
+            storage.archive(delta=config.archive_delta)
+            if tape is not None:
+                tape.flush()
+                tape.archive(delta=config.archive_delta)
+            stats = pipeline.stats(reset=True)
+            logger.info(
+                f"Ingest: depth={stats['depth']} (max {stats['max_depth']}), "
+                f"lag={stats['last_lag_seconds']:.3f}s (max {stats['max_lag_seconds']:.3f}s), "
+                f"processed={stats['processed']}, dropped={stats['dropped']}, coalesced={stats['coalesced']}, "
+                f"reconnects={connections.reconnects()}, late ticks={aggregator.late_ticks}"
+            )
+            if recorder is not None:
+                capture = recorder.stats(reset=True)
+                logger.info(
+                    f"Capture: depth={capture['depth']} (max {capture['max_depth']}), "
+                    f"frames={capture['frames']}, dropped={capture['dropped']}"
+                )
             last_flush = now
 
-        if now - last_discovery >= config.discovery_interval_seconds:
-            new_markets = discovery.discover(config.market_queries)
-            if new_markets:
-                new_ids = [m.asset_id for m in new_markets]
-                logger.info(f"Subscribing to {len(new_ids)} new assets")
-                ws.subscribe_to_tokens_ids(new_ids)
-            last_discovery = now
-
-        shutdown_event.wait(timeout=5)
+        # Sleep until the next candle deadline or flush, not on a fixed poll.
+        wake_at = min(aggregator.next_deadline(), last_flush + config.flush_interval_seconds)
+        if horizon < now:
+            wake_at = max(wake_at, time.time() + BACKLOG_POLL_SECONDS)
+        wake_event.wait(timeout=max(0.0, wake_at - time.time()) + BOUNDARY_SLACK_SECONDS)
 
     # Graceful shutdown: final flush
     logger.info("Shutting down...")
+    discovery_worker.stop()
+    discovery.close()
+    pipeline.stop()
+    if recorder is not None:
+        recorder.stop()
+    for compaction in compactions:
+        compaction.stop()
     aggregator.flush_stale_candles()
     completed = aggregator.drain_completed_candles()
     if completed:
         storage.append_candles(completed)
     storage.flush_to_disk()
-    storage.archive()
+    # candles still open are not written; the snapshot carries them into the next run
+    save_state()
+    storage.archive(delta=config.archive_delta)
+    if tape is not None:
+        tape.flush()
+        tape.archive(delta=config.archive_delta)
+    storage.close()
     logger.info("Shutdown complete")
 
 
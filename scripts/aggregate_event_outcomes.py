@@ -14,12 +14,17 @@ from scripts.event_data_utils import load_and_prepare
 def main() -> None:
     parser = argparse.ArgumentParser(description="Aggregate market volume by outcome from data.zip")
     parser.add_argument("--zip-path", default="data.zip", help="Path to zip archive")
+    parser.add_argument(
+        "--resolution",
+        default=None,
+        help="Read a rolled-up dataset instead of the base candles, e.g. 5m or 1h (data_5m.zip)",
+    )
     parser.add_argument("--event-slug", default=None, help="Optional event slug filter")
     parser.add_argument("--top", type=int, default=200, help="Rows to print")
     parser.add_argument("--save-csv", default=None, help="Optional output CSV path")
     args = parser.parse_args()
 
-    df = load_and_prepare(zip_path=args.zip_path, event_slug=args.event_slug)
+    df = load_and_prepare(zip_path=args.zip_path, event_slug=args.event_slug, resolution=args.resolution)
 
     agg = (
         df.groupby(["event_slug", "market", "outcome"], dropna=False)
@@ -0,0 +1,159 @@
+"""Micro-benchmark for WebSocket frame decoding + routing (messages/second).
+
+Compares the previous per-frame implementation (stdlib json, desired-events set and
+nested helper rebuilt per call, duplicated list/dict branches) against
+FrameRouter.handle_frame with every installed decoder. Frames come from a file
+with one raw frame per line (e.g. extracted from a capture) or are synthesised.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.decoding import DECODERS
+from src.ohlcv_aggregator import OHLCVAggregator
+from src.websocket_orderbook import FrameRouter
+
+
+def synth_frames(n: int, n_assets: int = 500, seed: int = 7) -> list[str]:
+    rng = random.Random(seed)
+    assets = [str(rng.getrandbits(250)) for _ in range(n_assets)]
+    frames = []
+    ts = 1_770_000_000_000
+    for _ in range(n):
+        ts += rng.randint(1, 200)
+        kind = rng.random()
+        if kind < 0.55:
+            changes = []
+            for _ in range(rng.randint(1, 6)):
+                bid = rng.randint(1, 98) / 100
+                changes.append({
+                    "asset_id": rng.choice(assets), "price": f"{bid:.2f}", "size": f"{rng.uniform(1, 500):.2f}",
+                    "side": rng.choice(["BUY", "SELL"]), "hash": "0x" + "ab" * 20,
+                    "best_bid": f"{bid:.2f}", "best_ask": f"{bid + 0.01:.2f}",
+                })
+            msg = {"event_type": "price_change", "market": "0x" + "cd" * 32, "timestamp": str(ts),
+                   "price_changes": changes}
+        elif kind < 0.8:
+            bid = rng.randint(1, 98) / 100
+            msg = {"event_type": "best_bid_ask", "asset_id": rng.choice(assets), "market": "0x" + "cd" * 32,
+                   "best_bid": f"{bid:.2f}", "best_ask": f"{bid + 0.01:.2f}", "spread": "0.01", "timestamp": str(ts)}
+        elif kind < 0.95:
+            msg = {"event_type": "last_trade_price", "asset_id": rng.choice(assets), "market": "0x" + "cd" * 32,
+                   "price": f"{rng.randint(1, 99) / 100:.2f}", "size": f"{rng.uniform(1, 500):.2f}",
+                   "side": rng.choice(["BUY", "SELL"]), "fee_rate_bps": "0", "timestamp": str(ts)}
+        else:
+            levels = lambda: [{"price": f"{p / 100:.2f}", "size": f"{rng.uniform(1, 1000):.2f}"}
+                              for p in rng.sample(range(1, 99), 20)]
+            msg = {"event_type": "book", "asset_id": rng.choice(assets), "market": "0x" + "cd" * 32,
+                   "timestamp": str(ts), "hash": "0x" + "ef" * 20, "bids": levels(), "asks": levels()}
+        frames.append(json.dumps([msg] if rng.random() < 0.7 else msg))
+    return frames
+
+
+def legacy_on_message(book: FrameRouter, message: str):
+    """The pre-dispatch-table implementation, kept here as the benchmark baseline."""
+    try:
+        data = json.loads(message)
+        desired_events = {
+            "book", "price_change", "tick_size_change", "last_trade_price", "best_bid_ask", "new_market",
+        }
+
+        def get_event_type(d):
+            return d.get("event") or d.get("event_type")
+
+        if isinstance(data, list):
+            for item in data:
+                event_type = get_event_type(item)
+                if isinstance(item, dict) and event_type in desired_events:
+                    if event_type == "new_market":
+                        if book.new_market_callback:
+                            book.new_market_callback(item)
+                    else:
+                        asset_id = item.get("asset_id")
+                        if asset_id:
+                            book.orderbooks[asset_id] = item
+                        if book.message_callback:
+                            book.message_callback(item)
+        elif isinstance(data, dict):
+            event_type = get_event_type(data)
+            if event_type in desired_events:
+                if event_type == "new_market":
+                    if book.new_market_callback:
+                        book.new_market_callback(data)
+                else:
+                    asset_id = data.get("asset_id")
+                    if asset_id:
+                        book.orderbooks[asset_id] = data
+                    if book.message_callback:
+                        book.message_callback(data)
+    except json.JSONDecodeError:
+        pass
+
+
+def count_messages(frames: list[str]) -> int:
+    total = 0
+    for f in frames:
+        data = json.loads(f)
+        total += len(data) if isinstance(data, list) else 1
+    return total
+
+
+def run(label: str, fn, frames: list[str], n_messages: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            fn(frame)
+        best = min(best, time.perf_counter() - start)
+    rate = n_messages / best
+    print(f"  {label:<28} {rate:>12,.0f} msg/s  ({best * 1000:.1f} ms)")
+    return rate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark WebSocket frame decoding and routing")
+    parser.add_argument("--frames", default=None, help="File with one raw frame per line")
+    parser.add_argument("--synthetic", type=int, default=50_000, help="Synthetic frame count when --frames is not given")
+    parser.add_argument("--repeat", type=int, default=5, help="Take the best of N runs")
+    parser.add_argument("--with-aggregator", action="store_true", help="Feed events into OHLCVAggregator too")
+    args = parser.parse_args()
+
+    if args.frames:
+        frames = [line.rstrip("\n") for line in open(args.frames) if line.strip()]
+    else:
+        frames = synth_frames(args.synthetic)
+    n_messages = count_messages(frames)
+    print(f"{len(frames)} frames, {n_messages} messages, decoders installed: {sorted(DECODERS)}")
+
+    def make_book(decoder=None) -> FrameRouter:
+        agg = OHLCVAggregator(60) if args.with_aggregator else None
+        return FrameRouter(
+            message_callback=agg.on_message if agg else (lambda m: None),
+            verbose=False,
+            batch_callback=agg.on_messages if agg else (lambda b: None),
+            decoder=decoder,
+        )
+
+    legacy_book = make_book("json")
+    legacy_book.orderbooks = {}  # the old code kept the last raw message per asset
+    baseline = run("legacy (json, per-item)", lambda f: legacy_on_message(legacy_book, f), frames, n_messages, args.repeat)
+    for name in ("json", "msgspec", "orjson"):
+        if name not in DECODERS:
+            continue
+        book = make_book(name)
+        rate = run(f"handle_frame ({name})", book.handle_frame, frames, n_messages, args.repeat)
+        print(f"  {'':<28} {rate / baseline:>11.2f}x vs legacy")
+
+
+if __name__ == "__main__":
+    main()
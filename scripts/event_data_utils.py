@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import re
+from pathlib import Path
 from typing import Iterable
 
 import pandas as pd
@@ -11,11 +12,20 @@ from fetch_data import load_zip
 _SUFFIX_RE = r"__(?:yes|no)$"
 
 
+def resolution_zip_path(zip_path: str, resolution: str | None) -> str:
+    """Archive of a rolled-up resolution: ("data.zip", "5m") -> "data_5m.zip"."""
+    if not resolution:
+        return zip_path
+    path = Path(zip_path)
+    return str(path.with_name(f"{path.stem}_{resolution}{path.suffix}"))
+
+
 def load_and_prepare(
     zip_path: str = "data.zip",
     event_slug: str | None = None,
+    resolution: str | None = None,
 ) -> pd.DataFrame:
-    df = load_zip(zip_path).copy()
+    df = load_zip(resolution_zip_path(zip_path, resolution)).copy()
     if event_slug:
         df = df[df["event_slug"] == event_slug].copy()
     return normalize_market_outcomes(df)
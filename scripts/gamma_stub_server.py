@@ -0,0 +1,161 @@
+"""Local stand-in for the Gamma API, for exercising discovery without the network.
+
+Serves the three endpoints MarketDiscovery uses - ``/public-search``,
+``/events?slug=`` and ``/events/<slug or id>`` - from a JSON fixture (a list of Gamma
+event objects; a small built-in sample otherwise). Every response carries an ETag
+and Last-Modified, and conditional requests are answered with 304, so the discovery
+cache can be checked end to end. Point ``gamma_api_url`` in config.yaml at it:
+
+    python scripts/gamma_stub_server.py --port 8765 --events fixtures/events.json
+    gamma_api_url: "http://127.0.0.1:8765"
+
+``--fail-rate`` answers a share of requests with 503 to exercise negative caching.
+The request log on stderr shows which requests were 200s and which 304s.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import random
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+SAMPLE_EVENTS = [
+    {
+        "id": "1001",
+        "slug": "highest-temperature-in-nyc-on-january-1",
+        "title": "Highest temperature in NYC on January 1?",
+        "closed": False,
+        "archived": False,
+        "markets": [
+            {
+                "id": "2001",
+                "slug": "nyc-34-35f",
+                "question": "Will the highest temperature in NYC be 34-35°F on January 1?",
+                "groupItemTitle": "34-35°F",
+                "conditionId": "0xc1",
+                "outcomes": '["Yes", "No"]',
+                "clobTokenIds": '["111", "112"]',
+                "closed": False,
+                "archived": False,
+            },
+            {
+                "id": "2002",
+                "slug": "nyc-36-37f",
+                "question": "Will the highest temperature in NYC be 36-37°F on January 1?",
+                "groupItemTitle": "36-37°F",
+                "conditionId": "0xc2",
+                "outcomes": '["Yes", "No"]',
+                "closed": False,
+                "archived": False,
+            },
+        ],
+    },
+]
+
+
+class GammaStub:
+    def __init__(self, events: list[dict], fail_rate: float = 0.0):
+        self.events = events
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.last_modified = formatdate(time.time(), usegmt=True)
+
+    def _search_view(self, event: dict) -> dict:
+        # like the real endpoint, search results may omit token ids
+        markets = [{k: v for k, v in m.items() if k != "clobTokenIds"} for m in event.get("markets", [])]
+        return dict(event, markets=markets)
+
+    def route(self, path: str, query: dict[str, list[str]]) -> tuple[int, object]:
+        if path == "/public-search":
+            if int(query.get("page", ["1"])[0]) > 1:
+                return 200, {"events": []}
+            words = [w for w in query.get("q", [""])[0].lower().replace("_", " ").replace("-", " ").split() if w]
+            found = [
+                self._search_view(e) for e in self.events
+                if all(w in (e.get("slug", "") + " " + e.get("title", "")).lower() for w in words)
+            ]
+            return 200, {"events": found}
+        if path == "/events":
+            slug = query.get("slug", [""])[0]
+            return 200, [e for e in self.events if e.get("slug") == slug]
+        if path.startswith("/events/"):
+            key = unquote(path[len("/events/"):])
+            for event in self.events:
+                if key in (str(event.get("id")), event.get("slug")):
+                    return 200, event
+        return 404, {"error": "not found"}
+
+
+def make_handler(stub: GammaStub):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            stub.requests += 1
+            if stub.fail_rate and random.random() < stub.fail_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+            parts = urlsplit(self.path)
+            status, payload = stub.route(parts.path, parse_qs(parts.query))
+            body = json.dumps(payload).encode()
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if status == 200 and (
+                self.headers.get("If-None-Match") == etag
+                or (self.headers.get("If-None-Match") is None
+                    and self.headers.get("If-Modified-Since") == stub.last_modified)
+            ):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 200:
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", stub.last_modified)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, events: list[dict] | None = None,
+          fail_rate: float = 0.0) -> ThreadingHTTPServer:
+    """A server bound to ``host:port`` (0 picks a free port); call serve_forever().
+
+    ``server.stub`` is the GammaStub behind it: tests change ``fail_rate`` and read the
+    ``requests`` count through it.
+    """
+    stub = GammaStub(events if events is not None else SAMPLE_EVENTS, fail_rate)
+    server = ThreadingHTTPServer((host, port), make_handler(stub))
+    server.stub = stub
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Gamma API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--events", default=None, help="JSON file with a list of Gamma event objects")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    args = parser.parse_args()
+
+    events = json.loads(Path(args.events).read_text()) if args.events else None
+    server = serve(args.host, args.port, events, args.fail_rate)
+    print(f"Gamma stub listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.storage import LAYOUT_SEGMENTED, ParquetStorage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Rebuild the single-file layout (<event>/<market>.parquet) from segmented storage"
+    )
+    parser.add_argument("--data-dir", default="data", help="Segmented data directory")
+    parser.add_argument("--dest-dir", default="data_single", help="Output directory for single files")
+    args = parser.parse_args()
+
+    storage = ParquetStorage(args.data_dir, layout=LAYOUT_SEGMENTED)
+    written = storage.materialize(args.dest_dir)
+    print(f"Wrote {written} market files to {args.dest_dir}")
+
+
+if __name__ == "__main__":
+    main()
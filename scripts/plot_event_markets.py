@@ -19,6 +19,11 @@ from scripts.event_data_utils import load_and_prepare, pick_plot_frame
 def main() -> None:
     parser = argparse.ArgumentParser(description="Plot event markets with gap-safe lines")
     parser.add_argument("--zip-path", default="data.zip", help="Path to zip archive")
+    parser.add_argument(
+        "--resolution",
+        default=None,
+        help="Read a rolled-up dataset instead of the base candles, e.g. 5m or 1h (data_5m.zip)",
+    )
     parser.add_argument("--event-slug", required=True, help="Event slug to plot")
     parser.add_argument(
         "--prefer-outcome",
@@ -29,7 +34,7 @@ def main() -> None:
     parser.add_argument("--save", default=None, help="Optional output image path")
     args = parser.parse_args()
 
-    df_work = load_and_prepare(zip_path=args.zip_path, event_slug=args.event_slug)
+    df_work = load_and_prepare(zip_path=args.zip_path, event_slug=args.event_slug, resolution=args.resolution)
     plot_df = pick_plot_frame(df_work, prefer_outcome=args.prefer_outcome)
 
     if plot_df.empty:
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Parquet pages are already compressed; deflating them again only burns CPU.
+STORED_SUFFIXES = (".parquet", ".zip", ".arrow", ".gz", ".zst")
+_COPY_CHUNK = 1024 * 1024
+
+
+def _file_sha1(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_COPY_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _compress_type(name: str) -> int:
+    return zipfile.ZIP_STORED if name.endswith(STORED_SUFFIXES) else zipfile.ZIP_DEFLATED
+
+
+class IncrementalArchiver:
+    """Keeps ``data.zip`` (and optional delta bundles) in sync with the data directory.
+
+    Per-file size/mtime/sha1 signatures are persisted next to the archive. A rebuild
+    only reads changed files from disk; unchanged members are streamed from the
+    previous archive without recompression, and when nothing changed the archive is
+    left alone entirely. Any change still rewrites the whole archive into a temp file
+    that replaces it atomically, so the write I/O of ``build`` is the archive size;
+    only the CPU cost is proportional to the changes. Delta bundles
+    (``data-delta-<seq>.zip``) contain only the files whose content changed since the
+    previous delta, plus a ``_delta.json`` member listing removed paths, so copying
+    off the server moves only new bytes.
+    """
+
+    def __init__(self, data_dir: Path, archive_path: str = "data.zip"):
+        self.data_dir = Path(data_dir)
+        self.archive_dest = Path(archive_path)
+        self.state_path = self.archive_dest.with_name(self.archive_dest.name + ".state.json")
+        self._state = self._load_state()
+
+    def _load_state(self) -> dict:
+        if self.state_path.exists():
+            try:
+                with open(self.state_path, "r") as f:
+                    return json.load(f)
+            except Exception:
+                logger.warning(f"Ignoring unreadable archive state {self.state_path}")
+        return {"files": {}, "delta_seq": 0, "delta_files": {}}
+
+    def _save_state(self):
+        fd, tmp_name = tempfile.mkstemp(dir=self.state_path.parent, prefix=".tmp-", suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_name, self.state_path)
+
+    def _member_name(self, path: Path) -> str:
+        return (Path(self.data_dir.name) / path.relative_to(self.data_dir)).as_posix()
+
+    def scan(self) -> dict[str, dict]:
+        """Signature of every file under data_dir, keyed by archive member name.
+
+        sha1 is only recomputed for files whose size or mtime moved.
+        """
+        previous = self._state["files"]
+        current: dict[str, dict] = {}
+        for path in sorted(self.data_dir.rglob("*")):
+            if not path.is_file() or path.name.startswith(".tmp-"):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            name = self._member_name(path)
+            sig = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            old = previous.get(name)
+            if old and old["size"] == sig["size"] and old["mtime_ns"] == sig["mtime_ns"]:
+                sig["sha1"] = old["sha1"]
+            else:
+                try:
+                    sig["sha1"] = _file_sha1(path)
+                except FileNotFoundError:
+                    continue
+            current[name] = sig
+        return current
+
+    def _write_member(self, zf: zipfile.ZipFile, name: str, src, mtime: float):
+        info = zipfile.ZipInfo(name, date_time=time.localtime(max(mtime, 315532800))[:6])
+        info.compress_type = _compress_type(name)
+        info.external_attr = 0o644 << 16
+        with zf.open(info, "w", force_zip64=True) as dst:
+            for chunk in iter(lambda: src.read(_COPY_CHUNK), b""):
+                dst.write(chunk)
+
+    def _build_zip(self, tmp_path: Path, files: dict[str, dict], reuse: dict[str, dict]):
+        """Write ``files`` into ``tmp_path``, streaming unchanged members from the current archive."""
+        old_zf = None
+        if reuse and self.archive_dest.exists():
+            try:
+                old_zf = zipfile.ZipFile(self.archive_dest, "r")
+            except zipfile.BadZipFile:
+                logger.warning(f"Existing archive {self.archive_dest} is unreadable, rebuilding from disk")
+        old_members = {i.filename: i for i in old_zf.infolist()} if old_zf else {}
+
+        written = 0
+        with zipfile.ZipFile(tmp_path, "w", allowZip64=True) as zf:
+            for name, sig in files.items():
+                mtime = sig["mtime_ns"] / 1e9
+                old_info = old_members.get(name)
+                if (
+                    old_info is not None
+                    and reuse.get(name, {}).get("sha1") == sig["sha1"]
+                    and old_info.compress_type == _compress_type(name)
+                ):
+                    with old_zf.open(old_info, "r") as src:
+                        self._write_member(zf, name, src, mtime)
+                    continue
+                path = self.data_dir / Path(name).relative_to(self.data_dir.name)
+                try:
+                    with open(path, "rb") as src:
+                        self._write_member(zf, name, src, mtime)
+                    written += 1
+                except FileNotFoundError:
+                    logger.warning(f"File vanished while archiving: {path}")
+        if old_zf is not None:
+            old_zf.close()
+        return written
+
+    def _rotate_backups(self, created: Path):
+        # Create backups before overwriting, but only if new archive is not smaller in size
+        archive_dest = self.archive_dest
+        if not archive_dest.exists():
+            return
+        new_size = created.stat().st_size
+        old_size = archive_dest.stat().st_size
+        if new_size >= old_size:
+            backup1 = archive_dest.with_name(f"{archive_dest.stem}_backup_1.zip")
+            backup2 = archive_dest.with_name(f"{archive_dest.stem}_backup_2.zip")
+            if backup1.exists():
+                if not backup2.exists() or backup1.stat().st_size > backup2.stat().st_size:
+                    backup1.replace(backup2)  # Move backup1 to backup2 only if larger
+                else:
+                    logger.info("Skipping backup1 to backup2 move: backup1 not larger than backup2")
+            archive_dest.replace(backup1)  # Move current to backup1
+        else:
+            logger.warning(f"New archive ({new_size} bytes) is smaller than existing ({old_size} bytes), skipping backup creation")
+
+    def build(self, files: dict[str, dict] | None = None) -> bool:
+        """Bring the full archive up to date. Returns False when it was already current."""
+        files = self.scan() if files is None else files
+        previous = self._state["files"]
+        changed = [n for n, sig in files.items() if previous.get(n, {}).get("sha1") != sig["sha1"]]
+        removed = [n for n in previous if n not in files]
+        if self.archive_dest.exists() and not changed and not removed:
+            logger.debug("Archive up to date, nothing to do")
+            return False
+
+        fd, tmp_name = tempfile.mkstemp(dir=self.archive_dest.parent, prefix=".tmp-", suffix=".zip")
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        try:
+            written = self._build_zip(tmp_path, files, previous)
+            self._rotate_backups(tmp_path)
+            tmp_path.replace(self.archive_dest)
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        self._state["files"] = files
+        self._save_state()
+
+        size_mb = self.archive_dest.stat().st_size / (1024 * 1024)
+        logger.info(
+            f"Archive updated: {self.archive_dest} ({size_mb:.1f} MB, "
+            f"{written} files read from disk, {len(removed)} removed)"
+        )
+
+        # chmod: rw-r--- (640)
+        self.archive_dest.chmod(0o640)
+        return True
+
+    def build_delta(self, files: dict[str, dict] | None = None) -> Path | None:
+        """Write ``data-delta-<seq>.zip`` with files changed since the last delta watermark."""
+        files = self.scan() if files is None else files
+        watermark = self._state.get("delta_files", {})
+        changed = {n: sig for n, sig in files.items() if watermark.get(n) != sig["sha1"]}
+        removed = sorted(n for n in watermark if n not in files)
+        if not changed and not removed:
+            return None
+
+        seq = self._state.get("delta_seq", 0) + 1
+        dest = self.archive_dest.with_name(f"{self.archive_dest.stem}-delta-{seq:06d}.zip")
+
+        fd, tmp_name = tempfile.mkstemp(dir=dest.parent, prefix=".tmp-", suffix=".zip")
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        try:
+            self._build_zip(tmp_path, changed, {})
+            with zipfile.ZipFile(tmp_path, "a") as zf:
+                zf.writestr(
+                    "_delta.json",
+                    json.dumps({"seq": seq, "created": time.time(), "removed": removed}),
+                    compress_type=zipfile.ZIP_DEFLATED,
+                )
+            tmp_path.replace(dest)
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        self._state["delta_seq"] = seq
+        self._state["delta_files"] = {n: sig["sha1"] for n, sig in files.items()}
+        self._save_state()
+        dest.chmod(0o640)
+        logger.info(f"Delta archive written: {dest} ({len(changed)} changed, {len(removed)} removed)")
+        return dest
@@ -0,0 +1,191 @@
+"""Write-ahead log of completed candles, so buffered candles survive a crash.
+
+ParquetStorage appends every CandleBatch here before buffering it and truncates the
+log once a flush has written the buffer out; on startup whatever the log still holds
+is replayed into the buffer. Flushes can then be hours apart without risking more
+than the candles of the last fsync batch.
+
+The log is a sequence of records::
+
+    <magic "CWL1"> <uint32 payload length> <uint32 crc32 of payload> <payload>
+
+with the payload a whole batch in columns: a string table, int32 codes for asset_id
+and outcome, the market each asset belongs to (so replayed candles of a market that
+was retired meanwhile still land in its files), then the timestamp, trade_count,
+synthetic and FLOAT_FIELDS columns as raw little-endian arrays. A torn or corrupt
+tail (the process died mid-write) ends the replay and is cut off.
+"""
+
+import logging
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from src.market_discovery import MarketInfo
+from src.ohlcv_aggregator import FLOAT_FIELDS, CandleBatch
+
+logger = logging.getLogger(__name__)
+
+RECORD_MAGIC = b"CWL1"
+RECORD_HEADER = struct.Struct("<4sII")
+# candles, strings, market rows
+_COUNTS = struct.Struct("<III")
+_STRING_LENGTH = struct.Struct("<I")
+# string codes per market row: asset_id, event_slug, market_title, event_title, condition_id, outcome_label
+_MARKET_COLUMNS = 6
+
+
+def encode_batch(batch: CandleBatch, market_lookup: dict) -> bytes:
+    """One WAL payload for ``batch``; ``market_lookup`` maps asset_id -> MarketInfo."""
+    strings: dict[str, int] = {}
+
+    def code(value) -> int:
+        value = "" if value is None else str(value)
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    unique_assets, asset_inverse = np.unique(batch.asset_id, return_inverse=True)
+    unique_outcomes, outcome_inverse = np.unique(batch.outcome, return_inverse=True)
+    asset_codes = np.array([code(a) for a in unique_assets.tolist()], dtype=np.int32)[asset_inverse]
+    outcome_codes = np.array([code(o) for o in unique_outcomes.tolist()], dtype=np.int32)[outcome_inverse]
+    markets = []
+    for asset_id in unique_assets.tolist():
+        info = market_lookup.get(asset_id)
+        if info is not None:
+            markets.extend((code(asset_id), code(info.event_slug), code(info.market_title),
+                            code(info.event_title), code(info.condition_id),
+                            code(getattr(info, "outcome_label", ""))))
+
+    n = len(batch)
+    parts = [_COUNTS.pack(n, len(strings), len(markets) // _MARKET_COLUMNS)]
+    for value in strings:
+        data = value.encode()
+        parts.append(_STRING_LENGTH.pack(len(data)))
+        parts.append(data)
+    parts.append(asset_codes.astype("<i4").tobytes())
+    parts.append(outcome_codes.astype("<i4").tobytes())
+    parts.append(np.array(markets, dtype="<i4").tobytes())
+    parts.append(batch.timestamp.astype("<i8").tobytes())
+    parts.append(batch.trade_count.astype("<u4").tobytes())
+    parts.append(batch.synthetic.astype(np.int8).tobytes())
+    for name in FLOAT_FIELDS:
+        parts.append(getattr(batch, name).astype("<f8").tobytes())
+    return b"".join(parts)
+
+
+def decode_batch(payload: bytes) -> tuple[CandleBatch, dict[str, MarketInfo]]:
+    """Inverse of encode_batch: the batch and the markets recorded with it."""
+    n, n_strings, n_markets = _COUNTS.unpack_from(payload, 0)
+    offset = _COUNTS.size
+    strings = []
+    for _ in range(n_strings):
+        (length,) = _STRING_LENGTH.unpack_from(payload, offset)
+        offset += _STRING_LENGTH.size
+        strings.append(payload[offset:offset + length].decode())
+        offset += length
+    table = np.array(strings, dtype=object)
+
+    def column(dtype, count):
+        nonlocal offset
+        values = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+        offset += values.nbytes
+        return values
+
+    asset_id = table[column("<i4", n)] if n else np.empty(0, dtype=object)
+    outcome = table[column("<i4", n)] if n else np.empty(0, dtype=object)
+    market_codes = column("<i4", n_markets * _MARKET_COLUMNS).reshape(-1, _MARKET_COLUMNS)
+    markets = {}
+    for row in market_codes.tolist():
+        asset, event_slug, market_title, event_title, condition_id, outcome_label = (strings[i] for i in row)
+        markets[asset] = MarketInfo(asset, event_slug, market_title, event_title, condition_id, outcome_label)
+    timestamp = column("<i8", n).astype(np.int64)
+    trade_count = column("<u4", n).astype(np.uint32)
+    synthetic = column(np.int8, n).astype(bool)
+    floats = {name: column("<f8", n).astype(np.float64) for name in FLOAT_FIELDS}
+    return CandleBatch(asset_id, outcome, timestamp, trade_count, synthetic, **floats), markets
+
+
+class CandleWAL:
+    """Append-only log file of CandleBatch records.
+
+    ``append`` writes a record through to the OS, which is enough to survive the
+    process dying; ``sync`` (called once per main-loop pass) fsyncs whatever was
+    appended since the last one, so the several logs written in one pass share a
+    single fsync each rather than paying one per batch.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self._file = open(self.path, "ab")
+        self._dirty = False
+        self.records = 0
+
+    def append(self, batch: CandleBatch, market_lookup: dict):
+        if not len(batch):
+            return
+        payload = encode_batch(batch, market_lookup)
+        record = RECORD_HEADER.pack(RECORD_MAGIC, len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            self._file.write(record)
+            self._file.flush()
+            self._dirty = True
+            self.records += 1
+
+    def sync(self):
+        with self.lock:
+            if self._dirty:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    def replay(self) -> tuple[list[CandleBatch], dict[str, MarketInfo]]:
+        """Every intact record in the log, oldest first, with the markets they recorded.
+
+        A torn or corrupt tail is cut off so later appends follow the last good record.
+        """
+        with self.lock:
+            data = self.path.read_bytes() if self.path.exists() else b""
+        batches: list[CandleBatch] = []
+        markets: dict[str, MarketInfo] = {}
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            magic, length, crc = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            payload = data[start:start + length]
+            if magic != RECORD_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            try:
+                batch, batch_markets = decode_batch(payload)
+            except Exception:
+                logger.exception(f"Undecodable record at offset {offset} of {self.path}")
+                break
+            batches.append(batch)
+            markets.update(batch_markets)
+            offset = start + length
+        if offset < len(data):
+            logger.warning(f"Cutting off {len(data) - offset} bytes of torn or corrupt records from {self.path}")
+            with self.lock:
+                self._file.truncate(offset)
+                os.fsync(self._file.fileno())
+        self.records = len(batches)
+        return batches, markets
+
+    def truncate(self):
+        """Empty the log once its candles are on disk."""
+        with self.lock:
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+            self._dirty = False
+            self.records = 0
+
+    def close(self):
+        self.sync()
+        with self.lock:
+            self._file.close()
@@ -0,0 +1,203 @@
+"""Raw WebSocket frame capture, for replaying a session later (see replay.py).
+
+Capture files are gzip streams of length-prefixed records::
+
+    <int64 receive time, ns since epoch> <uint32 length> <frame bytes, UTF-8>
+
+(little endian), rotated by size as ``frames-<UTC time>-<seq>.log.gz``. Alongside them
+``markets-<UTC time>.json`` snapshots of the discovery map let a replay resolve
+events, markets and outcomes without calling Gamma.
+"""
+
+import gzip
+import json
+import logging
+import queue
+import struct
+import threading
+import time
+from dataclasses import asdict, fields
+from pathlib import Path
+from typing import Iterator
+
+from src.market_discovery import MarketInfo
+from src.segments import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct("<qI")
+FRAME_GLOB = "frames-*.log.gz"
+MARKETS_GLOB = "markets-*.json"
+
+
+def _stamp() -> str:
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+
+
+class FrameRecorder:
+    """Writes raw frames to rotating compressed capture files on a background thread.
+
+    ``put`` is called from the WebSocket receive threads and only timestamps the
+    frame and hands it to a queue; compression and file I/O happen on the writer
+    thread, in large sequential writes. The queue holds at most ``maxsize`` frames:
+    when the disk or gzip falls behind, new frames are dropped (and counted) rather
+    than held in memory, so the capture has a hole but the receive threads never block.
+    """
+
+    def __init__(self, directory: str = "captures", rotate_bytes: int = 256 * 1024 * 1024,
+                 compresslevel: int = 1, maxsize: int = 100_000):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.rotate_bytes = rotate_bytes
+        self.compresslevel = compresslevel
+        self.maxsize = maxsize
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._file = None
+        self._file_bytes = 0
+        self._seq = 0
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.max_depth = 0
+        # put runs on every shard's receive thread
+        self._stats_lock = threading.Lock()
+
+    def put(self, frame: str | bytes):
+        try:
+            self._queue.put_nowait((time.time_ns(), frame))
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            with self._stats_lock:
+                self.max_depth = max(self.max_depth, depth)
+
+    def stats(self, reset: bool = False) -> dict:
+        """Queue depth and counters; ``reset`` clears the max_depth watermark."""
+        with self._stats_lock:
+            depth = self._queue.qsize()
+            stats = {
+                "depth": depth,
+                "max_depth": self.max_depth,
+                "frames": self.frames,
+                "bytes": self.bytes,
+                "dropped": self.dropped,
+            }
+            if reset:
+                self.max_depth = depth
+        return stats
+
+    def write_markets(self, markets: dict[str, MarketInfo]):
+        """Snapshot the discovery map so a replay can resolve every captured asset."""
+        payload = {asset_id: asdict(info) for asset_id, info in list(markets.items())}
+        path = self.directory / f"markets-{_stamp()}.json"
+        try:
+            atomic_write_bytes(path, json.dumps(payload).encode())
+        except Exception:
+            logger.exception(f"Error writing market snapshot {path}")
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="frame-capture")
+        self._thread.start()
+        logger.info(f"Capturing raw frames to {self.directory}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self._close_file()
+
+    def _open_file(self):
+        self._seq += 1
+        path = self.directory / f"frames-{_stamp()}-{self._seq:04d}.log.gz"
+        self._file = gzip.open(path, "wb", compresslevel=self.compresslevel)
+        self._file_bytes = 0
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                logger.exception("Error closing capture file")
+            self._file = None
+
+    def _run(self):
+        while not self._stop_event.is_set() or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            records = [first]
+            while len(records) < 10000:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(records)
+            except Exception:
+                logger.exception(f"Error writing {len(records)} captured frames")
+                self._close_file()
+
+    def _write(self, records: list[tuple[int, str | bytes]]):
+        chunks = []
+        for received_ns, frame in records:
+            data = frame.encode() if isinstance(frame, str) else frame
+            chunks.append(RECORD_HEADER.pack(received_ns, len(data)))
+            chunks.append(data)
+        blob = b"".join(chunks)
+        if self._file is None or self._file_bytes >= self.rotate_bytes:
+            self._close_file()
+            self._open_file()
+        self._file.write(blob)
+        self._file_bytes += len(blob)
+        self.frames += len(records)
+        self.bytes += len(blob)
+
+
+def capture_files(source: str | Path) -> list[Path]:
+    """Capture files under a directory (in recording order), or a single file."""
+    source = Path(source)
+    if source.is_dir():
+        return sorted(source.glob(FRAME_GLOB))
+    return [source]
+
+
+def read_frames(source: str | Path) -> Iterator[tuple[float, str]]:
+    """Yield ``(receive time in seconds, frame)`` from capture files in order.
+
+    A file cut short (the process was killed mid-write) ends at its last whole record.
+    """
+    header_size = RECORD_HEADER.size
+    for path in capture_files(source):
+        with gzip.open(path, "rb") as f:
+            try:
+                while True:
+                    header = f.read(header_size)
+                    if len(header) < header_size:
+                        break
+                    received_ns, length = RECORD_HEADER.unpack(header)
+                    data = f.read(length)
+                    if len(data) < length:
+                        break
+                    yield received_ns / 1e9, data.decode()
+            except EOFError:
+                logger.warning(f"Capture file {path} is truncated")
+
+
+def load_markets(directory: str | Path) -> dict[str, MarketInfo]:
+    """Merge every market snapshot in a capture directory (later snapshots win)."""
+    markets: dict[str, MarketInfo] = {}
+    # derived fields (market_slug) are recomputed
+    init_fields = [f.name for f in fields(MarketInfo) if f.init]
+    for path in sorted(Path(directory).glob(MARKETS_GLOB)):
+        with open(path, "r") as f:
+            for asset_id, values in json.load(f).items():
+                markets[asset_id] = MarketInfo(**{name: values[name] for name in init_fields if name in values})
+    return markets
@@ -0,0 +1,132 @@
+import logging
+import math
+import threading
+import time
+
+import pandas as pd
+
+from src.segments import SegmentStore, combine_frames
+
+logger = logging.getLogger(__name__)
+
+
+class CompactionService:
+    """Background merger for segmented market directories.
+
+    Segments are bucketed into size tiers (tier 0 below ``tier_base_bytes``, each
+    further tier ``fan_in`` times larger). Whenever ``fan_in`` adjacent segments share a
+    tier they are merged into one sorted, deduplicated file; shorter same-tier runs are
+    merged once their oldest member is older than ``max_age_seconds`` so quiet
+    markets do not accumulate small files. Sealed stores (resolved markets) are merged
+    into a single file regardless of tiers. Each pass is bounded by
+    ``max_merges_per_pass`` so a large backlog never monopolises the disk.
+    """
+
+    def __init__(
+        self,
+        storage,
+        interval_seconds: float = 300,
+        fan_in: int = 4,
+        max_age_seconds: float = 3600,
+        tier_base_bytes: int = 256 * 1024,
+        max_merges_per_pass: int = 200,
+        row_group_size: int = 16_384,
+    ):
+        self.storage = storage
+        self.interval = interval_seconds
+        self.fan_in = max(2, fan_in)
+        self.max_age = max_age_seconds
+        self.tier_base_bytes = tier_base_bytes
+        self.max_merges_per_pass = max_merges_per_pass
+        self.row_group_size = row_group_size
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="compaction")
+        self._thread.start()
+        logger.info(f"Compaction service started (every {self.interval}s, fan-in {self.fan_in})")
+
+    def stop(self, timeout: float | None = 30):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Compaction pass failed")
+
+    def tier_of(self, size_bytes: int) -> int:
+        if size_bytes < self.tier_base_bytes:
+            return 0
+        return int(math.log(size_bytes / self.tier_base_bytes, self.fan_in)) + 1
+
+    def plan(self, segments: list[dict], now: float | None = None, sealed: bool = False) -> list[dict] | None:
+        """Pick the contiguous run of segments to merge next, or None if nothing is due."""
+        if len(segments) < 2:
+            return None
+        if sealed:
+            return segments
+        now = time.time() if now is None else now
+
+        runs: list[list[dict]] = []
+        for seg in segments:
+            tier = self.tier_of(seg.get("bytes", 0))
+            if runs and self.tier_of(runs[-1][0].get("bytes", 0)) == tier:
+                runs[-1].append(seg)
+            else:
+                runs.append([seg])
+
+        for run in runs:
+            if len(run) >= self.fan_in:
+                return run
+        for run in runs:
+            if len(run) >= 2 and now - min(s.get("created", now) for s in run) >= self.max_age:
+                return run
+        return None
+
+    def compact_store(self, store: SegmentStore, now: float | None = None) -> bool:
+        """Run at most one merge on ``store``. Returns True if segments were replaced."""
+        run = self.plan(store.segments(), now, sealed=store.is_sealed())
+        if not run:
+            return False
+
+        frames = [pd.read_parquet(store.directory / s["file"]) for s in run]
+        merged = combine_frames(frames)
+        size_hint = sum(s.get("bytes", 0) for s in run)
+
+        with self.storage.io_lock:
+            path = store.replace_segments(
+                run, merged, tier=self.tier_of(size_hint), row_group_size=self.row_group_size
+            )
+            if path is None:
+                logger.debug(f"Compaction of {store.directory} skipped: segments changed")
+                return False
+            for s in run:
+                if s["file"] != path.name:
+                    (store.directory / s["file"]).unlink(missing_ok=True)
+
+        logger.info(f"Compacted {len(run)} segments ({len(merged)} rows) -> {path}")
+        return True
+
+    def run_once(self, now: float | None = None) -> int:
+        """One bounded pass over every segmented directory. Returns the number of merges."""
+        merges = 0
+        for store in list(self.storage.iter_segment_stores()):
+            if self._stop_event.is_set() or merges >= self.max_merges_per_pass:
+                break
+            try:
+                while merges < self.max_merges_per_pass and self.compact_store(store, now):
+                    merges += 1
+            except Exception:
+                logger.exception(f"Error compacting {store.directory}")
+        if merges:
+            logger.info(f"Compaction pass complete: {merges} merges")
+        return merges
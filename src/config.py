@@ -7,9 +7,44 @@ from pathlib import Path
 class AppConfig:
     market_queries: list[str]
     candle_interval_seconds: int = 60
+    fill_empty_candles: bool = False
+    allowed_lateness_seconds: float = 2.0
+    trade_tape: bool = False
+    trade_tape_dir: str = "trades"
+    capture_frames: bool = False
+    capture_dir: str = "captures"
+    capture_rotate_mb: int = 256
+    capture_queue_size: int = 100000
+    rollup_intervals: list[int] = field(default_factory=list)
+    warm_restart: bool = False
+    state_dir: str = "state"
     discovery_interval_seconds: int = 300
+    discovery_workers: int = 8
+    discovery_max_per_host: int = 4
+    discovery_cache_path: str | None = "discovery_cache.json"
+    discovery_cache_max_entries: int = 1024
+    discovery_cache_ttl_seconds: float = 3600
+    discovery_cache_negative_ttl_seconds: float = 60
+    gamma_api_url: str = "https://gamma-api.polymarket.com"
     flush_interval_seconds: int = 120
+    candle_wal: bool = False
+    wal_dir: str = "wal"
     data_dir: str = "data"
+    storage_layout: str = "single"
+    compaction_interval_seconds: int = 300
+    compaction_fan_in: int = 4
+    compaction_max_age_seconds: int = 3600
+    archive_delta: bool = False
+    ingest_queue_size: int = 10000
+    ingest_workers: int = 1
+    ingest_overflow: str = "block"
+    json_decoder: str | None = None
+    ws_max_assets_per_connection: int = 500
+    ws_backoff_initial_seconds: float = 1.0
+    ws_backoff_max_seconds: float = 60.0
+    ws_resubscribe_chunk_size: int = 100
+    l2_books: bool = True
+    depth_ticks: int = 5
     log_level: str = "INFO"
     verbose: bool = False
 
@@ -0,0 +1,183 @@
+import logging
+import math
+import threading
+from typing import Callable, Iterable
+
+from src.websocket_orderbook import MARKET_CHANNEL, FrameRouter, WebSocketOrderBook
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedConnectionManager:
+    """Spreads market-channel subscriptions over several WebSocketOrderBook connections.
+
+    Each connection ("shard") holds at most ``max_assets_per_connection`` asset IDs and
+    runs on its own thread, so one slow callback or one reconnect only affects the
+    markets on that shard. Every shard shares the same FrameRouter and hands raw frames
+    to the same ``frame_callback`` (normally ``IngestPipeline.put``).
+
+    New assets go to the least-loaded shard with room, opening a new shard when all
+    are full. Removing assets closes shards that become empty, and when the remaining
+    assets fit on fewer sockets the smallest shard is drained into the others.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        router: FrameRouter,
+        frame_callback: Callable[[str], None] | None = None,
+        max_assets_per_connection: int = 500,
+        verbose: bool = False,
+        gap_callback: Callable[[list], None] | None = None,
+        backoff_initial: float = 1.0,
+        backoff_max: float = 60.0,
+        resubscribe_chunk_size: int = 100,
+    ):
+        if max_assets_per_connection < 1:
+            raise ValueError("max_assets_per_connection must be at least 1")
+        self.url = url
+        self.router = router
+        self.frame_callback = frame_callback
+        self.max_assets = max_assets_per_connection
+        self.verbose = verbose
+        # passed to every shard: each reconnects on its own and reports its own gaps
+        self.shard_options = {
+            "gap_callback": gap_callback,
+            "backoff_initial": backoff_initial,
+            "backoff_max": backoff_max,
+            "resubscribe_chunk_size": resubscribe_chunk_size,
+        }
+        self._shards: dict[int, WebSocketOrderBook] = {}
+        self._threads: dict[int, threading.Thread] = {}
+        self._owner: dict[str, int] = {}
+        self._next_shard = 0
+        self._lock = threading.RLock()
+        self._running = False
+
+    @property
+    def decoder_name(self) -> str:
+        return self.router.decoder_name
+
+    def __len__(self) -> int:
+        return len(self._owner)
+
+    def assets(self) -> list[str]:
+        """Every subscribed asset id."""
+        with self._lock:
+            return list(self._owner)
+
+    def reconnects(self) -> int:
+        with self._lock:
+            return sum(shard.reconnects for shard in self._shards.values())
+
+    def shard_sizes(self) -> dict[int, int]:
+        with self._lock:
+            return {sid: len(shard.data) for sid, shard in self._shards.items()}
+
+    def _open_shard(self, asset_ids: list[str]) -> int:
+        sid = self._next_shard
+        self._next_shard += 1
+        shard = WebSocketOrderBook(
+            channel_type=MARKET_CHANNEL,
+            url=self.url,
+            data=asset_ids,
+            auth=None,
+            message_callback=None,
+            verbose=self.verbose,
+            frame_callback=self.frame_callback,
+            router=self.router,
+            name=f"ws-{sid}",
+            **self.shard_options,
+        )
+        self._shards[sid] = shard
+        for asset_id in asset_ids:
+            self._owner[asset_id] = sid
+        if self._running:
+            self._start_shard(sid)
+        logger.info(f"Opened shard ws-{sid} with {len(asset_ids)} assets ({len(self._shards)} connections)")
+        return sid
+
+    def _start_shard(self, sid: int):
+        thr = threading.Thread(target=self._shards[sid].run, daemon=True, name=f"ws-{sid}")
+        thr.start()
+        self._threads[sid] = thr
+
+    def _close_shard(self, sid: int):
+        shard = self._shards.pop(sid)
+        self._threads.pop(sid, None)
+        shard.stop()
+        logger.info(f"Closed shard ws-{sid} ({len(self._shards)} connections)")
+
+    def subscribe(self, asset_ids: Iterable[str]) -> int:
+        """Subscribe to assets not already held by a shard. Returns how many were added."""
+        with self._lock:
+            pending = [a for a in dict.fromkeys(asset_ids) if a not in self._owner]
+            if not pending:
+                return 0
+            added = len(pending)
+            # Top up existing shards, least loaded first.
+            for sid, shard in sorted(self._shards.items(), key=lambda kv: len(kv[1].data)):
+                room = self.max_assets - len(shard.data)
+                if room <= 0 or not pending:
+                    continue
+                chunk, pending = pending[:room], pending[room:]
+                for asset_id in chunk:
+                    self._owner[asset_id] = sid
+                shard.subscribe_to_tokens_ids(chunk)
+            while pending:
+                chunk, pending = pending[:self.max_assets], pending[self.max_assets:]
+                self._open_shard(chunk)
+            return added
+
+    def unsubscribe(self, asset_ids: Iterable[str]) -> int:
+        """Unsubscribe assets from whichever shard holds them, then rebalance."""
+        with self._lock:
+            by_shard: dict[int, list[str]] = {}
+            for asset_id in dict.fromkeys(asset_ids):
+                sid = self._owner.pop(asset_id, None)
+                if sid is not None:
+                    by_shard.setdefault(sid, []).append(asset_id)
+            for sid, ids in by_shard.items():
+                shard = self._shards[sid]
+                shard.unsubscribe_to_tokens_ids(ids)
+                if not shard.data:
+                    self._close_shard(sid)
+            self.rebalance()
+            return sum(len(ids) for ids in by_shard.values())
+
+    def rebalance(self):
+        """Drain the smallest shard into the others while the assets fit on fewer sockets.
+
+        Assets are unsubscribed from the drained shard before they are subscribed
+        elsewhere, trading a brief gap for never receiving the same trade twice.
+        """
+        with self._lock:
+            while len(self._shards) > max(1, math.ceil(len(self._owner) / self.max_assets)):
+                sid = min(self._shards, key=lambda s: len(self._shards[s].data))
+                moving = list(self._shards[sid].data)
+                free = sum(self.max_assets - len(s.data) for k, s in self._shards.items() if k != sid)
+                if len(moving) > free:
+                    break
+                for asset_id in moving:
+                    del self._owner[asset_id]
+                self._close_shard(sid)
+                logger.info(f"Rebalancing {len(moving)} assets from shard ws-{sid}")
+                self.subscribe(moving)
+
+    def start(self, asset_ids: Iterable[str] = ()):
+        with self._lock:
+            self._running = True
+            self.subscribe(asset_ids)
+            for sid in self._shards:
+                if sid not in self._threads:
+                    self._start_shard(sid)
+        logger.info(
+            f"Connection manager started: {len(self._owner)} assets on {len(self._shards)} connections "
+            f"(max {self.max_assets} per connection)"
+        )
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            for shard in self._shards.values():
+                shard.stop()
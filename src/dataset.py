@@ -0,0 +1,127 @@
+"""Helpers for reading recorder output from data.zip regardless of storage layout."""
+
+import io
+import zipfile
+from pathlib import PurePosixPath
+from typing import Iterator
+
+import pandas as pd
+
+from src.gaps import GAPS_FILE_NAME, read_gaps
+from src.schema import with_reader_columns
+from src.segments import combine_frames, is_segment_file, segment_seq
+
+# market key used for consolidated per-event datasets, which hold every market of the event
+EVENT_DATASET = ""
+
+
+def parse_member(name: str) -> tuple[str, str] | None:
+    """Map an archive member to (event_slug, market), or None if it is not candle data.
+
+    Understands every storage layout:
+      data/<event_slug>/<market>.parquet                  (single file)
+      data/<event_slug>/<market>/part-<seq>.parquet       (segmented)
+      data/<event_slug>/<market>/merged-<a>-<b>.parquet   (segmented, compacted)
+      data/<event_slug>/part-<seq>.parquet                (per-event dataset, market = EVENT_DATASET)
+    """
+    parts = name.replace("\\", "/").split("/")
+    if not parts[-1].endswith(".parquet") or parts[-1].startswith((".", "_")):
+        return None
+    if len(parts) == 3 and is_segment_file(parts[2]):
+        event_slug, market = parts[1], EVENT_DATASET
+    elif len(parts) == 3:
+        event_slug, market = parts[1], PurePosixPath(parts[2]).stem
+    elif len(parts) == 4 and is_segment_file(parts[3]):
+        event_slug, market = parts[1], parts[2]
+    else:
+        return None
+    if event_slug == "unknown":
+        return None
+    return event_slug, market
+
+
+def group_members(names: list[str]) -> dict[tuple[str, str], list[str]]:
+    """Group archive members by (event_slug, market), each list ordered oldest segment first."""
+    groups: dict[tuple[str, str], list[str]] = {}
+    for name in names:
+        key = parse_member(name)
+        if key is not None:
+            groups.setdefault(key, []).append(name)
+    for members in groups.values():
+        members.sort(key=lambda n: segment_seq(n) if is_segment_file(n) else -1)
+    return groups
+
+
+def list_event_slugs(names: list[str]) -> list[str]:
+    return sorted({event for event, _ in group_members(names)})
+
+
+def read_members(
+    zf: zipfile.ZipFile, members: list[str], columns: list[str] | None = None, filters: list | None = None
+) -> pd.DataFrame:
+    """Read and merge the parquet members that make up one market or event dataset.
+
+    ``filters`` is passed to pyarrow, which skips row groups using their min/max statistics.
+    """
+    frames = [pd.read_parquet(io.BytesIO(zf.read(name)), columns=columns, filters=filters) for name in members]
+    if len(frames) == 1:
+        return frames[0]
+    return combine_frames(frames)
+
+
+def count_markets(zf: zipfile.ZipFile, event_slug: str) -> int:
+    """Number of markets stored for an event, reading only market_slug from event datasets."""
+    markets = set()
+    for (event, market), members in group_members(zf.namelist()).items():
+        if event != event_slug:
+            continue
+        if market == EVENT_DATASET:
+            markets.update(read_members(zf, members, columns=["market_slug"])["market_slug"].astype(str))
+        else:
+            markets.add(market)
+    return len(markets)
+
+
+def iter_frames(
+    zf: zipfile.ZipFile, event_slug: str | None = None, markets: list[str] | None = None
+) -> Iterator[pd.DataFrame]:
+    """Yield candle frames with 'event_slug' and 'market' columns, one per stored dataset.
+
+    Frames pass through with_reader_columns, so files written with the compact schema
+    come back with the same columns and dtypes as legacy files.
+
+    A per-event dataset is read with a single member open per segment and yields one
+    frame covering all of its markets; ``markets`` narrows it via row-group pruning.
+    """
+    for (event, market), members in group_members(zf.namelist()).items():
+        if event_slug is not None and event != event_slug:
+            continue
+        if market == EVENT_DATASET:
+            filters = [("market_slug", "in", list(markets))] if markets else None
+            df = read_members(zf, members, filters=filters)
+        elif markets and market not in markets:
+            continue
+        else:
+            df = read_members(zf, members)
+        if market == EVENT_DATASET:
+            market_col = df["market_slug"].astype(str)
+            df = df.drop(columns=["event_slug", "market_slug"], errors="ignore")
+            df["event_slug"] = event
+            df["market"] = market_col
+        else:
+            df["event_slug"] = event
+            df["market"] = market
+        yield with_reader_columns(df)
+
+
+def iter_gaps(zf: zipfile.ZipFile, event_slug: str | None = None) -> Iterator[pd.DataFrame]:
+    """Yield the outage records of each event (``<event>/_gaps.parquet``) with an 'event_slug' column."""
+    for name in zf.namelist():
+        parts = name.replace("\\", "/").split("/")
+        if len(parts) != 3 or parts[2] != GAPS_FILE_NAME:
+            continue
+        if event_slug is not None and parts[1] != event_slug:
+            continue
+        df = read_gaps(io.BytesIO(zf.read(name)))
+        df.insert(0, "event_slug", parts[1])
+        yield df
@@ -0,0 +1,43 @@
+"""Pluggable JSON decoding for WebSocket frames.
+
+Uses orjson when installed, then msgspec, then the stdlib ``json`` module. All three
+return plain dicts/lists, so the rest of the pipeline does not care which one is active.
+"""
+
+import json
+import logging
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+DECODERS: dict[str, Callable[[str | bytes], Any]] = {"json": json.loads}
+DECODE_ERRORS: tuple[type[Exception], ...] = (ValueError,)  # json/orjson errors subclass ValueError
+
+try:
+    import orjson
+
+    DECODERS["orjson"] = orjson.loads
+except ImportError:
+    pass
+
+try:
+    import msgspec
+
+    DECODERS["msgspec"] = msgspec.json.Decoder().decode
+    DECODE_ERRORS = DECODE_ERRORS + (msgspec.DecodeError,)
+except ImportError:
+    pass
+
+PREFERRED_ORDER = ("orjson", "msgspec", "json")
+
+
+def get_decoder(name: str | None = None) -> tuple[str, Callable[[str | bytes], Any]]:
+    """Return (name, decode) for ``name``, or the fastest installed decoder when None."""
+    if name is not None:
+        if name not in DECODERS:
+            raise ValueError(f"JSON decoder '{name}' is not available (installed: {sorted(DECODERS)})")
+        return name, DECODERS[name]
+    for candidate in PREFERRED_ORDER:
+        if candidate in DECODERS:
+            return candidate, DECODERS[candidate]
+    return "json", json.loads
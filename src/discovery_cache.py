@@ -0,0 +1,141 @@
+"""Bounded LRU + TTL cache for Gamma API responses, persisted across restarts.
+
+Entries keep the response validators (ETag / Last-Modified) so an expired entry can
+be revalidated with a conditional request; a 304 then costs one round trip and no
+body. Failed lookups are cached as negative entries with their own, short TTL so a
+transient error is retried soon instead of being remembered.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from src.segments import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class CacheEntry:
+    value: Any
+    stored_at: float
+    etag: str | None = None
+    last_modified: str | None = None
+    negative: bool = False
+
+    @property
+    def revalidatable(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+
+class DiscoveryCache:
+    """Thread-safe LRU of ``key -> CacheEntry``, at most ``max_entries`` long.
+
+    ``get`` reports whether an entry may be used without asking the server: positive
+    entries for ``ttl_seconds`` (or a per-call ttl), negative ones for
+    ``negative_ttl_seconds``. Expired entries without validators are dropped on
+    lookup; expired entries with validators stay for conditional requests. With a
+    ``path`` the cache is loaded on start and written by ``save()`` (JSON, atomic).
+    """
+
+    def __init__(self, path: str | None = None, max_entries: int = 1024, ttl_seconds: float = 3600,
+                 negative_ttl_seconds: float = 60):
+        self.path = Path(path) if path else None
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl_seconds
+        self.negative_ttl = negative_ttl_seconds
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        if self.path is not None:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, entry: CacheEntry, ttl: float | None, now: float) -> bool:
+        limit = self.negative_ttl if entry.negative else (self.ttl if ttl is None else ttl)
+        return now - entry.stored_at >= limit
+
+    def get(self, key: str, ttl: float | None = None) -> tuple[CacheEntry | None, bool]:
+        """``(entry, fresh)``; entry is None when there is nothing usable or revalidatable."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            if not self._expired(entry, ttl, now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, True
+            if entry.negative or not entry.revalidatable:
+                del self._entries[key]
+                self._dirty = True
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            return entry, False
+
+    def set(self, key: str, value: Any, etag: str | None = None, last_modified: str | None = None,
+            negative: bool = False):
+        with self._lock:
+            self._entries[key] = CacheEntry(value, time.time(), etag, last_modified, negative)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def set_negative(self, key: str):
+        self.set(key, None, negative=True)
+
+    def revalidate(self, key: str):
+        """The server answered 304: the entry is fresh again."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.stored_at = time.time()
+                self.revalidated += 1
+                self._dirty = True
+
+    def load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, "r") as f:
+                raw = json.load(f)
+            entries = OrderedDict((key, CacheEntry(**fields)) for key, fields in raw.get("entries", []))
+        except Exception:
+            logger.warning(f"Ignoring unreadable discovery cache {self.path}")
+            return
+        with self._lock:
+            self._entries = entries
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        logger.info(f"Loaded {len(entries)} discovery cache entries from {self.path}")
+
+    def save(self):
+        """Write the cache if it changed since the last save (oldest entry first)."""
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [[key, asdict(entry)] for key, entry in self._entries.items()]
+            self._dirty = False
+        try:
+            atomic_write_bytes(self.path, json.dumps({"entries": entries}).encode())
+        except Exception:
+            logger.exception(f"Error saving discovery cache {self.path}")
+            self._dirty = True
+
+    def stats(self) -> dict:
+        return {"entries": len(self), "hits": self.hits, "revalidated": self.revalidated, "misses": self.misses}
@@ -0,0 +1,82 @@
+import logging
+import threading
+from typing import Callable
+
+from src.market_discovery import MarketDiscovery, MarketInfo
+
+logger = logging.getLogger(__name__)
+
+
+class DiscoveryWorker:
+    """Runs MarketDiscovery passes on a dedicated thread.
+
+    A pass runs every ``interval_seconds`` and whenever ``request()`` is called (e.g. on
+    a ``new_market`` push). Requests made while a pass is running collapse into one
+    follow-up pass, so a burst of pushes never queues up a burst of Gamma searches.
+    New markets are handed to ``on_new_markets`` from this thread; when
+    ``on_closed_markets`` is set, each pass also checks tracked events for markets that
+    closed and hands their asset ids to it.
+    """
+
+    def __init__(
+        self,
+        discovery: MarketDiscovery,
+        queries: list[str],
+        on_new_markets: Callable[[list[MarketInfo]], None],
+        interval_seconds: float = 300,
+        on_closed_markets: Callable[[list[str]], None] | None = None,
+    ):
+        self.discovery = discovery
+        self.queries = queries
+        self.on_new_markets = on_new_markets
+        self.on_closed_markets = on_closed_markets
+        self.interval = interval_seconds
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def request(self, reason: str = ""):
+        if reason:
+            logger.debug(f"Discovery requested: {reason}")
+        self._wake.set()
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="discovery")
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 10):
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def run_once(self) -> list[MarketInfo]:
+        try:
+            new_markets = self.discovery.discover(self.queries)
+        except Exception:
+            logger.exception("Discovery pass failed")
+            return []
+        if new_markets:
+            try:
+                self.on_new_markets(new_markets)
+            except Exception:
+                logger.exception("Error handling newly discovered markets")
+        if self.on_closed_markets is not None:
+            try:
+                closed = self.discovery.find_closed_assets()
+                if closed:
+                    self.on_closed_markets(closed)
+            except Exception:
+                logger.exception("Error checking for closed markets")
+        logger.debug(f"Discovery cache: {self.discovery.cache.stats()}")
+        return new_markets
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(timeout=self.interval)
+            if self._stop_event.is_set():
+                break
+            self._wake.clear()
+            self.run_once()
@@ -0,0 +1,65 @@
+"""Outage ("gap") records: windows during which a WebSocket shard received nothing.
+
+A gap row per asset lets readers tell missing data apart from a quiet market without
+rescanning candle timestamps. Gaps are stored per event in ``_gaps.parquet`` next to the
+candles; the leading underscore keeps candle readers from picking the file up.
+"""
+
+import math
+from dataclasses import dataclass
+
+import pandas as pd
+import pyarrow as pa
+
+GAPS_FILE_NAME = "_gaps.parquet"
+GAP_REASON_DISCONNECT = "disconnect"
+# the recorder was down between a warm-restart snapshot and the next start
+GAP_REASON_RESTART = "restart"
+
+GAP_SCHEMA = pa.schema([
+    pa.field("asset_id", pa.dictionary(pa.int32(), pa.string())),
+    pa.field("market_slug", pa.dictionary(pa.int32(), pa.string())),
+    pa.field("outcome", pa.dictionary(pa.int32(), pa.string())),
+    pa.field("start", pa.int64()),  # last moment data was flowing, Unix seconds UTC (floored)
+    pa.field("end", pa.int64()),  # resubscribed, Unix seconds UTC (ceiled)
+    pa.field("reason", pa.dictionary(pa.int32(), pa.string())),
+    pa.field("connection", pa.dictionary(pa.int32(), pa.string())),
+])
+GAP_KEYS = ["asset_id", "start"]
+GAP_STRING_COLUMNS = ("asset_id", "market_slug", "outcome", "reason", "connection")
+
+
+@dataclass(slots=True)
+class GapRecord:
+    asset_id: str
+    start: float  # Unix seconds
+    end: float
+    reason: str = GAP_REASON_DISCONNECT
+    connection: str = ""
+
+
+def gaps_to_frame(records: list[GapRecord], lookup: dict) -> pd.DataFrame:
+    """Rows for GAP_SCHEMA; ``lookup`` maps asset_id -> MarketInfo for slug and outcome."""
+    rows = []
+    for r in records:
+        info = lookup.get(r.asset_id)
+        rows.append({
+            "asset_id": r.asset_id,
+            "market_slug": info.market_slug if info else r.asset_id[:16],
+            "outcome": (getattr(info, "outcome_label", "") or "") if info else "",
+            "start": int(math.floor(r.start)),
+            "end": int(math.ceil(r.end)),
+            "reason": r.reason,
+            "connection": r.connection,
+        })
+    return pd.DataFrame(rows, columns=GAP_SCHEMA.names)
+
+
+def read_gaps(source) -> pd.DataFrame:
+    """Read a gaps file (path or file-like) with plain string columns."""
+    return pd.read_parquet(source).astype({c: str for c in GAP_STRING_COLUMNS})
+
+
+def to_gap_table(df: pd.DataFrame) -> pa.Table:
+    df = df.astype({c: str for c in GAP_STRING_COLUMNS})
+    return pa.Table.from_pandas(df.reset_index(drop=True), schema=GAP_SCHEMA, preserve_index=False)
@@ -0,0 +1,246 @@
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_COALESCE_BBO = "coalesce_bbo"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE_BBO)
+
+_NON_QUOTE_MARKERS = ('"last_trade_price"', '"book"', '"new_market"', '"market_resolved"')
+_QUOTE_MARKERS = ('"best_bid_ask"', '"price_change"')
+# with L2 books price_change carries level deltas: dropping one corrupts the book
+_L2_NON_QUOTE_MARKERS = _NON_QUOTE_MARKERS + ('"price_change"',)
+_L2_QUOTE_MARKERS = ('"best_bid_ask"',)
+
+
+_ASSET_ID_RE = re.compile(r'"asset_id"\s*:\s*"([^"]*)"')
+
+# queue entry: [received_at, frame, quote key or None, state]
+_QUEUED, _TAKEN, _COALESCED = 0, 1, 2
+
+
+def _is_quote_only(frame: str, l2_books: bool = False) -> bool:
+    """Cheap textual check: the frame only carries top-of-book updates a later frame supersedes."""
+    quote, non_quote = (_L2_QUOTE_MARKERS, _L2_NON_QUOTE_MARKERS) if l2_books else (_QUOTE_MARKERS, _NON_QUOTE_MARKERS)
+    return any(m in frame for m in quote) and not any(m in frame for m in non_quote)
+
+
+def _quote_key(frame: str, l2_books: bool = False) -> frozenset | None:
+    """The assets a quote-only frame quotes, or None when it is not quote-only: a newer
+    quote-only frame with the same key supersedes it."""
+    if not _is_quote_only(frame, l2_books):
+        return None
+    return frozenset(_ASSET_ID_RE.findall(frame)) or None
+
+
+class IngestPipeline:
+    """Bounded queue of raw WebSocket frames between the socket thread and the aggregator.
+
+    The socket callback only enqueues; ``workers`` consumer threads call ``handler`` with
+    each frame. When the queue is full the overflow policy decides what happens:
+
+      block         - the producer waits for room (backpressure onto the socket)
+      drop_oldest   - the oldest queued frame is discarded
+      coalesce_bbo  - the oldest quote-only frame (best_bid_ask / price_change) for
+                      which a newer quote-only frame of the same assets is queued is
+                      discarded; falls back to drop_oldest when no frame is
+                      superseded. With ``l2_books`` price_change frames are book
+                      deltas and never coalesced, only best_bid_ask frames are.
+                      The mid prices of a discarded frame are lost to the candles'
+                      high/low, like any dropped frame
+
+    A per-key index of the latest queued quote makes every overflow O(1): superseded
+    frames are marked coalesced in place and skipped by the workers.
+
+    With more than one worker frames may be applied out of order.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str], None],
+        maxsize: int = 10000,
+        workers: int = 1,
+        overflow: str = OVERFLOW_BLOCK,
+        l2_books: bool = False,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {OVERFLOW_POLICIES}")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = max(1, workers)
+        self.overflow = overflow
+        self.l2_books = l2_books
+        # entries in arrival order, including coalesced ones not yet skipped by a worker
+        self._queue: deque[list] = deque()
+        # queued (not coalesced) entries, and coalesced ones still in _queue
+        self._depth = 0
+        self._tombstones = 0
+        # latest queued entry per quote key, and entries a newer one superseded (oldest first)
+        self._latest_quote: dict[frozenset, list] = {}
+        self._superseded: deque[list] = deque()
+        # receive time of the frame each worker is handling
+        self._in_flight: dict[int, float] = {}
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def put(self, frame: str):
+        """Enqueue a raw frame. Called from the WebSocket receive thread."""
+        key = _quote_key(frame, self.l2_books) if self.overflow == OVERFLOW_COALESCE_BBO else None
+        item = [time.time(), frame, key, _QUEUED]
+        with self._cond:
+            if key is not None:
+                # the frame supersedes the queued one it replaces, so that one can go first
+                previous = self._latest_quote.get(key)
+                if previous is not None:
+                    self._superseded.append(previous)
+                    while self._superseded[0][3] != _QUEUED:
+                        # taken by a worker since it was superseded
+                        self._superseded.popleft()
+                self._latest_quote[key] = item
+            if self._depth >= self.maxsize:
+                if self.overflow == OVERFLOW_BLOCK:
+                    while self._depth >= self.maxsize and not self._stop_event.is_set():
+                        self._cond.wait(timeout=1.0)
+                else:
+                    self._evict_one()
+            self._queue.append(item)
+            self._depth += 1
+            self.enqueued += 1
+            if self._depth > self.max_depth:
+                self.max_depth = self._depth
+            self._cond.notify_all()
+
+    def _evict_one(self):
+        while self._superseded:
+            item = self._superseded.popleft()
+            if item[3] == _QUEUED:
+                item[1] = None  # free the frame now; a worker drops the entry when it gets there
+                item[3] = _COALESCED
+                self._depth -= 1
+                self._tombstones += 1
+                self.coalesced += 1
+                if self._tombstones > self.maxsize:
+                    # stalled workers: compact, amortized O(1) over the evictions since the last one
+                    self._queue = deque(i for i in self._queue if i[3] == _QUEUED)
+                    self._tombstones = 0
+                return
+        item = self._take()
+        self._forget_quote(item)
+        self.dropped += 1
+
+    def _take(self) -> list:
+        """The oldest queued entry (caller holds _cond and knows one exists)."""
+        while True:
+            item = self._queue.popleft()
+            if item[3] == _QUEUED:
+                item[3] = _TAKEN
+                self._depth -= 1
+                return item
+            self._tombstones -= 1
+
+    def _forget_quote(self, item: list):
+        key = item[2]
+        if key is not None and self._latest_quote.get(key) is item:
+            del self._latest_quote[key]
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._depth and not self._stop_event.is_set():
+                    self._cond.wait(timeout=1.0)
+                if not self._depth:
+                    return
+                item = self._take()
+                self._forget_quote(item)
+                received_at, frame = item[0], item[1]
+                self._in_flight[threading.get_ident()] = received_at
+                lag = time.time() - received_at
+                self.last_lag = lag
+                if lag > self.max_lag:
+                    self.max_lag = lag
+                self._cond.notify_all()
+
+            failed = False
+            try:
+                self.handler(frame)
+            except Exception:
+                failed = True
+                logger.exception("Error handling WebSocket frame")
+            with self._cond:
+                del self._in_flight[threading.get_ident()]
+                self.processed += 1
+                if failed:
+                    self.errors += 1
+
+    def start(self):
+        self._stop_event.clear()
+        for i in range(self.workers):
+            thr = threading.Thread(target=self._worker, daemon=True, name=f"ingest-{i}")
+            thr.start()
+            self._threads.append(thr)
+        logger.info(
+            f"Ingest pipeline started ({self.workers} workers, max {self.maxsize} frames, overflow={self.overflow})"
+        )
+
+    def stop(self, timeout: float | None = 10):
+        """Stop the workers after they drain whatever is still queued."""
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thr in self._threads:
+            thr.join(timeout=timeout)
+        self._threads = []
+
+    def received_through(self, now: float | None = None) -> float:
+        """Every frame received before this time has been handled: the receive time of
+        the oldest frame still queued or in a worker, or ``now`` when there is none.
+
+        Candle windows close on this rather than on the wall clock, so a backlog in the
+        queue delays finalization instead of turning the queued ticks into late ones.
+        """
+        now = time.time() if now is None else now
+        with self._cond:
+            oldest = min(self._in_flight.values(), default=now)
+            for item in self._queue:
+                if item[3] == _QUEUED:
+                    oldest = min(oldest, item[0])
+                    break
+        return min(oldest, now)
+
+    def depth(self) -> int:
+        return self._depth
+
+    def stats(self, reset: bool = False) -> dict:
+        """Queue depth, lag and counters; ``reset`` clears the max_* watermarks."""
+        with self._cond:
+            stats = {
+                "depth": self._depth,
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "last_lag_seconds": self.last_lag,
+                "max_lag_seconds": self.max_lag,
+            }
+            if reset:
+                self.max_depth = self._depth
+                self.max_lag = 0.0
+        return stats
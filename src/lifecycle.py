@@ -0,0 +1,114 @@
+import logging
+import threading
+
+from src.connection_manager import ShardedConnectionManager
+from src.market_discovery import MarketDiscovery
+from src.ohlcv_aggregator import OHLCVAggregator
+from src.rollup import MultiResolutionStorage
+
+logger = logging.getLogger(__name__)
+
+
+class MarketLifecycle:
+    """Retires closed/resolved markets so per-asset state does not grow for the life of the process.
+
+    ``retire()`` may be called from any thread (discovery worker, ingest workers on a
+    ``market_resolved`` event); the work happens in ``process()`` on the main loop:
+
+      1. drop the assets from the discovery map (``forget``), which also stops the
+         aggregator from accepting their queued and in-flight frames
+      2. unsubscribe the assets from their WebSocket shard
+      3. finalize their open candles (and rollups), evict them from the aggregator
+         (candles, quotes and books) and flush them to disk
+      4. seal each event whose markets have all been retired
+
+    Storage holds on to the retired assets' MarketInfo (``hold_markets``) until their
+    last candles are flushed, so those still land in the right files. When the flush
+    fails the sealing waits for a later ``process`` call with an empty buffer.
+    """
+
+    def __init__(
+        self,
+        discovery: MarketDiscovery,
+        aggregator: OHLCVAggregator,
+        storage: MultiResolutionStorage,
+        connections: ShardedConnectionManager,
+        wake: threading.Event | None = None,
+    ):
+        self.discovery = discovery
+        self.aggregator = aggregator
+        self.storage = storage
+        self.connections = connections
+        # set when work is queued, so a main loop sleeping until the next candle wakes up
+        self.wake = wake
+        self._pending: dict[str, str] = {}
+        # events whose markets are all retired, sealed once their candles are on disk
+        self._unsealed: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.retired = 0
+
+    def retire(self, asset_ids, reason: str = "closed"):
+        with self._lock:
+            for asset_id in asset_ids:
+                if asset_id in self.discovery.known_assets:
+                    self._pending.setdefault(asset_id, reason)
+        if self._pending and self.wake is not None:
+            self.wake.set()
+
+    def on_resolved(self, msg: dict):
+        """FrameRouter resolved_callback: retire every asset of a market_resolved event."""
+        asset_ids = list(msg.get("assets_ids") or [])
+        if msg.get("asset_id"):
+            asset_ids.append(msg["asset_id"])
+        if asset_ids:
+            self.retire(asset_ids, "resolved")
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def process(self) -> int:
+        """Retire everything queued since the last call. Returns the number of assets retired."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            if self._unsealed and not self.storage.get_buffer_size():
+                self._seal()
+            return 0
+
+        asset_ids = list(pending)
+        dropped = self.discovery.forget(asset_ids)
+        self.storage.hold_markets(dropped)
+        events: dict[str, str] = {}
+        for info in dropped:
+            events.setdefault(info.event_slug, pending[info.asset_id])
+
+        self.connections.unsubscribe(asset_ids)
+        self.aggregator.evict_assets(asset_ids)
+        completed = self.aggregator.drain_completed_candles()
+        if completed:
+            self.storage.append_candles(completed)
+        self.storage.evict_assets(asset_ids)
+        self.storage.flush_to_disk()
+
+        remaining = {info.event_slug for info in list(self.discovery.known_assets.values())}
+        self._unsealed.update((e, reason) for e, reason in events.items() if e not in remaining)
+        if self.storage.get_buffer_size():
+            # the retry of the next flush still resolves their files through hold_markets
+            logger.warning(f"Flush failed, sealing of {len(self._unsealed)} events deferred")
+        else:
+            self._seal()
+
+        self.retired += len(asset_ids)
+        logger.info(
+            f"Retired {len(asset_ids)} assets across {len(events)} events "
+            f"({len(self.discovery.known_assets)} still tracked)"
+        )
+        return len(asset_ids)
+
+    def _seal(self):
+        unsealed, self._unsealed = self._unsealed, {}
+        for event_slug, reason in unsealed.items():
+            try:
+                self.storage.seal_event(event_slug, reason)
+            except Exception:
+                logger.exception(f"Error sealing event {event_slug}")
@@ -2,23 +2,150 @@ import re
 import requests
 import json
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Any
 from datetime import datetime
+from urllib.parse import quote, urlencode, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+from src.discovery_cache import DiscoveryCache
 
 logger = logging.getLogger(__name__)
 
-GAMMA_SEARCH_URL = "https://gamma-api.polymarket.com/public-search"
+GAMMA_API_URL = "https://gamma-api.polymarket.com"
+SEARCH_PAGES = 3
+
 
+_NON_SLUG_RE = re.compile(r"[^a-z0-9-]+")
+_DASHES_RE = re.compile(r"-+")
 
+
+@lru_cache(maxsize=65536)
 def _slugify(text: str) -> str:
     text = (text or "").lower()
-    text = re.sub(r"[^a-z0-9-]+", "-", text)
-    text = re.sub(r"-+", "-", text)
+    text = _NON_SLUG_RE.sub("-", text)
+    text = _DASHES_RE.sub("-", text)
     return text.rstrip("-") or "unknown"
 
 
+def _tokens_in_order(needle_tokens: tuple[str, ...], haystack_tokens: list[str]) -> bool:
+    """Return True when all needle tokens appear in order in the haystack."""
+    if not needle_tokens:
+        return False
+    i = 0
+    for token in haystack_tokens:
+        if token == needle_tokens[i]:
+            i += 1
+            if i == len(needle_tokens):
+                return True
+    return False
+
+
+class QueryMatcher:
+    """Classifies Gamma events against a fixed set of queries in one pass.
+
+    The public-search endpoint is fuzzy and can return loosely related events, so an
+    event is kept for a query only when one of its slug, title, market slug, group
+    title or question, slugified, contains the query slug or contains the query
+    tokens in order (the endpoint inserts words: elon-musk-tweets ->
+    elon-musk-of-tweets). Built once per query set: the query slugs go into an
+    Aho-Corasick automaton and their tokens into an inverted index, so a string is
+    scanned once for all queries. Each distinct string is classified once; events
+    repeating it on later pages and passes cost a cache lookup.
+    """
+
+    def __init__(self, queries: list[str], cache_size: int = 65536):
+        self.queries = list(dict.fromkeys(queries))
+        self._tokens: list[tuple[str, ...]] = []
+        # token -> indices of the queries containing it
+        self._by_token: dict[str, list[int]] = {}
+        # Aho-Corasick automaton over query slugs: transitions, failure links, and
+        # the queries whose slug ends at each node
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[frozenset[int]] = [frozenset()]
+        for index, query in enumerate(self.queries):
+            slug = _slugify(query.replace("_", "-"))
+            tokens = tuple(t for t in slug.split("-") if t)
+            self._tokens.append(tokens)
+            if not tokens:
+                continue
+            for token in set(tokens):
+                self._by_token.setdefault(token, []).append(index)
+            self._add_pattern(slug, index)
+        self._link()
+        self._classify = lru_cache(maxsize=cache_size)(self._classify_string)
+
+    def _add_pattern(self, pattern: str, index: int):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = self._goto[node][ch] = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(frozenset())
+            node = nxt
+        self._out[node] = self._out[node] | {index}
+
+    def _link(self):
+        # breadth first; the root's children fail to the root
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, nxt in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] | self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def _classify_string(self, text: str) -> frozenset[int]:
+        slug = _slugify(text)
+        if slug == "unknown":
+            return frozenset()
+        goto, fail, out = self._goto, self._fail, self._out
+        hits = set()
+        node = 0
+        for ch in slug:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                hits |= out[node]
+
+        tokens = [t for t in slug.split("-") if t]
+        present: dict[int, int] = {}
+        for token in set(tokens):
+            for index in self._by_token.get(token, ()):
+                present[index] = present.get(index, 0) + 1
+        for index, count in present.items():
+            needle = self._tokens[index]
+            if index not in hits and count == len(set(needle)) and _tokens_in_order(needle, tokens):
+                hits.add(index)
+        return frozenset(hits)
+
+    def matches(self, event: dict) -> set[str]:
+        """The queries ``event`` is relevant to."""
+        texts = [event.get("slug") or "", event.get("title") or ""]
+        for m in event.get("markets", []) or []:
+            texts.append(m.get("slug") or "")
+            texts.append(m.get("groupItemTitle") or "")
+            texts.append(m.get("question") or "")
+
+        hits: set[int] = set()
+        for text in texts:
+            hits |= self._classify(text)
+            if len(hits) == len(self.queries):
+                break
+        return {self.queries[i] for i in hits}
+
+
 @dataclass
 class MarketInfo:
     asset_id: str
@@ -33,88 +160,210 @@ class MarketInfo:
         self.market_slug = _slugify(self.market_title)
 
 
-class MarketDiscovery:
-    def __init__(self):
-        self.known_assets: dict[str, MarketInfo] = {}
-        # stores cache_key -> (value, timestamp)
-        self._details_cache: dict[str, Any] = {}
+def pooled_session(pool_size: int) -> requests.Session:
+    """A keep-alive Session whose connection pool fits ``pool_size`` concurrent requests."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-    def _cache_get(self, key: str):
-        return self._details_cache.get(key)
 
-    def _cache_set(self, key: str, value: Any):
-        self._details_cache[key] = value
+class MarketDiscovery:
+    """Finds the markets behind the configured queries on the Gamma API.
+
+    HTTP goes through one pooled keep-alive Session. Queries, their result pages,
+    market detail lookups and event status checks run concurrently on a small thread
+    pool, at most ``max_per_host`` requests in flight per host. Results are merged on
+    the calling thread (the discovery worker), while MarketLifecycle calls ``forget``
+    from the main loop: every change to ``known_assets`` and ``retired_assets`` holds
+    ``assets_lock``. Other threads only look up single assets, or iterate a copy.
+
+    JSON responses go through ``cache`` (a DiscoveryCache, in memory only by default).
+    Search pages and event status lookups are revalidated on every pass with
+    If-None-Match / If-Modified-Since, so unchanged ones come back as bodiless 304s;
+    event details are reused for the cache TTL, and failed detail lookups are retried
+    once the negative TTL has passed.
+    """
+
+    def __init__(self, max_workers: int = 8, max_per_host: int = 4, session: requests.Session | None = None,
+                 cache: DiscoveryCache | None = None, base_url: str = GAMMA_API_URL):
+        self.search_url = f"{base_url.rstrip('/')}/public-search"
+        self.events_url = f"{base_url.rstrip('/')}/events"
+        self.cache = cache if cache is not None else DiscoveryCache()
+        self.session = session if session is not None else pooled_session(max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="gamma")
+        self.max_per_host = max(1, max_per_host)
+        self._host_limits: dict[str, threading.BoundedSemaphore] = {}
+        self._host_lock = threading.Lock()
+        # guards the check-then-insert of discovery against forget() on the main thread
+        self.assets_lock = threading.Lock()
+        self.known_assets: dict[str, MarketInfo] = {}
+        # asset ids whose market closed and was retired; never rediscovered
+        self.retired_assets: set[str] = set()
+        # known asset ids seen closed/archived in search results, until collected
+        self._closed_seen: set[str] = set()
+        self._matcher = QueryMatcher([])
+
+    def _matcher_for(self, queries: list[str]) -> QueryMatcher:
+        """The matcher for ``queries``, rebuilt only when the query set changes."""
+        matcher = self._matcher
+        if matcher.queries != list(dict.fromkeys(queries)):
+            matcher = self._matcher = QueryMatcher(queries)
+        return matcher
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        self.cache.save()
+
+    def _get(self, url: str, params: dict | None = None, timeout: float = 15,
+             headers: dict | None = None) -> requests.Response:
+        """GET through the pooled session, holding the per-host concurrency limit."""
+        host = urlsplit(url).netloc
+        with self._host_lock:
+            limit = self._host_limits.get(host)
+            if limit is None:
+                limit = self._host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+        with limit:
+            return self.session.get(url, params=params, timeout=timeout, headers=headers)
+
+    def _get_json(self, url: str, params: dict | None = None, timeout: float = 15, ttl: float = 0,
+                  negative: bool = False) -> Any:
+        """GET a JSON document through the cache.
+
+        A fresh entry (younger than ``ttl``) is returned without a request; an expired
+        one with validators is revalidated conditionally and reused on a 304, or when
+        the revalidation fails. With ``negative``, a failed request for anything else
+        returns None and is remembered for the cache's negative TTL instead of raising.
+        """
+        key = f"{url}?{urlencode(sorted(params.items()))}" if params else url
+        entry, fresh = self.cache.get(key, ttl)
+        if fresh:
+            return entry.value
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        try:
+            resp = self._get(url, params=params, timeout=timeout, headers=headers or None)
+            if resp.status_code == 304 and entry is not None:
+                self.cache.revalidate(key)
+                return entry.value
+            resp.raise_for_status()
+            value = resp.json()
+        except Exception:
+            if entry is not None:
+                # a failed revalidation must not replace the last good value
+                logger.warning(f"Revalidating {url} failed, serving the cached copy", exc_info=True)
+                return entry.value
+            if not negative:
+                raise
+            self.cache.set_negative(key)
+            return None
+        etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+        # without validators an entry that is stale at once would only take up room
+        if ttl > 0 or etag or last_modified:
+            self.cache.set(key, value, etag, last_modified)
+        return value
 
     def discover(self, queries: list[str]) -> list[MarketInfo]:
+        self._matcher_for(queries)
+        events = self._dedupe_events(self._search_all(queries))
+        self._prefetch_details(events)
+
         new_markets = []
-        for query in queries:
+        for query, event in events:
             try:
-                events = self._search_events(query)
-            except Exception:
-                logger.exception(f"Error searching for query: {query}")
-                continue
-
-            for event in events:
-                try:
-                    # skip events that have no open markets
-                    mkts = event.get("markets", []) or []
-                    if not any(not (m.get("closed") or m.get("archived")) for m in mkts):
-                        continue
+                # skip events that have no open markets
+                mkts = event.get("markets", []) or []
+                if not any(not (m.get("closed") or m.get("archived")) for m in mkts):
+                    continue
 
-                    new_from_event = self._extract_yes_tokens(event)
-                    new_markets.extend(new_from_event)
-                except Exception:
-                    logger.exception(f"Error processing event {event.get('slug')} for query: {query}")
+                new_from_event = self._extract_yes_tokens(event)
+                new_markets.extend(new_from_event)
+            except Exception:
+                logger.exception(f"Error processing event {event.get('slug')} for query: {query}")
+        self.cache.save()
         return new_markets
 
-    def _tokens_in_order(self, needle_tokens: list[str], haystack_tokens: list[str]) -> bool:
-        """Return True when all needle tokens appear in order in the haystack."""
-        if not needle_tokens:
-            return False
-        i = 0
-        for token in haystack_tokens:
-            if token == needle_tokens[i]:
-                i += 1
-                if i == len(needle_tokens):
-                    return True
-        return False
+    def _search_all(self, queries: list[str]) -> dict[str, list[dict]]:
+        """Open matching events per query, every query searched concurrently.
 
-    def _event_matches_query(self, event: dict, query: str) -> bool:
+        Page 1 of all queries is fetched first; for queries without open events on it,
+        the remaining pages are fetched together and the first page with open events
+        wins, as a sequential page walk would have returned.
         """
-        The public-search endpoint is fuzzy and can return loosely related events.
-        Keep only events that are clearly relevant to the configured query.
-        """
-        query_slug = _slugify(query.replace("_", "-"))
-        query_tokens = [t for t in query_slug.split("-") if t]
-        if not query_tokens:
-            return False
-
-        candidates: list[str] = []
-        candidates.append(event.get("slug") or "")
-        candidates.append(event.get("title") or "")
-
-        for m in event.get("markets", []) or []:
-            candidates.append(m.get("slug") or "")
-            candidates.append(m.get("groupItemTitle") or "")
-            candidates.append(m.get("question") or "")
-
-        for candidate in candidates:
-            candidate_slug = _slugify(candidate)
-            if not candidate_slug or candidate_slug == "unknown":
+        first = {query: self._executor.submit(self._search_page, query, 1) for query in queries}
+        found: dict[str, list[dict]] = {}
+        later = {}
+        for query, future in first.items():
+            try:
+                events = future.result()
+            except Exception:
+                logger.exception(f"Error searching for query: {query}")
                 continue
+            if events:
+                found[query] = events
+            else:
+                later[query] = [
+                    self._executor.submit(self._search_page, query, page) for page in range(2, SEARCH_PAGES + 1)
+                ]
+        for query, futures in later.items():
+            for future in futures:
+                try:
+                    events = future.result()
+                except Exception:
+                    logger.exception(f"Error searching for query: {query}")
+                    break
+                if events:
+                    found[query] = events
+                    break
+        # in query order, so the first query returning an event keeps it
+        return {query: found[query] for query in queries if query in found}
+
+    @staticmethod
+    def _dedupe_events(found: dict[str, list[dict]]) -> list[tuple[str, dict]]:
+        """(query, event) pairs with each event once, from the first query that returned it."""
+        seen = set()
+        events = []
+        for query, query_events in found.items():
+            for event in query_events:
+                key = event.get("id") or event.get("slug")
+                if key in seen:
+                    continue
+                seen.add(key)
+                events.append((query, event))
+        return events
+
+    def _prefetch_details(self, events: list[tuple[str, dict]]):
+        """Fetch, concurrently, the details of events with open markets listed without
+        token ids (once per event), so _extract_yes_tokens finds them in the cache."""
+        futures = []
+        for _, event in events:
+            event_key = event.get("id") or event.get("eventId") or event.get("event_id") or event.get("slug", "")
+            for market in event.get("markets", []) or []:
+                if market.get("closed") or market.get("archived") or market.get("clobTokenIds"):
+                    continue
+                title = market.get("groupItemTitle", market.get("question", "Unknown")) or "Unknown"
+                futures.append(self._executor.submit(self._fetch_market_details, event_key, title))
+                break
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                logger.exception("Error prefetching market details")
 
-            # Fast path for exact/substring-style slug matches.
-            if query_slug == candidate_slug or query_slug in candidate_slug:
-                return True
-
-            # Accept close matches where the endpoint inserts words (e.g. elon-musk-tweets -> elon-musk-of-tweets).
-            candidate_tokens = [t for t in candidate_slug.split("-") if t]
-            if self._tokens_in_order(query_tokens, candidate_tokens):
-                return True
-
-        return False
+    def _event_matches_query(self, event: dict, query: str) -> bool:
+        """Keep only events clearly relevant to the configured query (see QueryMatcher)."""
+        matcher = self._matcher
+        if query not in matcher.queries:
+            matcher = QueryMatcher([query])
+        return query in matcher.matches(event)
 
-    def _search_events(self, query: str) -> list[dict]:
+    def _search_page(self, query: str, page: int) -> list[dict]:
         params = {
             "q": query,
             "limit_per_type": 50,
@@ -126,22 +375,13 @@ class MarketDiscovery:
         }
 
         open_events = []
-        for page in range(1, 4):                    # page 1..3
-            p = dict(params, page=page)
-            resp = requests.get(GAMMA_SEARCH_URL, params=p, timeout=15)
-            resp.raise_for_status()
-            events = resp.json().get("events", []) or []
-            for e in events:
-                mkts = e.get("markets", []) or []
-                if any(not (m.get("closed") or m.get("archived")) for m in mkts) and self._event_matches_query(e, query):
-                    open_events.append(e)
-            if open_events:
-                break                              # stop early if we found open events
-
+        events = self._get_json(self.search_url, dict(params, page=page), timeout=15).get("events", []) or []
+        for e in events:
+            mkts = e.get("markets", []) or []
+            if any(not (m.get("closed") or m.get("archived")) for m in mkts) and self._event_matches_query(e, query):
+                open_events.append(e)
         return open_events
 
-
-
     def _load_json_if_str(self, value: Any, name: str = "") -> Any:
         if value is None:
             return []
@@ -182,6 +422,9 @@ class MarketDiscovery:
         for market in mkts_list:
             try:
                 if market.get("closed") or market.get("archived"):
+                    for token_id in self._load_json_if_str(market.get("clobTokenIds"), "clobTokenIds") or []:
+                        if str(token_id).strip() in self.known_assets:
+                            self._closed_seen.add(str(token_id).strip())
                     continue
 
                 # read market fields first
@@ -214,7 +457,11 @@ class MarketDiscovery:
                         outcome = outcomes[i] if i < len(outcomes) else ""
                         outcome_norm = self._normalize_outcome(outcome)
 
-                        if token_id_str and token_id_str not in self.known_assets:
+                        if not token_id_str:
+                            continue
+                        with self.assets_lock:
+                            if token_id_str in self.known_assets or token_id_str in self.retired_assets:
+                                continue
                             info = MarketInfo(
                                 asset_id=token_id_str,
                                 event_slug=event_slug,
@@ -224,8 +471,8 @@ class MarketDiscovery:
                                 outcome_label=outcome_norm,
                             )
                             self.known_assets[token_id_str] = info
-                            new_markets.append(info)
-                            logger.info("Discovered: %s / %s [%s]", event_title, market_title, outcome_norm)
+                        new_markets.append(info)
+                        logger.info("Discovered: %s / %s [%s]", event_title, market_title, outcome_norm)
                     except Exception:
                         logger.exception("Error processing token/outcome for market %s", market.get("id"))
                         continue
@@ -235,6 +482,55 @@ class MarketDiscovery:
 
         return new_markets
 
+    def find_closed_assets(self) -> list[str]:
+        """Known asset ids whose market is closed or archived on Gamma.
+
+        Combines closed markets seen in search results with one event lookup per
+        tracked event (search only returns active events, so an event that closed
+        entirely would otherwise never be reported).
+        """
+        closed = set(self._closed_seen)
+        self._closed_seen.clear()
+
+        by_event: dict[str, list[MarketInfo]] = {}
+        for info in list(self.known_assets.values()):
+            by_event.setdefault(info.event_slug, []).append(info)
+
+        lookups = {
+            event_slug: self._executor.submit(self._get_json, self.events_url, {"slug": event_slug}, 15)
+            for event_slug in by_event
+        }
+        for event_slug, infos in by_event.items():
+            try:
+                events = lookups[event_slug].result() or []
+            except Exception:
+                logger.exception(f"Error checking status of event {event_slug}")
+                continue
+            if not events:
+                continue
+            event = events[0]
+            if event.get("closed") or event.get("archived"):
+                closed.update(i.asset_id for i in infos)
+                continue
+            for market in event.get("markets", []) or []:
+                if market.get("closed") or market.get("archived"):
+                    for token_id in self._load_json_if_str(market.get("clobTokenIds"), "clobTokenIds") or []:
+                        closed.add(str(token_id).strip())
+
+        self.cache.save()
+        return [a for a in closed if a in self.known_assets]
+
+    def forget(self, asset_ids) -> list[MarketInfo]:
+        """Drop retired assets from known_assets; they are not rediscovered afterwards."""
+        dropped = []
+        with self.assets_lock:
+            for asset_id in asset_ids:
+                self.retired_assets.add(asset_id)
+                info = self.known_assets.pop(asset_id, None)
+                if info is not None:
+                    dropped.append(info)
+        return dropped
+
     def get_market_info(self, asset_id: str) -> MarketInfo | None:
         return self.known_assets.get(str(asset_id).strip())
 
@@ -244,17 +540,11 @@ class MarketDiscovery:
         """
         if not event_slug:
             return None
-        market_key = _slugify(market_title) if market_title else ""
-        cache_key = f"{event_slug}::{market_key}"
-        val = self._cache_get(cache_key)
-        if val is not None:
-            return val
 
         try:
-            url = f"https://gamma-api.polymarket.com/events/{event_slug}"
-            resp = requests.get(url, timeout=8)
-            if resp.status_code == 200:
-                data = resp.json()
+            url = f"{self.events_url}/{quote(str(event_slug), safe='')}"
+            data = self._get_json(url, timeout=8, ttl=self.cache.ttl, negative=True)
+            if data:
                 mkts = data.get("markets", []) or []
                 if market_title:
                     mt_lower = market_title.lower()
@@ -267,16 +557,11 @@ class MarketDiscovery:
                             market_title in m_title or
                             m_slug == _slugify(market_title) or
                             _slugify(market_title) in m_slug):
-                            val = m.get("clobTokenIds") or m.get("clob_token_ids") or None
-                            self._cache_set(cache_key, val)
-                            return val
+                            return m.get("clobTokenIds") or m.get("clob_token_ids") or None
                 # fallback: first market
                 if mkts:
-                    val = mkts[0].get("clobTokenIds") or mkts[0].get("clob_token_ids") or None
-                    self._cache_set(cache_key, val)
-                    return val
+                    return mkts[0].get("clobTokenIds") or mkts[0].get("clob_token_ids") or None
         except Exception:
             pass
 
-        self._cache_set(cache_key, None)
         return None
@@ -0,0 +1,88 @@
+"""Shapes of the market-channel messages the recorder consumes.
+
+Decoders return plain dicts; these TypedDicts document the fields each handler reads.
+Numeric fields arrive as strings.
+"""
+
+from typing import TypedDict
+
+
+class OrderLevel(TypedDict, total=False):
+    price: str
+    size: str
+
+
+class BookMessage(TypedDict, total=False):
+    event_type: str  # "book"
+    asset_id: str
+    market: str
+    timestamp: str  # ms
+    hash: str
+    buys: list[OrderLevel]
+    sells: list[OrderLevel]
+    bids: list[OrderLevel]
+    asks: list[OrderLevel]
+
+
+class PriceChange(TypedDict, total=False):
+    asset_id: str
+    price: str
+    size: str
+    side: str  # "BUY" / "SELL"
+    hash: str
+    best_bid: str
+    best_ask: str
+
+
+class PriceChangeMessage(TypedDict, total=False):
+    event_type: str  # "price_change"
+    market: str
+    timestamp: str
+    price_changes: list[PriceChange]
+
+
+class LastTradePriceMessage(TypedDict, total=False):
+    event_type: str  # "last_trade_price"
+    asset_id: str
+    market: str
+    price: str
+    size: str
+    side: str
+    fee_rate_bps: str
+    timestamp: str
+
+
+class BestBidAskMessage(TypedDict, total=False):
+    event_type: str  # "best_bid_ask"
+    asset_id: str
+    market: str
+    best_bid: str
+    best_ask: str
+    spread: str
+    timestamp: str
+
+
+class TickSizeChangeMessage(TypedDict, total=False):
+    event_type: str  # "tick_size_change"
+    asset_id: str
+    market: str
+    old_tick_size: str
+    new_tick_size: str
+    timestamp: str
+
+
+class NewMarketMessage(TypedDict, total=False):
+    event_type: str  # "new_market"
+    asset_id: str
+    token_id: str
+    market: str
+
+
+class MarketResolvedMessage(TypedDict, total=False):
+    event_type: str  # "market_resolved"
+    id: str
+    market: str  # condition id
+    assets_ids: list[str]
+    winning_asset_id: str
+    winning_outcome: str
+    timestamp: str
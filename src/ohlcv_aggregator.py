@@ -1,12 +1,31 @@
+import heapq
+import math
 import time
 import logging
 import threading
+from array import array
 from dataclasses import dataclass
 
+import numpy as np
+
+from src.messages import (
+    BestBidAskMessage, BookMessage, LastTradePriceMessage, PriceChangeMessage, TickSizeChangeMessage,
+)
+from src.order_book import DEPTH_FIELDS, NO_DEPTH, OrderBookEngine, parse_levels
+from src.top_of_book import NAN, TopOfBookStore
+from src.trade_tape import TradeTape
+
 logger = logging.getLogger(__name__)
 
+FLOAT_FIELDS = ("open", "high", "low", "close", "volume", "vwap", "spread", "buy_volume", "sell_volume") + DEPTH_FIELDS
+
+# book operations carried alongside updates, applied in arrival order under the lock
+BOOK_SNAPSHOT = 0
+BOOK_DELTA = 1
+BOOK_TICK = 2
 
-@dataclass
+
+@dataclass(slots=True)
 class OHLCVCandle:
     asset_id: str
     timestamp: int  # Candle open time (Unix seconds, floored to interval)
@@ -21,31 +40,311 @@ class OHLCVCandle:
     sell_volume: float
     outcome: str
     spread: float
+    # L2 depth at candle close (NaN without a book)
+    bid_depth: float = NAN
+    ask_depth: float = NAN
+    depth_imbalance: float = NAN
+    microprice: float = NAN
+    # carry-forward candle for an interval without ticks (fill_empty)
+    synthetic: bool = False
+
+
+class CandleBatch:
+    """Completed candles as parallel columns; ``len(batch)`` candles, no per-candle objects.
+
+    ``asset_id`` and ``outcome`` are object arrays of (shared) strings, ``timestamp`` is
+    int64, ``trade_count`` uint32, ``synthetic`` bool (all False when not given) and
+    every name in FLOAT_FIELDS is a float64 array.
+    """
+
+    __slots__ = ("asset_id", "outcome", "timestamp", "trade_count", "synthetic") + FLOAT_FIELDS
+
+    def __init__(self, asset_id, outcome, timestamp, trade_count, synthetic=None, **floats):
+        self.asset_id = np.asarray(asset_id, dtype=object)
+        self.outcome = np.asarray(outcome, dtype=object)
+        self.timestamp = np.asarray(timestamp, dtype=np.int64)
+        self.trade_count = np.asarray(trade_count, dtype=np.uint32)
+        if synthetic is None:
+            self.synthetic = np.zeros(len(self.timestamp), dtype=bool)
+        else:
+            self.synthetic = np.asarray(synthetic, dtype=bool)
+        for name in FLOAT_FIELDS:
+            setattr(self, name, np.asarray(floats[name], dtype=np.float64))
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def __iter__(self):
+        """Materialise OHLCVCandle objects (for callers that still want them)."""
+        for i in range(len(self)):
+            yield OHLCVCandle(
+                asset_id=self.asset_id[i],
+                timestamp=int(self.timestamp[i]),
+                open=float(self.open[i]),
+                high=float(self.high[i]),
+                low=float(self.low[i]),
+                close=float(self.close[i]),
+                volume=float(self.volume[i]),
+                trade_count=int(self.trade_count[i]),
+                vwap=float(self.vwap[i]),
+                buy_volume=float(self.buy_volume[i]),
+                sell_volume=float(self.sell_volume[i]),
+                outcome=self.outcome[i],
+                spread=float(self.spread[i]),
+                **{name: float(getattr(self, name)[i]) for name in DEPTH_FIELDS},
+                synthetic=bool(self.synthetic[i]),
+            )
+
+    @classmethod
+    def empty(cls) -> "CandleBatch":
+        return cls([], [], [], [], **{name: [] for name in FLOAT_FIELDS})
+
+    @classmethod
+    def from_candles(cls, candles) -> "CandleBatch":
+        candles = list(candles)
+        return cls(
+            [c.asset_id for c in candles],
+            [getattr(c, "outcome", "") for c in candles],
+            [c.timestamp for c in candles],
+            [c.trade_count for c in candles],
+            [getattr(c, "synthetic", False) for c in candles],
+            **{name: [getattr(c, name, NAN) for c in candles] for name in FLOAT_FIELDS},
+        )
+
+    def take(self, index) -> "CandleBatch":
+        """The candles at ``index`` (a boolean mask or integer positions)."""
+        return CandleBatch(
+            self.asset_id[index], self.outcome[index], self.timestamp[index], self.trade_count[index],
+            self.synthetic[index], **{name: getattr(self, name)[index] for name in FLOAT_FIELDS},
+        )
+
+    def latest_per_asset(self) -> "CandleBatch":
+        """The candle with the highest timestamp of each asset (the later one on ties)."""
+        if not len(self):
+            return self
+        order = np.lexsort((np.arange(len(self)), self.timestamp, self.asset_id.astype(str)))
+        ids = self.asset_id[order]
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = ids[1:] != ids[:-1]
+        return self.take(order[last])
+
+    @classmethod
+    def concat(cls, batches: list["CandleBatch"]) -> "CandleBatch":
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        return cls(
+            np.concatenate([b.asset_id for b in batches]),
+            np.concatenate([b.outcome for b in batches]),
+            np.concatenate([b.timestamp for b in batches]),
+            np.concatenate([b.trade_count for b in batches]),
+            np.concatenate([b.synthetic for b in batches]),
+            **{name: np.concatenate([getattr(b, name) for b in batches]) for name in FLOAT_FIELDS},
+        )
+
+
+class CompletedColumns:
+    """Growable typed columns that finalized candles are appended to until drained."""
+
+    def __init__(self):
+        self.slot = array("q")
+        self.outcome: list[str] = []
+        self.timestamp = array("q")
+        self.trade_count = array("q")
+        self.synthetic = array("b")
+        self.floats = {name: array("d") for name in FLOAT_FIELDS}
+
+    def __len__(self) -> int:
+        return len(self.slot)
+
+    def append(self, slot: int, outcome: str, timestamp: int, trade_count: int, values: tuple,
+               synthetic: bool = False):
+        self.slot.append(slot)
+        self.outcome.append(outcome)
+        self.timestamp.append(timestamp)
+        self.trade_count.append(trade_count)
+        self.synthetic.append(synthetic)
+        for col, value in zip(self.floats.values(), values):
+            col.append(value)
+
+    def extend(self, slots: np.ndarray, outcomes: list[str], timestamps: np.ndarray,
+               trade_counts: np.ndarray, floats: dict[str, np.ndarray], synthetic: bool = False):
+        self.slot.frombytes(np.ascontiguousarray(slots, dtype=np.int64).tobytes())
+        self.outcome.extend(outcomes)
+        self.timestamp.frombytes(np.ascontiguousarray(timestamps, dtype=np.int64).tobytes())
+        self.trade_count.frombytes(np.ascontiguousarray(trade_counts, dtype=np.int64).tobytes())
+        self.synthetic.frombytes(np.full(len(slots), synthetic, dtype=np.int8).tobytes())
+        for name, col in self.floats.items():
+            col.frombytes(np.ascontiguousarray(floats[name], dtype=np.float64).tobytes())
+
+    def to_batch(self, asset_ids: np.ndarray) -> CandleBatch:
+        """The completed candles as a CandleBatch, ``asset_ids`` mapping slot -> asset id."""
+        slots = np.frombuffer(self.slot, dtype=np.int64)
+        return CandleBatch(
+            asset_ids[slots],
+            self.outcome,
+            np.frombuffer(self.timestamp, dtype=np.int64),
+            np.frombuffer(self.trade_count, dtype=np.int64),
+            np.frombuffer(self.synthetic, dtype=np.int8),
+            **{name: np.frombuffer(col, dtype=np.float64) for name, col in self.floats.items()},
+        )
 
 
 class OHLCVAggregator:
-    def __init__(self, candle_interval_seconds: int = 60, tracked_assets: dict | None = None, market_lookup: dict | None = None):
+    """Tick-to-candle aggregation over dense per-asset slots and per-window rows.
+
+    Asset IDs are interned to integer slots on first sight. Each open candle (window)
+    is a row in typed ``array`` columns (open/high/low/close/volume/vwap numerator/
+    buy/sell/spread/trade count, start time -1 when free), so a tick is a dict lookup
+    plus a handful of indexed stores and finalization gathers whole batches with
+    NumPy. The latest best bid/ask of every asset is kept in ``quotes`` (a
+    TopOfBookStore).
+
+    Windows close on a watermark rather than on the next tick: an asset may have
+    several open windows, a tick is merged into the window its timestamp falls in
+    (open/close follow timestamps, not arrival order), and a window is finalized once
+    the watermark, ``now - allowed_lateness``, passes its end. Ticks for windows the
+    watermark has already passed are dropped and counted in ``late_ticks``, so every
+    (asset, timestamp) candle is emitted exactly once.
+
+    With ``l2_books`` an incremental L2 book per asset (``books``) is maintained from
+    ``book`` snapshots and ``price_change`` deltas, and every finalized candle carries
+    the depth features (DEPTH_FIELDS) of the book when it is finalized, ``depth_ticks``
+    ticks deep.
+
+    With ``fill_empty`` every asset that has produced a candle gets one for each later
+    interval too: intervals without ticks are filled with a ``synthetic`` carry-forward
+    candle (last close as OHLC and vwap, zero volume, last spread and depth), so every
+    series is dense and aligned on interval boundaries.
+
+    With a ``tape`` every trade print of a tracked asset is also recorded there, after
+    the candle lock is released.
+    """
+
+    def __init__(self, candle_interval_seconds: int = 60, tracked_assets: dict | None = None, market_lookup: dict | None = None,
+                 l2_books: bool = True, depth_ticks: int = 5, fill_empty: bool = False,
+                 allowed_lateness: float = 0.0, tape: TradeTape | None = None):
         self.interval = candle_interval_seconds
         self.tracked_assets = tracked_assets
         self.market_lookup = market_lookup
+        self.allowed_lateness = allowed_lateness
+        self.tape = tape
         self.lock = threading.Lock()
-        self._current_candles: dict[str, dict] = {}
-        self._completed_candles: list[OHLCVCandle] = []
-        self._last_bbo: dict[str, tuple[float, float]] = {}
+        # per asset slot
+        self._slots: dict[str, int] = {}
+        self._asset_ids: list[str] = []
+        # slots of evicted assets: recycled once their completed candles have been drained
+        self._evicted_slots: list[int] = []
+        self._free_slots: list[int] = []
+        self._asset_id_array = np.empty(0, dtype=object)
+        # open windows of each slot: candle start -> row
+        self._windows: list[dict[int, int]] = []
+        # per window row
+        self._free_rows: list[int] = []
+        self._row_slot = array("q")
+        self._outcome: list[str] = []
+        self._start = array("q")
+        self._first_ms = array("q")
+        self._last_ms = array("q")
+        self._open = array("d")
+        self._high = array("d")
+        self._low = array("d")
+        self._close = array("d")
+        self._volume = array("d")
+        self._vwap_num = array("d")
+        self._buy = array("d")
+        self._sell = array("d")
+        self._spread = array("d")
+        self._trades = array("q")
+        self._completed = CompletedColumns()
+        # event-time seconds below which every window is closed; -inf until the first flush
+        self._watermark = -math.inf
+        self.late_ticks = 0
+        # carry-forward state per slot: end of the last candle emitted (real or synthetic,
+        # -1 before the first) and the outcome/close/spread/depth it ended on
+        self.fill_empty = fill_empty
+        self._covered = array("q")
+        self._last_outcome: list[str] = []
+        self._last_close = array("d")
+        self._last_spread = array("d")
+        self._last_depth = {name: array("d") for name in DEPTH_FIELDS}
+        self._filled_until = -1
+        # timer wheel: window deadline (end + allowed_lateness) -> rows that opened a window
+        # due then, plus a heap of the distinct deadlines; entries are validated lazily on expiry
+        self._deadlines: dict[float, list[int]] = {}
+        self._deadline_heap: list[float] = []
+        self.quotes = TopOfBookStore(self._slots, self._asset_ids)
+        self.books = OrderBookEngine(depth_ticks) if l2_books else None
+        self._handlers = {
+            "last_trade_price": self._handle_trade,
+            "best_bid_ask": self._handle_bbo,
+            "price_change": self._handle_price_change,
+            "book": self._handle_book,
+            "tick_size_change": self._handle_tick_size,
+        }
 
     def on_message(self, message: dict):
-        event_type = message.get("event_type") or message.get("event")
-
-        if event_type == "last_trade_price":
-            self._handle_trade(message)
-        elif event_type == "best_bid_ask":
-            self._handle_bbo(message)
-        elif event_type == "price_change":
-            self._handle_price_change(message)
-        elif event_type == "book":
-            self._handle_book(message)
-
-    def _handle_trade(self, msg: dict):
+        self.on_messages([message])
+
+    def on_messages(self, messages: list[dict]):
+        """Apply every update in a WebSocket frame under a single lock acquisition.
+
+        Messages are parsed into plain update tuples first, outside the lock; only the
+        candle/BBO/book mutations run while holding it. Book operations are applied in
+        arrival order, each after the candle update it came with.
+        """
+        updates: list[tuple] = []
+        handlers = self._handlers
+        for message in messages:
+            handler = handlers.get(message.get("event_type") or message.get("event"))
+            if handler is not None:
+                handler(message, updates)
+
+        if not updates:
+            return
+        quotes = []
+        books = self.books
+        tracked = self.tracked_assets
+        tape = self.tape
+        trades = None
+        if tape is not None:
+            trades = [(u[0], u[1], u[2], u[3], u[5]) for u in updates
+                      if u[4] and (tracked is None or u[0] in tracked)]
+        with self.lock:
+            for asset_id, timestamp_ms, price, trade_size, is_trade, side, spread, bbo, book_op in updates:
+                if bbo is not None and (tracked is None or asset_id in tracked):
+                    slot = self._slots.get(asset_id)
+                    if slot is None:
+                        slot = self._intern(asset_id)
+                    quotes.append((slot, timestamp_ms) + bbo)
+                if price is not None:
+                    self._update_candle(asset_id, timestamp_ms, price, trade_size, is_trade, side, spread)
+                if book_op is not None and books is not None and (tracked is None or asset_id in tracked):
+                    self._apply_book_op(books, asset_id, book_op)
+            # under the candle lock, so evict_assets cannot land between the check and the update
+            if quotes:
+                self.quotes.update_many(quotes)
+        if trades:
+            tape.record_many(trades)
+
+    # Each _handle_* parses one message and appends
+    # (asset_id, timestamp_ms, price, trade_size, is_trade, side, spread, bbo, book_op) tuples,
+    # bbo being (bid, ask, bid_size, ask_size) with NaN for sizes the message lacks, price
+    # None for book-only updates and book_op None or a BOOK_* tuple.
+
+    @staticmethod
+    def _apply_book_op(books: OrderBookEngine, asset_id: str, op: tuple):
+        kind = op[0]
+        if kind == BOOK_DELTA:
+            books.apply_delta(asset_id, op[1], op[2], op[3])
+        elif kind == BOOK_SNAPSHOT:
+            books.apply_snapshot(asset_id, op[1], op[2])
+        elif kind == BOOK_TICK:
+            books.set_tick_size(asset_id, op[1])
+
+    def _handle_trade(self, msg: LastTradePriceMessage, updates: list):
         asset_id = msg.get("asset_id")
         if not asset_id:
             return
@@ -57,12 +356,9 @@ class OHLCVAggregator:
         if price <= 0:
             return
 
-        with self.lock:
-            self._update_candle(
-                asset_id, timestamp_ms, price=price, trade_size=size, is_trade=True, side=side
-            )
+        updates.append((asset_id, timestamp_ms, price, size, True, side, 0.0, None, None))
 
-    def _handle_bbo(self, msg: dict):
+    def _handle_bbo(self, msg: BestBidAskMessage, updates: list):
         asset_id = msg.get("asset_id")
         if not asset_id:
             return
@@ -74,11 +370,9 @@ class OHLCVAggregator:
 
         if best_bid > 0 and best_ask > 0:
             mid = (best_bid + best_ask) / 2
-            with self.lock:
-                self._last_bbo[asset_id] = (best_bid, best_ask)
-                self._update_candle(asset_id, timestamp_ms, price=mid, is_trade=False, spread=spread)
+            updates.append((asset_id, timestamp_ms, mid, 0.0, False, "", spread, (best_bid, best_ask, NAN, NAN), None))
 
-    def _handle_price_change(self, msg: dict):
+    def _handle_price_change(self, msg: PriceChangeMessage, updates: list):
         timestamp_ms = int(msg.get("timestamp", time.time() * 1000))
         for change in msg.get("price_changes", []):
             asset_id = change.get("asset_id")
@@ -86,39 +380,95 @@ class OHLCVAggregator:
                 continue
             best_bid = float(change.get("best_bid", 0))
             best_ask = float(change.get("best_ask", 0))
+            price = float(change.get("price", 0))
+            size = float(change.get("size", 0))
+            side = change.get("side", "")
+            book_op = (BOOK_DELTA, side == "BUY", price, size) if side in ("BUY", "SELL") and price > 0 else None
 
             if best_bid > 0 and best_ask > 0:
                 mid = (best_bid + best_ask) / 2
                 spread = best_ask - best_bid
-                with self.lock:
-                    self._last_bbo[asset_id] = (best_bid, best_ask)
-                    self._update_candle(
-                        asset_id, timestamp_ms, price=mid, is_trade=False, spread=spread
-                    )
-
-    def _handle_book(self, msg: dict):
+                # the changed level's size is the top-of-book size when it sits at the best price
+                bid_size = ask_size = NAN
+                if side == "BUY" and price == best_bid:
+                    bid_size = size
+                elif side == "SELL" and price == best_ask:
+                    ask_size = size
+                updates.append((asset_id, timestamp_ms, mid, 0.0, False, "", spread,
+                                (best_bid, best_ask, bid_size, ask_size), book_op))
+            elif book_op is not None:
+                updates.append((asset_id, timestamp_ms, None, 0.0, False, "", 0.0, None, book_op))
+
+    def _handle_book(self, msg: BookMessage, updates: list):
         asset_id = msg.get("asset_id")
         if not asset_id:
             return
 
-        buys = msg.get("buys", [])
-        sells = msg.get("sells", [])
+        buys = msg.get("bids") or msg.get("buys") or []
+        sells = msg.get("asks") or msg.get("sells") or []
         timestamp_ms = int(msg.get("timestamp", time.time() * 1000))
 
-        best_bid = max((float(b.get("price", 0)) for b in buys), default=0)
-        best_ask = min((float(s.get("price", 0)) for s in sells), default=0)
+        best_bid = best_ask = 0.0
+        bid_size = ask_size = NAN
+        book_op = None
+        if self.books is not None:
+            # parse and sort the levels here, outside the lock; applying only swaps them in
+            bids, asks = parse_levels(buys), parse_levels(sells)
+            book_op = (BOOK_SNAPSHOT, bids, asks)
+            if bids[0]:
+                best_bid, bid_size = bids[0][-1], bids[1][-1]
+            if asks[0] and asks[0][0] > 0:
+                best_ask, ask_size = asks[0][0], asks[1][0]
+        else:
+            # empty levels are skipped, as parse_levels drops them
+            for level in buys:
+                price, size = float(level.get("price", 0)), float(level.get("size", 0))
+                if price > best_bid and size > 0:
+                    best_bid, bid_size = price, size
+            for level in sells:
+                price, size = float(level.get("price", 0)), float(level.get("size", 0))
+                if price > 0 and size > 0 and (best_ask == 0 or price < best_ask):
+                    best_ask, ask_size = price, size
 
         if best_bid > 0 and best_ask > 0:
             mid = (best_bid + best_ask) / 2
             spread = best_ask - best_bid
-            with self.lock:
-                self._last_bbo[asset_id] = (best_bid, best_ask)
-                self._update_candle(asset_id, timestamp_ms, price=mid, is_trade=False, spread=spread)
+            updates.append((asset_id, timestamp_ms, mid, 0.0, False, "", spread,
+                            (best_bid, best_ask, bid_size, ask_size), book_op))
+        elif book_op is not None:
+            updates.append((asset_id, timestamp_ms, None, 0.0, False, "", 0.0, None, book_op))
+
+    def _handle_tick_size(self, msg: TickSizeChangeMessage, updates: list):
+        asset_id = msg.get("asset_id")
+        tick_size = float(msg.get("new_tick_size", 0) or 0)
+        if asset_id and tick_size > 0:
+            timestamp_ms = int(msg.get("timestamp", time.time() * 1000))
+            updates.append((asset_id, timestamp_ms, None, 0.0, False, "", 0.0, None, (BOOK_TICK, tick_size)))
 
     def _candle_start_time(self, timestamp_ms: int) -> int:
         ts_seconds = timestamp_ms // 1000
         return (ts_seconds // self.interval) * self.interval
 
+    def _intern(self, asset_id: str) -> int:
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._slots[asset_id] = slot
+            self._asset_ids[slot] = asset_id
+            self._covered[slot] = -1
+            # the cached id array now maps this slot to the evicted asset
+            self._asset_id_array = np.empty(0, dtype=object)
+            return slot
+        slot = len(self._asset_ids)
+        self._slots[asset_id] = slot
+        self._asset_ids.append(asset_id)
+        self._windows.append({})
+        self._covered.append(-1)
+        self._last_outcome.append("")
+        for col in (self._last_close, self._last_spread, *self._last_depth.values()):
+            col.append(0.0)
+        self.quotes.grow()
+        return slot
+
     def _update_candle(
         self,
         asset_id: str,
@@ -133,6 +483,10 @@ class OHLCVAggregator:
             return
 
         candle_start = self._candle_start_time(timestamp_ms)
+        if candle_start + self.interval <= self._watermark:
+            # its window is closed (emitted, or empty and past the watermark)
+            self.late_ticks += 1
+            return
 
         # determine outcome label from market_lookup if available
         outcome_label = ""
@@ -143,92 +497,400 @@ class OHLCVAggregator:
         except Exception:
             outcome_label = ""
 
-        if asset_id in self._current_candles:
-            current = self._current_candles[asset_id]
-            # finalize if timeslot changed or outcome changed
-            if current["start_time"] != candle_start or current.get("outcome", "") != outcome_label:
-                self._finalize_candle(current)
-                self._current_candles[asset_id] = self._new_candle_state(
-                    asset_id, candle_start, price, outcome_label
-                )
-        else:
-            self._current_candles[asset_id] = self._new_candle_state(
-                asset_id, candle_start, price, outcome_label
-            )
-
-        c = self._current_candles[asset_id]
-        c["high"] = max(c["high"], price)
-        c["low"] = min(c["low"], price)
-        c["close"] = price
-        # record the latest spread value for this candle
-        c["spread"] = spread
+        slot = self._slots.get(asset_id)
+        if slot is None:
+            slot = self._intern(asset_id)
+
+        row = self._windows[slot].get(candle_start)
+        if row is None:
+            row = self._open_window(slot, candle_start, timestamp_ms, price)
+        self._outcome[row] = outcome_label
+
+        if price > self._high[row]:
+            self._high[row] = price
+        if price < self._low[row]:
+            self._low[row] = price
+        # a late tick only moves the open/close if it is the earliest/latest so far
+        if timestamp_ms < self._first_ms[row]:
+            self._first_ms[row] = timestamp_ms
+            self._open[row] = price
+        if timestamp_ms >= self._last_ms[row]:
+            self._last_ms[row] = timestamp_ms
+            self._close[row] = price
+            # record the latest spread value for this candle
+            self._spread[row] = spread
 
         if is_trade and trade_size > 0:
-            c["volume"] += trade_size
-            c["trade_count"] += 1
-            c["vwap_numerator"] += price * trade_size
+            self._volume[row] += trade_size
+            self._trades[row] += 1
+            self._vwap_num[row] += price * trade_size
             if side.upper() == "BUY":
-                c["buy_volume"] += trade_size
+                self._buy[row] += trade_size
             elif side.upper() == "SELL":
-                c["sell_volume"] += trade_size
-
-    def _new_candle_state(self, asset_id: str, start_time: int, price: float, outcome: str = "") -> dict:
-        return {
-            "asset_id": asset_id,
-            "start_time": start_time,
-            "open": price,
-            "high": price,
-            "low": price,
-            "close": price,
-            "volume": 0.0,
-            "buy_volume": 0.0,
-            "sell_volume": 0.0,
-            "trade_count": 0,
-            "vwap_numerator": 0.0,
-            "outcome": outcome,
-            "spread": 0.0
-        }
-
-    def _finalize_candle(self, state: dict):
-        vwap = (
-            state["vwap_numerator"] / state["volume"]
-            if state["volume"] > 0
-            else state["close"]
-        )
-
-        candle = OHLCVCandle(
-            asset_id=state["asset_id"],
-            timestamp=state["start_time"],
-            open=state["open"],
-            high=state["high"],
-            low=state["low"],
-            close=state["close"],
-            volume=state["volume"],
-            trade_count=state["trade_count"],
-            vwap=vwap,
-            buy_volume=state["buy_volume"],
-            sell_volume=state["sell_volume"],
-            outcome=state.get("outcome", ""),
-            spread=state["spread"],
+                self._sell[row] += trade_size
+
+    def _schedule(self, row: int, deadline: float):
+        bucket = self._deadlines.get(deadline)
+        if bucket is None:
+            bucket = self._deadlines[deadline] = []
+            heapq.heappush(self._deadline_heap, deadline)
+        bucket.append(row)
+
+    def _open_window(self, slot: int, start_time: int, timestamp_ms: int, price: float) -> int:
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._row_slot)
+            self._row_slot.append(slot)
+            self._outcome.append("")
+            for col in (self._start, self._first_ms, self._last_ms, self._trades):
+                col.append(0)
+            for col in (self._open, self._high, self._low, self._close, self._volume,
+                        self._vwap_num, self._buy, self._sell, self._spread):
+                col.append(0.0)
+        self._schedule(row, start_time + self.interval + self.allowed_lateness)
+        self._windows[slot][start_time] = row
+        self._row_slot[row] = slot
+        self._start[row] = start_time
+        self._first_ms[row] = self._last_ms[row] = timestamp_ms
+        self._open[row] = self._high[row] = self._low[row] = self._close[row] = price
+        self._volume[row] = self._vwap_num[row] = 0.0
+        self._buy[row] = self._sell[row] = 0.0
+        self._spread[row] = 0.0
+        self._trades[row] = 0
+        return row
+
+    def _depth(self, asset_id: str) -> tuple:
+        return self.books.features(asset_id) if self.books is not None else NO_DEPTH
+
+    def _release(self, rows):
+        """Return finalized rows to the free list and record each slot's last candle."""
+        for row in rows:
+            slot = self._row_slot[row]
+            start = self._start[row]
+            del self._windows[slot][start]
+            self._last_outcome[slot] = self._outcome[row]
+            self._start[row] = -1
+            self._free_rows.append(row)
+
+    def _finalize_row(self, row: int):
+        volume = self._volume[row]
+        vwap = self._vwap_num[row] / volume if volume > 0 else self._close[row]
+        slot = self._row_slot[row]
+        depth = self._depth(self._asset_ids[slot])
+        self._completed.append(
+            slot,
+            self._outcome[row],
+            self._start[row],
+            self._trades[row],
+            # same order as FLOAT_FIELDS
+            (self._open[row], self._high[row], self._low[row], self._close[row], volume,
+             vwap, self._spread[row], self._buy[row], self._sell[row]) + depth,
         )
-        self._completed_candles.append(candle)
+        self._covered[slot] = self._start[row] + self.interval
+        self._last_close[slot] = self._close[row]
+        self._last_spread[slot] = self._spread[row]
+        for col, value in zip(self._last_depth.values(), depth):
+            col[slot] = value
         logger.debug(
-            f"Candle finalized: {state['asset_id'][:16]}... @ {state['start_time']}"
+            f"Candle finalized: {self._asset_ids[slot][:16]}... @ {self._start[row]}"
         )
-
-    def flush_stale_candles(self):
-        now_ms = int(time.time() * 1000)
-        current_candle_start = self._candle_start_time(now_ms)
-
+        self._release((row,))
+
+    def _finalize_rows(self, rows: np.ndarray):
+        """Vectorised finalization of every window in ``rows``, oldest window first."""
+        start = np.frombuffer(self._start, dtype=np.int64)
+        rows = rows[np.argsort(start[rows], kind="stable")]
+        slots = np.frombuffer(self._row_slot, dtype=np.int64)[rows]
+        volume = np.frombuffer(self._volume, dtype=np.float64)[rows]
+        close = np.frombuffer(self._close, dtype=np.float64)[rows]
+        vwap_num = np.frombuffer(self._vwap_num, dtype=np.float64)[rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vwap = np.where(volume > 0, vwap_num / np.where(volume > 0, volume, 1.0), close)
+
+        floats = {
+            "open": np.frombuffer(self._open, dtype=np.float64)[rows],
+            "high": np.frombuffer(self._high, dtype=np.float64)[rows],
+            "low": np.frombuffer(self._low, dtype=np.float64)[rows],
+            "close": close,
+            "volume": volume,
+            "vwap": vwap,
+            "spread": np.frombuffer(self._spread, dtype=np.float64)[rows],
+            "buy_volume": np.frombuffer(self._buy, dtype=np.float64)[rows],
+            "sell_volume": np.frombuffer(self._sell, dtype=np.float64)[rows],
+        }
+        ids = self._asset_ids
+        depth = np.array([self._depth(ids[i]) for i in slots.tolist()], dtype=np.float64).reshape(-1, len(DEPTH_FIELDS))
+        for j, name in enumerate(DEPTH_FIELDS):
+            floats[name] = depth[:, j]
+        starts = start[rows]
+        self._completed.extend(
+            slots,
+            [self._outcome[i] for i in rows.tolist()],
+            starts,
+            np.frombuffer(self._trades, dtype=np.int64)[rows],
+            floats,
+        )
+        # windows are finalized in start order, so each slot's last assignment is its newest
+        np.frombuffer(self._covered, dtype=np.int64)[slots] = starts + self.interval
+        np.frombuffer(self._last_close, dtype=np.float64)[slots] = close
+        np.frombuffer(self._last_spread, dtype=np.float64)[slots] = floats["spread"]
+        for name, col in self._last_depth.items():
+            np.frombuffer(col, dtype=np.float64)[slots] = floats[name]
+        del start  # release the buffer export before the arrays can grow again
+        self._release(rows.tolist())
+        logger.debug(f"Finalized {len(rows)} candles")
+
+    def _fill_empty(self, watermark: float) -> int:
+        """Emit synthetic candles for every interval closed by ``watermark`` that a slot has
+        no candle for: from the end of its last candle up to its oldest open window (or the
+        watermark's boundary when idle). Runs once per boundary, over all slots at once."""
+        boundary = int(watermark) // self.interval * self.interval
+        if boundary <= self._filled_until:
+            return 0
+        self._filled_until = boundary
+        covered = np.frombuffer(self._covered, dtype=np.int64)
+        start = np.frombuffer(self._start, dtype=np.int64)
+        until = np.full(len(covered), boundary, dtype=np.int64)
+        open_rows = np.flatnonzero(start >= 0)
+        np.minimum.at(until, np.frombuffer(self._row_slot, dtype=np.int64)[open_rows], start[open_rows])
+        counts = np.where(covered >= 0, (until - covered) // self.interval, 0)
+        slots = np.flatnonzero(counts > 0)
+        total = 0
+        if slots.size:
+            counts = counts[slots]
+            rows = np.repeat(slots, counts)
+            total = len(rows)
+            # k-th missing interval of each slot: covered + k * interval
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            timestamps = covered[rows] + offsets * self.interval
+            close = np.frombuffer(self._last_close, dtype=np.float64)[rows]
+            zeros = np.zeros(total, dtype=np.float64)
+            floats = {
+                "open": close, "high": close, "low": close, "close": close, "vwap": close,
+                "volume": zeros, "buy_volume": zeros, "sell_volume": zeros,
+                "spread": np.frombuffer(self._last_spread, dtype=np.float64)[rows],
+            }
+            for name, col in self._last_depth.items():
+                floats[name] = np.frombuffer(col, dtype=np.float64)[rows]
+            outcome = self._last_outcome
+            self._completed.extend(
+                rows, [outcome[i] for i in rows.tolist()], timestamps,
+                np.zeros(total, dtype=np.int64), floats, synthetic=True,
+            )
+            covered[slots] += counts * self.interval
+        del covered, start  # release the buffer exports before the arrays can grow again
+        return total
+
+    def flush_stale_candles(self, now: float | None = None) -> int:
+        """Advance the watermark to ``now - allowed_lateness`` and finalize exactly the
+        windows it has passed.
+
+        Only the timer-wheel buckets that expired are visited, not every open window.
+        A bucket entry is stale when its row was finalized (and possibly reused for a
+        later window) in the meantime; the row's current start time decides. With
+        ``fill_empty`` the intervals that closed without ticks are then filled in.
+        Returns the number of candles finalized (synthetic ones included).
+        """
+        now = time.time() if now is None else now
         with self.lock:
-            for asset_id in list(self._current_candles.keys()):
-                c = self._current_candles[asset_id]
-                if c["start_time"] < current_candle_start:
-                    self._finalize_candle(c)
-                    del self._current_candles[asset_id]
-
-    def drain_completed_candles(self) -> list[OHLCVCandle]:
+            watermark = self._watermark = max(self._watermark, now - self.allowed_lateness)
+            finalized = 0
+            heap = self._deadline_heap
+            if heap and heap[0] <= now:
+                due: list[int] = []
+                while heap and heap[0] <= now:
+                    due.extend(self._deadlines.pop(heapq.heappop(heap)))
+                rows = np.unique(np.array(due, dtype=np.int64))
+                start = np.frombuffer(self._start, dtype=np.int64)
+                starts = start[rows]
+                del start  # release the buffer export before the arrays can grow again
+                rows = rows[(starts >= 0) & (starts + self.interval <= watermark)]
+                if rows.size:
+                    self._finalize_rows(rows)
+                finalized = int(rows.size)
+            if self.fill_empty:
+                finalized += self._fill_empty(watermark)
+            return finalized
+
+    def next_deadline(self, now: float | None = None) -> float:
+        """When flush_stale_candles next has work: the earliest window deadline, but no
+        later than the next interval boundary plus the allowed lateness (a tick may open
+        a window due then)."""
+        now = time.time() if now is None else now
+        lateness = self.allowed_lateness
+        boundary = (int(now - lateness) // self.interval + 1) * self.interval + lateness
+        with self.lock:
+            if self._deadline_heap:
+                return min(self._deadline_heap[0], boundary)
+        return boundary
+
+    def evict_assets(self, asset_ids) -> int:
+        """Finalize every open window of ``asset_ids`` and drop their per-asset state.
+
+        The finalized candles come out of the next drain_completed_candles(); the slots
+        are reused only after that drain, so queued candles keep their asset id.
+        Returns the number of assets evicted.
+        """
+        asset_ids = list(asset_ids)
+        evicted = 0
+        with self.lock:
+            for asset_id in asset_ids:
+                slot = self._slots.pop(asset_id, None)
+                if slot is None:
+                    continue
+                for _, row in sorted(self._windows[slot].items()):
+                    self._finalize_row(row)
+                self._covered[slot] = -1
+                self.quotes.clear(slot)
+                self._evicted_slots.append(slot)
+                evicted += 1
+            if self.books is not None:
+                self.books.evict(asset_ids)
+        return evicted
+
+    def export_state(self) -> dict:
+        """Open windows and per-asset carry-forward state as NumPy columns (copies), for
+        a warm-restart snapshot: ``windows`` (one row per open candle), ``slots`` (one
+        row per tracked asset), plus the ``watermark`` and ``filled_until`` scalars."""
+        with self.lock:
+            start = np.frombuffer(self._start, dtype=np.int64)
+            rows = np.flatnonzero(start >= 0)
+            row_slot = np.frombuffer(self._row_slot, dtype=np.int64)[rows]
+            ids = self._asset_ids
+            windows = {
+                "asset_id": np.array([ids[s] for s in row_slot.tolist()], dtype=object),
+                "outcome": np.array([self._outcome[r] for r in rows.tolist()], dtype=object),
+                "start": start[rows],
+            }
+            for name, col in (("first_ms", self._first_ms), ("last_ms", self._last_ms),
+                              ("trade_count", self._trades)):
+                windows[name] = np.frombuffer(col, dtype=np.int64)[rows]
+            for name, col in (("open", self._open), ("high", self._high), ("low", self._low),
+                              ("close", self._close), ("volume", self._volume), ("vwap_num", self._vwap_num),
+                              ("buy_volume", self._buy), ("sell_volume", self._sell), ("spread", self._spread)):
+                windows[name] = np.frombuffer(col, dtype=np.float64)[rows]
+
+            live = np.array(sorted(self._slots.values()), dtype=np.int64)
+            slots = {
+                "asset_id": np.array([ids[s] for s in live.tolist()], dtype=object),
+                "last_outcome": np.array([self._last_outcome[s] for s in live.tolist()], dtype=object),
+                "covered": np.frombuffer(self._covered, dtype=np.int64)[live],
+                "last_close": np.frombuffer(self._last_close, dtype=np.float64)[live],
+                "last_spread": np.frombuffer(self._last_spread, dtype=np.float64)[live],
+            }
+            for name, col in self._last_depth.items():
+                slots[f"last_{name}"] = np.frombuffer(col, dtype=np.float64)[live]
+            del start  # release the buffer export before the arrays can grow again
+            watermark = self._watermark
+            filled_until = self._filled_until
+        return {"windows": windows, "slots": slots, "watermark": watermark, "filled_until": filled_until}
+
+    def restore_state(self, windows: dict, slots: dict, watermark: float = -math.inf, filled_until: int = -1,
+                      emitted: CandleBatch | None = None) -> int:
+        """Reload columns written by export_state (after a restart).
+
+        Assets no longer tracked are skipped. Restored windows are scheduled as usual,
+        so those whose deadline passed while the recorder was down are finalized by the
+        next flush_stale_candles. ``emitted`` holds candles finalized after the snapshot
+        was taken (replayed from the candle WAL): windows they already cover are not
+        reopened, and each asset carries forward from its latest one. Returns the
+        number of windows restored.
+        """
+        # latest emitted candle per asset: its timestamp and row
+        latest: dict[str, tuple[int, int]] = {}
+        if emitted is not None:
+            for i, (asset_id, timestamp) in enumerate(zip(emitted.asset_id.tolist(), emitted.timestamp.tolist())):
+                if asset_id not in latest or timestamp >= latest[asset_id][0]:
+                    latest[asset_id] = (timestamp, i)
+        restored = 0
+        with self.lock:
+            self._watermark = max(self._watermark, watermark)
+            self._filled_until = max(self._filled_until, filled_until)
+            tracked = self.tracked_assets
+            for i, asset_id in enumerate(slots["asset_id"]):
+                if tracked is not None and asset_id not in tracked:
+                    continue
+                slot = self._slots.get(asset_id)
+                if slot is None:
+                    slot = self._intern(asset_id)
+                self._covered[slot] = int(slots["covered"][i])
+                self._last_outcome[slot] = slots["last_outcome"][i]
+                self._last_close[slot] = float(slots["last_close"][i])
+                self._last_spread[slot] = float(slots["last_spread"][i])
+                for name, col in self._last_depth.items():
+                    col[slot] = float(slots[f"last_{name}"][i])
+
+            if latest:
+                # every emitted candle had closed under the watermark of its time
+                self._watermark = max(self._watermark, max(t for t, _ in latest.values()) + self.interval)
+            for asset_id, (timestamp, i) in latest.items():
+                if tracked is not None and asset_id not in tracked:
+                    continue
+                slot = self._slots.get(asset_id)
+                if slot is None:
+                    slot = self._intern(asset_id)
+                if timestamp + self.interval <= self._covered[slot]:
+                    continue
+                self._covered[slot] = timestamp + self.interval
+                self._last_outcome[slot] = emitted.outcome[i]
+                self._last_close[slot] = float(emitted.close[i])
+                self._last_spread[slot] = float(emitted.spread[i])
+                for name, col in self._last_depth.items():
+                    col[slot] = float(getattr(emitted, name)[i])
+
+            for i, asset_id in enumerate(windows["asset_id"]):
+                if tracked is not None and asset_id not in tracked:
+                    continue
+                start_time = int(windows["start"][i])
+                if asset_id in latest and start_time <= latest[asset_id][0]:
+                    # finalized after the snapshot; the candle is already in the WAL
+                    continue
+                slot = self._slots.get(asset_id)
+                if slot is None:
+                    slot = self._intern(asset_id)
+                if start_time in self._windows[slot]:
+                    continue
+                row = self._open_window(slot, start_time, int(windows["first_ms"][i]), float(windows["open"][i]))
+                self._outcome[row] = windows["outcome"][i]
+                self._last_ms[row] = int(windows["last_ms"][i])
+                self._trades[row] = int(windows["trade_count"][i])
+                self._high[row] = float(windows["high"][i])
+                self._low[row] = float(windows["low"][i])
+                self._close[row] = float(windows["close"][i])
+                self._volume[row] = float(windows["volume"][i])
+                self._vwap_num[row] = float(windows["vwap_num"][i])
+                self._buy[row] = float(windows["buy_volume"][i])
+                self._sell[row] = float(windows["sell_volume"][i])
+                self._spread[row] = float(windows["spread"][i])
+                restored += 1
+        return restored
+
+    def restore_quotes(self, quotes: list[tuple]):
+        """Load ``(asset_id, updated_ms, bid, ask, bid_size, ask_size)`` rows (from a
+        snapshot) into ``quotes``; assets no longer tracked are skipped."""
+        tracked = self.tracked_assets
+        with self.lock:
+            rows = []
+            for asset_id, *quote in quotes:
+                if tracked is not None and asset_id not in tracked:
+                    continue
+                slot = self._slots.get(asset_id)
+                if slot is None:
+                    slot = self._intern(asset_id)
+                rows.append((slot, *quote))
+            self.quotes.update_many(rows)
+
+    def drain_completed_candles(self) -> CandleBatch:
         with self.lock:
-            candles = self._completed_candles
-            self._completed_candles = []
-            return candles
+            done = self._completed
+            self._free_slots.extend(self._evicted_slots)
+            self._evicted_slots.clear()
+            if not len(done):
+                return CandleBatch.empty()
+            self._completed = CompletedColumns()
+            if len(self._asset_id_array) != len(self._asset_ids):
+                self._asset_id_array = np.array(self._asset_ids, dtype=object)
+            asset_id_array = self._asset_id_array
+
+        return done.to_batch(asset_id_array)
@@ -0,0 +1,128 @@
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+
+NAN = math.nan
+DEFAULT_TICK_SIZE = 0.01
+
+# Per-candle depth features, in the order depth_features() returns them.
+DEPTH_FIELDS = ("bid_depth", "ask_depth", "depth_imbalance", "microprice")
+NO_DEPTH = (NAN, NAN, NAN, NAN)
+
+
+def parse_levels(levels) -> tuple[array, array]:
+    """Sorted (ascending) price and size arrays from ``[{"price", "size"}, ...]``, empty levels dropped.
+
+    Called while parsing a ``book`` message, outside the aggregator lock, so applying
+    the snapshot only swaps the arrays in.
+    """
+    pairs = sorted(
+        (float(level.get("price", 0)), float(level.get("size", 0))) for level in levels or ()
+    )
+    prices, sizes = array("d"), array("d")
+    for price, size in pairs:
+        if size > 0:
+            prices.append(price)
+            sizes.append(size)
+    return prices, sizes
+
+
+class L2Book:
+    """Price levels of one asset, each side as ascending parallel ``array('d')`` columns.
+
+    Levels are located with bisect, so a delta is an O(log n) search plus one
+    contiguous insert/delete; best bid is the last bid level, best ask the first ask.
+    """
+
+    __slots__ = ("bid_prices", "bid_sizes", "ask_prices", "ask_sizes", "tick_size")
+
+    def __init__(self, tick_size: float = DEFAULT_TICK_SIZE):
+        self.bid_prices, self.bid_sizes = array("d"), array("d")
+        self.ask_prices, self.ask_sizes = array("d"), array("d")
+        self.tick_size = tick_size
+
+    def apply_snapshot(self, bids: tuple[array, array], asks: tuple[array, array]):
+        """Replace both sides with ``(prices, sizes)`` arrays from parse_levels (taken over, not copied)."""
+        self.bid_prices, self.bid_sizes = bids
+        self.ask_prices, self.ask_sizes = asks
+
+    def apply_delta(self, is_bid: bool, price: float, size: float):
+        """Set the aggregate size at ``price``; a size of 0 removes the level."""
+        prices, sizes = (self.bid_prices, self.bid_sizes) if is_bid else (self.ask_prices, self.ask_sizes)
+        i = bisect_left(prices, price)
+        if i < len(prices) and prices[i] == price:
+            if size > 0:
+                sizes[i] = size
+            else:
+                del prices[i]
+                del sizes[i]
+        elif size > 0:
+            prices.insert(i, price)
+            sizes.insert(i, size)
+
+    def depth_features(self, n_ticks: int) -> tuple[float, float, float, float]:
+        """(bid_depth, ask_depth, depth_imbalance, microprice) for the current book.
+
+        Depth sums the size resting within ``n_ticks`` ticks of the best price on each
+        side (best level included). Imbalance is (bid - ask) / (bid + ask) depth, in
+        [-1, 1]. Microprice weights best bid and ask by the opposite top-level size.
+        NaN where a side is empty.
+        """
+        if not self.bid_prices or not self.ask_prices:
+            return NO_DEPTH
+        best_bid, best_ask = self.bid_prices[-1], self.ask_prices[0]
+        reach = n_ticks * self.tick_size + 1e-9
+        lo = bisect_left(self.bid_prices, best_bid - reach)
+        hi = bisect_right(self.ask_prices, best_ask + reach)
+        bid_depth = math.fsum(self.bid_sizes[lo:])
+        ask_depth = math.fsum(self.ask_sizes[:hi])
+        total = bid_depth + ask_depth
+        imbalance = (bid_depth - ask_depth) / total if total > 0 else NAN
+        bid_top, ask_top = self.bid_sizes[-1], self.ask_sizes[0]
+        microprice = (best_bid * ask_top + best_ask * bid_top) / (bid_top + ask_top)
+        return bid_depth, ask_depth, imbalance, microprice
+
+
+class OrderBookEngine:
+    """Incremental L2 books for every asset: snapshots from ``book``, deltas from ``price_change``.
+
+    Not thread-safe on its own; OHLCVAggregator applies book operations under its lock
+    in the same order as the candle updates they arrived with.
+    """
+
+    def __init__(self, depth_ticks: int = 5, default_tick_size: float = DEFAULT_TICK_SIZE):
+        self.depth_ticks = depth_ticks
+        self.default_tick_size = default_tick_size
+        self._books: dict[str, L2Book] = {}
+
+    def __len__(self) -> int:
+        return len(self._books)
+
+    def _book(self, asset_id: str) -> L2Book:
+        book = self._books.get(asset_id)
+        if book is None:
+            book = self._books[asset_id] = L2Book(self.default_tick_size)
+        return book
+
+    def get(self, asset_id: str) -> L2Book | None:
+        return self._books.get(asset_id)
+
+    def apply_snapshot(self, asset_id: str, bids: tuple[array, array], asks: tuple[array, array]):
+        self._book(asset_id).apply_snapshot(bids, asks)
+
+    def apply_delta(self, asset_id: str, is_bid: bool, price: float, size: float):
+        self._book(asset_id).apply_delta(is_bid, price, size)
+
+    def set_tick_size(self, asset_id: str, tick_size: float):
+        if tick_size > 0:
+            self._book(asset_id).tick_size = tick_size
+
+    def features(self, asset_id: str) -> tuple[float, float, float, float]:
+        book = self._books.get(asset_id)
+        if book is None:
+            return NO_DEPTH
+        return book.depth_features(self.depth_ticks)
+
+    def evict(self, asset_ids):
+        for asset_id in asset_ids:
+            self._books.pop(asset_id, None)
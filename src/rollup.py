@@ -0,0 +1,390 @@
+import logging
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+from src.ohlcv_aggregator import CandleBatch, CompletedColumns
+from src.order_book import DEPTH_FIELDS
+from src.storage import ParquetStorage
+
+logger = logging.getLogger(__name__)
+
+_LABEL_UNITS = ((86400, "d"), (3600, "h"), (60, "m"), (1, "s"))
+
+
+def interval_label(seconds: int) -> str:
+    """60 -> '1m', 900 -> '15m', 3600 -> '1h', 86400 -> '1d'."""
+    for unit, suffix in _LABEL_UNITS:
+        if seconds % unit == 0:
+            return f"{seconds // unit}{suffix}"
+    return f"{seconds}s"
+
+
+def rollup_data_dir(data_dir: str, interval: int) -> str:
+    """Dataset directory of a rollup resolution: data -> data_5m, data_1h, ..."""
+    return f"{data_dir}_{interval_label(interval)}"
+
+
+def rollup_archive_path(archive_path: str, interval: int) -> str:
+    """data.zip -> data_5m.zip"""
+    path = Path(archive_path)
+    return str(path.with_name(f"{path.stem}_{interval_label(interval)}{path.suffix}"))
+
+
+# columns of CandleRollup.export_state
+_STATE_COLUMNS = (
+    "interval", "asset_id", "outcome", "start", "trade_count", "synthetic",
+    "open", "high", "low", "close", "volume", "vwap_num", "spread", "buy_volume", "sell_volume",
+) + tuple(f"last_{name}" for name in DEPTH_FIELDS)
+
+
+class _Resolution:
+    """Open rollup candle per slot for one interval, in typed arrays like the aggregator."""
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self.start = array("q")
+        self.outcome: list[str] = []
+        self.trades = array("q")
+        # 1 while every base candle folded in so far was synthetic
+        self.synthetic = array("b")
+        self.open = array("d")
+        self.high = array("d")
+        self.low = array("d")
+        self.close = array("d")
+        self.volume = array("d")
+        self.vwap_num = array("d")
+        self.spread = array("d")
+        self.buy = array("d")
+        self.sell = array("d")
+        self.depth = {name: array("d") for name in DEPTH_FIELDS}
+        self.completed = CompletedColumns()
+
+    def grow(self):
+        self.start.append(-1)
+        self.outcome.append("")
+        self.trades.append(0)
+        self.synthetic.append(0)
+        for col in (self.open, self.high, self.low, self.close, self.volume, self.vwap_num,
+                    self.spread, self.buy, self.sell, *self.depth.values()):
+            col.append(0.0)
+
+    def float_columns(self) -> dict[str, array]:
+        """The float state columns by their snapshot name."""
+        return {
+            "open": self.open, "high": self.high, "low": self.low, "close": self.close,
+            "volume": self.volume, "vwap_num": self.vwap_num, "spread": self.spread,
+            "buy_volume": self.buy, "sell_volume": self.sell,
+            **{f"last_{name}": col for name, col in self.depth.items()},
+        }
+
+    def add(self, slot: int, timestamp: int, outcome: str, row: tuple):
+        o, h, l, c, v, vwap, spread, buy, sell, trades, depth, synthetic = row
+        bucket = timestamp - timestamp % self.interval
+        if self.start[slot] != bucket or self.outcome[slot] != outcome:
+            if self.start[slot] >= 0:
+                self.finalize(slot)
+            self.start[slot] = bucket
+            self.outcome[slot] = outcome
+            self.open[slot], self.high[slot], self.low[slot] = o, h, l
+            self.volume[slot] = self.vwap_num[slot] = self.buy[slot] = self.sell[slot] = 0.0
+            self.trades[slot] = 0
+            self.synthetic[slot] = synthetic
+        else:
+            if not synthetic:
+                self.synthetic[slot] = 0
+            if h > self.high[slot]:
+                self.high[slot] = h
+            if l < self.low[slot]:
+                self.low[slot] = l
+        self.close[slot] = c
+        self.volume[slot] += v
+        self.vwap_num[slot] += vwap * v
+        self.buy[slot] += buy
+        self.sell[slot] += sell
+        self.trades[slot] += trades
+        # spread and depth describe the book at close: the latest base candle wins
+        self.spread[slot] = spread
+        for col, value in zip(self.depth.values(), depth):
+            col[slot] = value
+
+    def finalize(self, slot: int):
+        volume = self.volume[slot]
+        vwap = self.vwap_num[slot] / volume if volume > 0 else self.close[slot]
+        self.completed.append(
+            slot,
+            self.outcome[slot],
+            self.start[slot],
+            self.trades[slot],
+            # same order as FLOAT_FIELDS
+            (self.open[slot], self.high[slot], self.low[slot], self.close[slot], volume, vwap,
+             self.spread[slot], self.buy[slot], self.sell[slot])
+            + tuple(col[slot] for col in self.depth.values()),
+            synthetic=bool(self.synthetic[slot]),
+        )
+        self.start[slot] = -1
+
+    def finalize_due(self, now: float) -> int:
+        start = np.frombuffer(self.start, dtype=np.int64)
+        slots = np.flatnonzero((start >= 0) & (start + self.interval <= now))
+        del start  # release the buffer export before the arrays can grow again
+        for slot in slots.tolist():
+            self.finalize(slot)
+        return int(slots.size)
+
+
+class CandleRollup:
+    """Coarser candles (e.g. 5m, 15m, 1h, 1d) built from finalized base candles.
+
+    Each base candle is folded into the open candle of every resolution in one pass:
+    first open, max high, min low, last close, summed volumes and trade counts,
+    volume-weighted vwap, and spread/depth from the latest base candle; a rollup candle
+    is ``synthetic`` only when all its base candles were. Ticks are
+    never re-processed. A rollup candle is emitted by ``flush(now)`` once its interval
+    has ended (after ``delay`` seconds, to let late base candles in), or when a base
+    candle for a later interval arrives.
+    """
+
+    def __init__(self, base_interval: int, intervals: list[int], delay: float = 0.0):
+        for interval in intervals:
+            if interval <= base_interval or interval % base_interval:
+                raise ValueError(
+                    f"Rollup interval {interval}s must be a larger multiple of the {base_interval}s base interval"
+                )
+        self.base_interval = base_interval
+        self.intervals = sorted(set(intervals))
+        self.delay = delay
+        self._resolutions = [_Resolution(i) for i in self.intervals]
+        self._slots: dict[str, int] = {}
+        self._asset_ids: list[str] = []
+        self._evicted_slots: list[int] = []
+        self._free_slots: list[int] = []
+
+    def _intern(self, asset_id: str) -> int:
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._asset_ids[slot] = asset_id
+        else:
+            slot = len(self._asset_ids)
+            self._asset_ids.append(asset_id)
+            for res in self._resolutions:
+                res.grow()
+        self._slots[asset_id] = slot
+        return slot
+
+    def add(self, batch: CandleBatch):
+        """Fold finalized base candles (in finalization order) into every resolution."""
+        self._fold(batch)
+
+    def _fold(self, batch: CandleBatch, finished: dict[tuple[int, str], int] | None = None):
+        # ``finished`` maps (interval, asset_id) to its latest rollup candle already emitted:
+        # base candles of that candle or an earlier one are not folded in again
+        if not len(batch) or not self._resolutions:
+            return
+        cols = [getattr(batch, name).tolist() for name in
+                ("open", "high", "low", "close", "volume", "vwap", "spread", "buy_volume", "sell_volume")]
+        depth = list(zip(*(getattr(batch, name).tolist() for name in DEPTH_FIELDS)))
+        trades = batch.trade_count.tolist()
+        timestamps = batch.timestamp.tolist()
+        synthetic = batch.synthetic.tolist()
+        slots = self._slots
+        for i, asset_id in enumerate(batch.asset_id.tolist()):
+            slot = slots.get(asset_id)
+            if slot is None:
+                slot = self._intern(asset_id)
+            row = tuple(col[i] for col in cols) + (trades[i], depth[i], synthetic[i])
+            outcome = batch.outcome[i]
+            timestamp = timestamps[i]
+            for res in self._resolutions:
+                if finished is None or timestamp - timestamp % res.interval > finished.get((res.interval, asset_id), -1):
+                    res.add(slot, timestamp, outcome, row)
+
+    def flush(self, now: float) -> int:
+        """Finalize every rollup candle whose interval ended at least ``delay`` seconds ago."""
+        return sum(res.finalize_due(now - self.delay) for res in self._resolutions)
+
+    def evict(self, asset_ids) -> int:
+        """Finalize the open rollup candles of retired assets and drop their slots."""
+        evicted = 0
+        for asset_id in asset_ids:
+            slot = self._slots.pop(asset_id, None)
+            if slot is None:
+                continue
+            for res in self._resolutions:
+                if res.start[slot] >= 0:
+                    res.finalize(slot)
+            self._evicted_slots.append(slot)
+            evicted += 1
+        return evicted
+
+    def export_state(self) -> dict[str, np.ndarray]:
+        """Every open rollup candle as NumPy columns, one row per (interval, asset), for a
+        warm-restart snapshot."""
+        rows = {name: [] for name in _STATE_COLUMNS}
+        for res in self._resolutions:
+            start = np.frombuffer(res.start, dtype=np.int64)
+            live = [s for s in np.flatnonzero(start >= 0).tolist() if self._asset_ids[s] in self._slots]
+            del start  # release the buffer export before the arrays can grow again
+            for slot in live:
+                rows["interval"].append(res.interval)
+                rows["asset_id"].append(self._asset_ids[slot])
+                rows["outcome"].append(res.outcome[slot])
+                rows["start"].append(res.start[slot])
+                rows["trade_count"].append(res.trades[slot])
+                rows["synthetic"].append(res.synthetic[slot])
+                for name, col in res.float_columns().items():
+                    rows[name].append(col[slot])
+        out = {}
+        for name, values in rows.items():
+            if name in ("asset_id", "outcome"):
+                out[name] = np.array(values, dtype=object)
+            elif name in ("interval", "start", "trade_count", "synthetic"):
+                out[name] = np.array(values, dtype=np.int64)
+            else:
+                out[name] = np.array(values, dtype=np.float64)
+        return out
+
+    def restore_state(self, columns: dict, base: CandleBatch | None = None,
+                      finished: dict[int, CandleBatch] | None = None) -> int:
+        """Reload the open rollup candles written by export_state (after a restart).
+
+        ``base`` are base candles finalized after the snapshot (recovered from the candle
+        WAL) and ``finished`` the rollup candles finalized after it, per interval. Open
+        candles that were finished meanwhile are dropped, and the base candles are folded
+        in again wherever their rollup candle is not finished yet. Rows for intervals
+        no longer configured are ignored. Returns the number of open candles restored.
+        """
+        by_interval = {res.interval: res for res in self._resolutions}
+        # latest finished rollup candle per (interval, asset)
+        done: dict[tuple[int, str], int] = {}
+        for interval, batch in (finished or {}).items():
+            for asset_id, timestamp in zip(batch.asset_id.tolist(), batch.timestamp.tolist()):
+                key = (interval, asset_id)
+                done[key] = max(done.get(key, timestamp), timestamp)
+
+        restored = 0
+        for i, (interval, asset_id) in enumerate(zip(columns["interval"].tolist(), columns["asset_id"].tolist())):
+            res = by_interval.get(interval)
+            start = int(columns["start"][i])
+            if res is None or start <= done.get((interval, asset_id), -1):
+                continue
+            slot = self._slots.get(asset_id)
+            if slot is None:
+                slot = self._intern(asset_id)
+            res.start[slot] = start
+            res.outcome[slot] = columns["outcome"][i]
+            res.trades[slot] = int(columns["trade_count"][i])
+            res.synthetic[slot] = int(columns["synthetic"][i])
+            for name, col in res.float_columns().items():
+                col[slot] = float(columns[name][i])
+            restored += 1
+
+        if base is not None:
+            self._fold(base, done)
+        return restored
+
+    def drain(self) -> dict[int, CandleBatch]:
+        """Completed rollup candles per interval (only intervals that have any)."""
+        ids = np.array(self._asset_ids, dtype=object)
+        out = {}
+        for res in self._resolutions:
+            done = res.completed
+            if not len(done):
+                continue
+            res.completed = CompletedColumns()
+            out[res.interval] = done.to_batch(ids)
+        self._free_slots.extend(self._evicted_slots)
+        self._evicted_slots.clear()
+        return out
+
+
+class MultiResolutionStorage:
+    """The base ParquetStorage plus one ParquetStorage per rollup interval.
+
+    Exposes the storage calls the main loop and MarketLifecycle make, fanning them
+    out: base candles are stored as-is and folded into ``rollup``; rollup candles go
+    to their own dataset (``data_5m/``, ``data_1h/``, ... archived as ``data_5m.zip``,
+    ...), laid out exactly like the base dataset.
+    """
+
+    def __init__(self, base: ParquetStorage, rollup: CandleRollup | None = None):
+        self.base = base
+        self.rollup = rollup
+        self.storages: dict[int, ParquetStorage] = {}
+        if rollup is not None:
+            for interval in rollup.intervals:
+                self.storages[interval] = ParquetStorage(
+                    rollup_data_dir(str(base.data_dir), interval),
+                    market_lookup=base.market_lookup,
+                    layout=base.layout,
+                    wal_dir=base.wal_dir,
+                )
+
+    def all_storages(self) -> list[ParquetStorage]:
+        return [self.base, *self.storages.values()]
+
+    def append_candles(self, candles: CandleBatch) -> int:
+        count = self.base.append_candles(candles)
+        if self.rollup is not None:
+            self.rollup.add(candles)
+        return count
+
+    def append_gaps(self, records):
+        self.base.append_gaps(records)
+
+    def _store_rollups(self):
+        for interval, batch in self.rollup.drain().items():
+            self.storages[interval].append_candles(batch)
+
+    def finalize_rollups(self, now: float) -> int:
+        if self.rollup is None:
+            return 0
+        # also stores candles closed early by add(), when a later base candle arrived
+        count = self.rollup.flush(now)
+        self._store_rollups()
+        return count
+
+    def hold_markets(self, infos):
+        infos = list(infos)
+        for storage in self.all_storages():
+            storage.hold_markets(infos)
+
+    def evict_assets(self, asset_ids):
+        if self.rollup is not None:
+            self.rollup.evict(asset_ids)
+            self._store_rollups()
+
+    def flush_to_disk(self):
+        for storage in self.all_storages():
+            storage.flush_to_disk()
+
+    def recovered_rollups(self) -> dict[int, CandleBatch]:
+        """Per interval, the rollup candles recovered from its WAL plus the latest one
+        already flushed per asset."""
+        return {
+            interval: CandleBatch.concat([storage.flushed_candles(), storage.buffered_candles()])
+            for interval, storage in self.storages.items()
+        }
+
+    def sync_wal(self):
+        for storage in self.all_storages():
+            storage.sync_wal()
+
+    def close(self):
+        for storage in self.all_storages():
+            storage.close()
+
+    def archive(self, archive_path: str = "data.zip", delta: bool = False):
+        self.base.archive(archive_path, delta=delta)
+        for interval, storage in self.storages.items():
+            storage.archive(rollup_archive_path(archive_path, interval), delta=delta)
+
+    def seal_event(self, event_slug: str, reason: str = "closed") -> bool:
+        sealed = self.base.seal_event(event_slug, reason)
+        for storage in self.storages.values():
+            storage.seal_event(event_slug, reason)
+        return sealed
+
+    def get_buffer_size(self) -> int:
+        return sum(storage.get_buffer_size() for storage in self.all_storages())
@@ -0,0 +1,94 @@
+"""On-disk candle schema and the reader shim that restores the legacy DataFrame columns."""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+_DICT_STRING = pa.dictionary(pa.int32(), pa.string())
+
+# Column order matches what older files contained, minus the derived 'datetime' string.
+CANDLE_FIELDS: list[pa.Field] = [
+    pa.field("asset_id", _DICT_STRING),
+    pa.field("timestamp", pa.int64()),  # candle open time, Unix seconds UTC
+    pa.field("open", pa.float32()),
+    pa.field("high", pa.float32()),
+    pa.field("low", pa.float32()),
+    pa.field("close", pa.float32()),
+    pa.field("volume", pa.float64()),
+    pa.field("trade_count", pa.uint32()),
+    pa.field("vwap", pa.float32()),
+    pa.field("spread", pa.float32()),
+    pa.field("buy_volume", pa.float64()),
+    pa.field("sell_volume", pa.float64()),
+    pa.field("outcome", _DICT_STRING),
+    # L2 depth features at candle close; absent from older files (read back as NaN)
+    pa.field("bid_depth", pa.float64()),
+    pa.field("ask_depth", pa.float64()),
+    pa.field("depth_imbalance", pa.float32()),
+    pa.field("microprice", pa.float32()),
+    # carry-forward candle for an interval without ticks; absent from older files (False)
+    pa.field("synthetic", pa.bool_()),
+]
+CANDLE_SCHEMA = pa.schema(CANDLE_FIELDS)
+_FIELD_TYPES = {f.name: f.type for f in CANDLE_FIELDS}
+
+# Columns added by the consolidated per-event layout.
+EXTRA_FIELD_TYPES = {
+    "event_slug": _DICT_STRING,
+    "market_slug": _DICT_STRING,
+}
+
+# float32 holds prices to ~7 significant digits; round back to this many decimals on load
+PRICE_DECIMALS = 6
+PRICE_COLUMNS = [f.name for f in CANDLE_FIELDS if f.type == pa.float32()]
+
+DERIVED_COLUMNS = ["datetime"]
+
+
+def to_candle_table(df: pd.DataFrame) -> pa.Table:
+    """Convert a candle DataFrame to an Arrow table using the compact on-disk types.
+
+    Legacy columns that are now derived on load (``datetime``) are dropped, which is
+    how old files are migrated the next time they are rewritten or compacted.
+    """
+    df = df.drop(columns=[c for c in DERIVED_COLUMNS if c in df.columns])
+    types = dict(_FIELD_TYPES, **EXTRA_FIELD_TYPES)
+    columns, fields = [], []
+    for name in df.columns:
+        values = df[name]
+        target = types.get(name)
+        if target is None:
+            arr = pa.array(values, from_pandas=True)
+        elif pa.types.is_dictionary(target):
+            arr = pa.array(values.astype(str), type=pa.string()).dictionary_encode()
+            arr = arr.cast(target)
+        else:
+            arr = pa.array(np.asarray(values), from_pandas=True).cast(target)
+        columns.append(arr)
+        fields.append(pa.field(name, arr.type))
+    return pa.Table.from_arrays(columns, schema=pa.schema(fields))
+
+
+def with_reader_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Give a frame read from any file vintage the columns/dtypes readers have always seen.
+
+    Adds the ISO-8601 ``datetime`` string after ``timestamp`` when the file did not store
+    it, widens float32 prices to float64 (rounded to PRICE_DECIMALS), turns dictionary
+    columns back into plain strings and marks candles from files without a ``synthetic``
+    column as real.
+    """
+    out = df.copy()
+    for col in PRICE_COLUMNS:
+        if col in out.columns and out[col].dtype == np.float32:
+            out[col] = out[col].astype(np.float64).round(PRICE_DECIMALS)
+    if "trade_count" in out.columns:
+        out["trade_count"] = out["trade_count"].astype(np.int64)
+    for col in ("asset_id", "outcome", "event_slug", "market_slug"):
+        if col in out.columns and isinstance(out[col].dtype, pd.CategoricalDtype):
+            out[col] = out[col].astype(str)
+    if "synthetic" not in out.columns and "timestamp" in out.columns:
+        out["synthetic"] = False
+    if "datetime" not in out.columns and "timestamp" in out.columns:
+        dt = pd.to_datetime(out["timestamp"], unit="s", utc=True).dt.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+        out.insert(out.columns.get_loc("timestamp") + 1, "datetime", dt)
+    return out
@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.schema import to_candle_table
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "_manifest.json"
+SEGMENT_PREFIX = "part-"
+MERGED_PREFIX = "merged-"
+DEDUP_KEYS = ["asset_id", "outcome", "timestamp"]
+# reads restarted because compaction replaced segments under them
+READ_ATTEMPTS = 5
+
+_SEQ_RE = re.compile(r"-(\d+)\.parquet$")
+
+
+def is_segment_file(name: str) -> bool:
+    """True for ``part-<seq>.parquet`` and ``merged-<first>-<last>.parquet`` file names."""
+    base = name.replace("\\", "/").rsplit("/", 1)[-1]
+    return base.startswith((SEGMENT_PREFIX, MERGED_PREFIX)) and base.endswith(".parquet")
+
+
+def segment_seq(name: str) -> int:
+    """Return the (last) sequence number encoded in a segment file name (``part-000012.parquet`` -> 12)."""
+    m = _SEQ_RE.search(name)
+    return int(m.group(1)) if m else -1
+
+
+def atomic_write_bytes(path: Path, payload: bytes):
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=path.suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_name, path)
+    except Exception:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_parquet(df: pd.DataFrame, path: Path, to_table=to_candle_table, **kwargs):
+    """Write candles with the compact schema to a temp name, then rename it into place.
+
+    ``to_table`` converts the frame to Arrow; pass another converter for non-candle files.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".parquet")
+    os.close(fd)
+    try:
+        pq.write_table(to_table(df), tmp_name, **kwargs)
+        os.replace(tmp_name, path)
+    except Exception:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def combine_frames(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate frames oldest-first and keep the newest row per (asset_id, outcome, timestamp)."""
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    categorical = {c for f in frames for c in f.columns if isinstance(f[c].dtype, pd.CategoricalDtype)}
+    combined = pd.concat(frames, ignore_index=True)
+    if categorical:
+        # concat of differing categories falls back to object; keep dictionary encoding on disk
+        combined = combined.astype({c: "category" for c in categorical})
+    subset = [c for c in DEDUP_KEYS if c in combined.columns]
+    if subset:
+        combined = combined.drop_duplicates(subset=subset, keep="last")
+    # consolidated event datasets are ordered by market first so row-group stats prune well
+    sort_cols = [c for c in ["market_slug", "timestamp", "outcome"] if c in combined.columns]
+    if sort_cols:
+        combined = combined.sort_values(sort_cols, kind="stable")
+    return combined.reset_index(drop=True)
+
+
+class SegmentStore:
+    """Append-only directory of immutable parquet segments described by a JSON manifest.
+
+    Each flush becomes one new ``part-<seq>.parquet`` file, so the write cost depends
+    only on the rows being appended. The manifest is rewritten atomically after the
+    segment is in place, so a reader never sees a manifest entry without its file.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.lock = threading.Lock()
+        self._manifest: dict | None = None
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / MANIFEST_NAME
+
+    def exists(self) -> bool:
+        return self.manifest_path.exists()
+
+    def load_manifest(self) -> dict:
+        if self._manifest is None:
+            if self.manifest_path.exists():
+                with open(self.manifest_path, "r") as f:
+                    self._manifest = json.load(f)
+            else:
+                self._manifest = {"version": 1, "next_seq": 1, "segments": []}
+        return self._manifest
+
+    def _save_manifest(self, manifest: dict):
+        payload = json.dumps(manifest, indent=1, sort_keys=True).encode()
+        atomic_write_bytes(self.manifest_path, payload)
+        self._manifest = manifest
+
+    def segments(self) -> list[dict]:
+        with self.lock:
+            return list(self.load_manifest()["segments"])
+
+    def files(self) -> list[Path]:
+        return [self.directory / s["file"] for s in self.segments()]
+
+    def is_sealed(self) -> bool:
+        with self.lock:
+            return bool(self.load_manifest().get("sealed"))
+
+    def seal(self):
+        """Mark the store sealed: no more appends are expected and compaction merges it fully."""
+        with self.lock:
+            manifest = self.load_manifest()
+            if not manifest.get("sealed") and self.manifest_path.exists():
+                self._save_manifest(dict(manifest, sealed=time.time()))
+
+    def replace_segments(self, old: list[dict], merged_df: pd.DataFrame, tier: int, **write_kwargs) -> Path | None:
+        """Swap a contiguous run of segments for one merged file.
+
+        The merged file is written under a temp name and renamed into place before the
+        manifest is atomically rewritten, so readers see either the old run or the merged
+        file, never a partial state. Returns the merged path, or None if the run changed
+        under us (it is then left untouched). The caller deletes the old files.
+        """
+        first_seq = old[0].get("first_seq", old[0]["seq"])
+        last_seq = old[-1]["seq"]
+        path = self.directory / f"{MERGED_PREFIX}{first_seq:06d}-{last_seq:06d}.parquet"
+        atomic_write_parquet(merged_df, path, **write_kwargs)
+
+        old_files = [s["file"] for s in old]
+        with self.lock:
+            manifest = self.load_manifest()
+            current = [s["file"] for s in manifest["segments"]]
+            try:
+                start = current.index(old_files[0])
+            except ValueError:
+                start = -1
+            if start < 0 or current[start:start + len(old_files)] != old_files:
+                if path.name not in current:
+                    path.unlink(missing_ok=True)
+                return None
+
+            entry = {
+                "file": path.name,
+                "seq": last_seq,
+                "first_seq": first_seq,
+                "tier": tier,
+                "rows": int(len(merged_df)),
+                "bytes": path.stat().st_size,
+                "created": min(s.get("created", time.time()) for s in old),
+                "compacted": time.time(),
+            }
+            if "timestamp" in merged_df.columns and len(merged_df):
+                entry["min_ts"] = int(merged_df["timestamp"].min())
+                entry["max_ts"] = int(merged_df["timestamp"].max())
+
+            segments = manifest["segments"]
+            segments = segments[:start] + [entry] + segments[start + len(old_files):]
+            self._save_manifest(dict(manifest, segments=segments))
+        return path
+
+    def append(self, df: pd.DataFrame) -> Path:
+        """Write ``df`` as the next immutable segment and register it in the manifest."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            manifest = self.load_manifest()
+            if manifest.get("sealed"):
+                logger.warning(f"Appending to sealed segment store {self.directory}, reopening it")
+                manifest = {k: v for k, v in manifest.items() if k != "sealed"}
+            seq = manifest["next_seq"]
+            path = self.directory / f"{SEGMENT_PREFIX}{seq:06d}.parquet"
+            atomic_write_parquet(df, path)
+
+            entry = {
+                "file": path.name,
+                "seq": seq,
+                "rows": int(len(df)),
+                "bytes": path.stat().st_size,
+                "created": time.time(),
+            }
+            if "timestamp" in df.columns and len(df):
+                entry["min_ts"] = int(df["timestamp"].min())
+                entry["max_ts"] = int(df["timestamp"].max())
+
+            updated = dict(manifest, next_seq=seq + 1, segments=manifest["segments"] + [entry])
+            self._save_manifest(updated)
+            return path
+
+    def read(self) -> pd.DataFrame:
+        """Read every live segment, oldest first, deduplicated and sorted.
+
+        Compaction deletes merged segments once the manifest names their replacement, so
+        a file that vanishes mid-read means the manifest changed: it is reloaded and the
+        read starts over. A file the reloaded manifest still lists is really lost and is
+        skipped with a warning.
+        """
+        lost: set[Path] = set()
+        for _ in range(READ_ATTEMPTS):
+            frames = []
+            for path in self.files():
+                if path in lost:
+                    continue
+                try:
+                    frames.append(pd.read_parquet(path))
+                except FileNotFoundError:
+                    self.reload()
+                    if path in self.files():
+                        logger.warning(f"Segment listed in manifest is missing: {path}")
+                        lost.add(path)
+                        continue
+                    break
+            else:
+                return combine_frames(frames)
+        raise RuntimeError(f"Segments of {self.directory} kept changing during {READ_ATTEMPTS} read attempts")
+
+    def reload(self):
+        """Drop the cached manifest so the next access reads it from disk."""
+        with self.lock:
+            self._manifest = None
+
+    def materialize(self, dest: Path) -> int:
+        """Write all segments as one sorted, deduplicated parquet file at ``dest``."""
+        df = self.read()
+        if df.empty:
+            return 0
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_parquet(df, dest)
+        return len(df)
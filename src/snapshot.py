@@ -0,0 +1,199 @@
+"""Warm-restart snapshots of the recorder's in-memory state.
+
+A snapshot holds what a restart would otherwise rebuild from Gamma or lose: the
+discovered markets (known and retired assets), the subscription list, every open
+candle and the per-asset carry-forward state of OHLCVAggregator, the open candles of
+every rollup resolution (so a restart mid-hour does not truncate the 1h bar), and the
+last best bid/ask of each asset. The tables are Arrow IPC files that are memory-mapped on
+load; ``state.json`` names the current generation and is replaced last, so a crash
+while saving leaves the previous snapshot intact.
+
+L2 books are not saved: the exchange sends a full ``book`` for every subscription.
+"""
+
+import json
+import logging
+import math
+import os
+import tempfile
+import time
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+
+from src.gaps import GAP_REASON_RESTART, GapRecord
+from src.market_discovery import MarketDiscovery, MarketInfo
+from src.ohlcv_aggregator import CandleBatch, OHLCVAggregator
+from src.rollup import CandleRollup
+from src.segments import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "state.json"
+SNAPSHOT_VERSION = 1
+TABLES = ("windows", "slots", "quotes")
+# written only when rollups are configured
+OPTIONAL_TABLES = ("rollups",)
+
+
+def _to_table(columns: dict[str, np.ndarray]) -> pa.Table:
+    arrays = {
+        name: pa.array(col, type=pa.string()) if col.dtype == object else pa.array(col)
+        for name, col in columns.items()
+    }
+    return pa.table(arrays)
+
+
+def _columns(table: pa.Table) -> dict[str, np.ndarray]:
+    # numeric columns are zero-copy views of the memory map
+    return {name: table.column(name).to_numpy() for name in table.column_names}
+
+
+def _write_ipc(table: pa.Table, path: Path):
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".arrow")
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp_name, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_name, path)
+    except Exception:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def _read_ipc(path: Path) -> pa.Table:
+    return pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+
+@dataclass
+class Snapshot:
+    created_at: float
+    known_assets: dict[str, MarketInfo]
+    retired_assets: set[str]
+    subscriptions: list[str]
+    watermark: float
+    filled_until: int
+    windows: pa.Table
+    slots: pa.Table
+    quotes: pa.Table
+    rollups: pa.Table | None = None
+
+    def restore(self, discovery: MarketDiscovery, aggregator: OHLCVAggregator,
+                emitted: CandleBatch | None = None, rollup: CandleRollup | None = None,
+                emitted_rollups: dict[int, CandleBatch] | None = None,
+                flushed: CandleBatch | None = None) -> int:
+        """Load the markets into ``discovery`` and the candle and quote state into
+        ``aggregator`` (which must track ``discovery.known_assets``). ``emitted`` are the
+        candles recovered from the candle WAL: windows the snapshot still had open but
+        which were finalized into the WAL before the restart are not reopened, nor are
+        those at or before the latest candle already on disk per asset (``flushed``, the
+        storage's high-water mark: a flush may have emptied the WAL after the snapshot).
+        The open rollup candles go into ``rollup``, completed with ``emitted`` and minus
+        those the rollup datasets already hold (``emitted_rollups``, per interval).
+        Returns the number of open candles restored."""
+        with discovery.assets_lock:
+            discovery.known_assets.update(self.known_assets)
+            discovery.retired_assets.update(self.retired_assets)
+        restored = aggregator.restore_state(
+            _columns(self.windows), _columns(self.slots), self.watermark, self.filled_until,
+            CandleBatch.concat([b for b in (flushed, emitted) if b is not None]),
+        )
+        if rollup is not None and self.rollups is not None:
+            rollup.restore_state(_columns(self.rollups), emitted, emitted_rollups)
+        quotes = _columns(self.quotes)
+        aggregator.restore_quotes(list(zip(
+            quotes["asset_id"].tolist(), quotes["updated_ms"].tolist(), quotes["bid"].tolist(),
+            quotes["ask"].tolist(), quotes["bid_size"].tolist(), quotes["ask_size"].tolist(),
+        )))
+        return restored
+
+    def gap_records(self, now: float | None = None) -> list[GapRecord]:
+        """One ``restart`` gap per subscribed asset, from the snapshot until ``now``."""
+        now = time.time() if now is None else now
+        return [GapRecord(a, self.created_at, now, reason=GAP_REASON_RESTART) for a in self.subscriptions]
+
+
+def save_snapshot(directory: str | Path, discovery: MarketDiscovery, aggregator: OHLCVAggregator,
+                  subscriptions: list[str], rollup: CandleRollup | None = None) -> Path:
+    """Write a new snapshot generation and drop the previous one. Returns the state file."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    created_at = time.time()
+    generation = f"{time.time_ns():020d}"
+    state = aggregator.export_state()
+    tables = {
+        "windows": _to_table(state["windows"]),
+        "slots": _to_table(state["slots"]),
+        "quotes": aggregator.quotes.to_arrow(),
+    }
+    if rollup is not None:
+        tables["rollups"] = _to_table(rollup.export_state())
+    for name, table in tables.items():
+        _write_ipc(table, directory / f"{name}-{generation}.arrow")
+
+    watermark = state["watermark"]
+    with discovery.assets_lock:
+        known_assets = {a: asdict(info) for a, info in discovery.known_assets.items()}
+        retired_assets = sorted(discovery.retired_assets)
+    payload = {
+        "version": SNAPSHOT_VERSION,
+        "generation": generation,
+        "tables": list(tables),
+        "created_at": created_at,
+        "known_assets": known_assets,
+        "retired_assets": retired_assets,
+        "subscriptions": list(subscriptions),
+        "watermark": watermark if math.isfinite(watermark) else None,
+        "filled_until": state["filled_until"],
+    }
+    state_path = directory / STATE_FILE
+    atomic_write_bytes(state_path, json.dumps(payload).encode())
+
+    for path in directory.glob("*-*.arrow"):
+        if not path.stem.endswith(generation):
+            path.unlink(missing_ok=True)
+    logger.debug(
+        f"Saved state snapshot: {len(payload['known_assets'])} markets, {tables['windows'].num_rows} open candles"
+    )
+    return state_path
+
+
+def load_snapshot(directory: str | Path) -> Snapshot | None:
+    """The latest snapshot under ``directory``, or None when there is none (or it is unreadable)."""
+    directory = Path(directory)
+    state_path = directory / STATE_FILE
+    if not state_path.exists():
+        return None
+    try:
+        with open(state_path, "r") as f:
+            payload = json.load(f)
+        if payload.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring state snapshot {state_path} with version {payload.get('version')}")
+            return None
+        # derived fields (market_slug) are recomputed
+        init_fields = [f.name for f in fields(MarketInfo) if f.init]
+        known_assets = {
+            asset_id: MarketInfo(**{name: values[name] for name in init_fields if name in values})
+            for asset_id, values in payload["known_assets"].items()
+        }
+        generation = payload["generation"]
+        tables = {name: _read_ipc(directory / f"{name}-{generation}.arrow") for name in TABLES}
+        for name in OPTIONAL_TABLES:
+            if name in payload.get("tables", ()):
+                tables[name] = _read_ipc(directory / f"{name}-{generation}.arrow")
+    except Exception:
+        logger.exception(f"Error loading state snapshot {state_path}")
+        return None
+
+    watermark = payload.get("watermark")
+    return Snapshot(
+        created_at=payload["created_at"],
+        known_assets=known_assets,
+        retired_assets=set(payload.get("retired_assets", [])),
+        subscriptions=[a for a in payload.get("subscriptions", []) if a in known_assets],
+        watermark=-math.inf if watermark is None else watermark,
+        filled_until=payload.get("filled_until", -1),
+        **tables,
+    )
@@ -1,26 +1,205 @@
+import json
 import logging
-import shutil
-import tempfile
+import threading
+import time
+
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from datetime import datetime, timezone
-import os
-from pathlib import Path
 
+from src.archive import IncrementalArchiver
+from src.candle_wal import CandleWAL, decode_batch, encode_batch
+from src.gaps import GAP_KEYS, GAPS_FILE_NAME, GapRecord, gaps_to_frame, read_gaps, to_gap_table
 from src.market_discovery import MarketInfo
+from src.ohlcv_aggregator import FLOAT_FIELDS, CandleBatch
+from src.order_book import DEPTH_FIELDS
+from src.schema import with_reader_columns
+from src.segments import MANIFEST_NAME, SegmentStore, atomic_write_bytes, atomic_write_parquet
 
 logger = logging.getLogger(__name__)
 
+# data/<event_slug>/<market_slug>.parquet, rewritten on every flush
+LAYOUT_SINGLE = "single"
+# data/<event_slug>/<market_slug>/part-<seq>.parquet + _manifest.json, append-only
+LAYOUT_SEGMENTED = "segmented"
+# data/<event_slug>/part-<seq>.parquet + _manifest.json, one dataset per event holding every
+# market, with dictionary-encoded event_slug/market_slug/outcome and rows sorted by market/time
+LAYOUT_EVENT = "event"
+LAYOUTS = (LAYOUT_SINGLE, LAYOUT_SEGMENTED, LAYOUT_EVENT)
+EVENT_DICT_COLUMNS = ["event_slug", "market_slug", "outcome", "asset_id"]
+# written to data/<event_slug>/ once every market of the event has closed
+SEALED_MARKER = "_sealed.json"
+# latest flushed candle per asset, in the candle WAL record payload format
+LAST_FLUSHED_NAME = "_last_flushed.bin"
+
+
+class CandleBuffer:
+    """Completed candles held as columnar CandleBatch chunks until the next flush."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._batches: list[CandleBatch] = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, batch: CandleBatch):
+        if len(batch):
+            self._batches.append(batch)
+            self._size += len(batch)
+
+    def batch(self) -> CandleBatch:
+        return CandleBatch.concat(self._batches)
+
+    def retain(self, keep: np.ndarray) -> CandleBatch:
+        """Keep only the candles where ``keep`` (aligned with to_frame() rows) is True."""
+        kept = CandleBatch.concat(self._batches).take(keep)
+        self.clear()
+        self.add(kept)
+        return kept
+
+    def to_frame(self) -> pd.DataFrame:
+        batch = CandleBatch.concat(self._batches)
+        data = {
+            "asset_id": batch.asset_id,
+            "timestamp": batch.timestamp,
+        }
+        for name in ("open", "high", "low", "close", "volume"):
+            data[name] = getattr(batch, name)
+        data["trade_count"] = batch.trade_count
+        for name in ("vwap", "spread", "buy_volume", "sell_volume"):
+            data[name] = getattr(batch, name)
+        data["outcome"] = batch.outcome
+        for name in DEPTH_FIELDS:
+            data[name] = getattr(batch, name)
+        data["synthetic"] = batch.synthetic
+        return pd.DataFrame(data)
+
 
 class ParquetStorage:
-    def __init__(self, data_dir: str = "data", market_lookup: dict[str, MarketInfo] | None = None):
+    def __init__(
+        self,
+        data_dir: str = "data",
+        market_lookup: dict[str, MarketInfo] | None = None,
+        layout: str = LAYOUT_SINGLE,
+        wal_dir: str | None = None,
+    ):
+        """With ``wal_dir`` every buffered batch is also appended to a write-ahead log,
+        ``<wal_dir>/<data_dir name>.wal``, which is truncated after each successful flush
+        and replayed into the buffer here on startup (see CandleWAL).
+
+        Every flush also records the latest candle written per asset in
+        ``<data_dir>/_last_flushed.bin`` before the WAL is truncated, so a warm restart
+        from a snapshot older than the flush does not reopen windows already on disk."""
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown storage layout '{layout}', expected one of {LAYOUTS}")
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.market_lookup = market_lookup if market_lookup is not None else {}
-        self._buffer: list[dict] = []
+        self.layout = layout
+        self._buffer = CandleBuffer()
+        self._segment_stores: dict[Path, SegmentStore] = {}
+        # one SegmentStore per directory, shared by the main loop and the compaction thread
+        self._stores_lock = threading.Lock()
+        # held while files under data_dir are swapped or deleted (compaction) or zipped (archive)
+        self.io_lock = threading.Lock()
+        self._archivers: dict[str, IncrementalArchiver] = {}
+        # outage records from the WebSocket threads, written to <event>/_gaps.parquet on flush
+        self._gaps: list[GapRecord] = []
+        self._gaps_lock = threading.Lock()
+        self.wal_dir = wal_dir
+        self._wal: CandleWAL | None = None
+        # markets of candles replayed from the WAL, for those no longer in market_lookup
+        self._wal_markets: dict[str, MarketInfo] = {}
+        # markets being retired: out of market_lookup already, their last candles not yet flushed
+        self._retired_markets: dict[str, MarketInfo] = {}
+        # a replayed WAL may repeat candles a crash mid-flush had already written
+        self._dedup_next_flush = False
+        self._last_flushed = self._load_last_flushed()
+        if wal_dir is not None:
+            self._wal = CandleWAL(Path(wal_dir) / f"{self.data_dir.name}.wal")
+            self._recover_wal()
 
-    def _get_file_path(self, asset_id: str) -> Path:
+    def _recover_wal(self):
+        batches, markets = self._wal.replay()
+        for batch in batches:
+            self._buffer.add(batch)
+        self._wal_markets = markets
+        if batches:
+            self._dedup_next_flush = True
+            logger.info(f"Recovered {len(self._buffer)} unflushed candles from {self._wal.path}")
+
+    @property
+    def last_flushed_path(self) -> Path:
+        return self.data_dir / LAST_FLUSHED_NAME
+
+    def _load_last_flushed(self) -> CandleBatch:
+        if self.last_flushed_path.exists():
+            try:
+                return decode_batch(self.last_flushed_path.read_bytes())[0]
+            except Exception:
+                logger.exception(f"Ignoring unreadable {self.last_flushed_path}")
+        return CandleBatch.empty()
+
+    def _record_flushed(self, batch: CandleBatch):
+        """Advance the per-asset high-water mark of flushed candles by ``batch``. Assets
+        no longer tracked are dropped, as a restart does not restore them."""
+        latest = CandleBatch.concat([self._last_flushed, batch]).latest_per_asset()
+        lookup = self._markets()
+        latest = latest.take(np.array([a in lookup for a in latest.asset_id.tolist()], dtype=bool))
+        try:
+            atomic_write_bytes(self.last_flushed_path, encode_batch(latest, lookup))
+        except Exception:
+            logger.exception(f"Error writing {self.last_flushed_path}")
+        self._last_flushed = latest
+
+    def flushed_candles(self) -> CandleBatch:
+        """The latest candle on disk per asset, as of the last flush."""
+        return self._last_flushed
+
+    def _market(self, asset_id: str) -> MarketInfo | None:
         info = self.market_lookup.get(asset_id)
+        if info is None:
+            info = self._retired_markets.get(asset_id)
+        if info is None:
+            info = self._wal_markets.get(asset_id)
+        return info
+
+    def _markets(self) -> dict[str, MarketInfo]:
+        """Every market a buffered candle may belong to, by asset id."""
+        return {**self._wal_markets, **self._retired_markets, **self.market_lookup}
+
+    def hold_markets(self, infos):
+        """Keep resolving the files of retired assets (already dropped from market_lookup)
+        until their last candles have been flushed."""
+        self._retired_markets.update((info.asset_id, info) for info in infos)
+
+    def _flushed(self):
+        """The whole buffer is on disk: drop it and its log."""
+        self._record_flushed(self._buffer.batch())
+        self._buffer.clear()
+        self._wal_markets = {}
+        self._retired_markets = {}
+        self._dedup_next_flush = False
+        if self._wal is not None:
+            self._wal.truncate()
+
+    def _partially_flushed(self, written: np.ndarray):
+        """A flush failed part way: keep only the candles not yet on disk, so the retry
+        does not append the written ones a second time."""
+        self._record_flushed(self._buffer.batch().take(written))
+        kept = self._buffer.retain(~written)
+        logger.warning(f"Flush failed after {int(written.sum())} candles, {len(kept)} retained for retry")
+        if self._wal is not None:
+            self._wal.truncate()
+            self._wal.append(kept, self._markets())
+            self._wal.sync()
+
+    def _get_file_path(self, asset_id: str) -> Path:
+        info = self._market(asset_id)
         if info:
             path = self.data_dir / info.event_slug / f"{info.market_slug}.parquet"
         else:
@@ -28,115 +207,257 @@ class ParquetStorage:
         path.parent.mkdir(parents=True, exist_ok=True)
         return path
 
-    def append_candles(self, candles: list) -> int:
-        for c in candles:
-            self._buffer.append(
-                {
-                    "asset_id": c.asset_id,
-                    "timestamp": c.timestamp,
-                    "datetime": datetime.fromtimestamp(c.timestamp, tz=timezone.utc).isoformat(),
-                    "open": c.open,
-                    "high": c.high,
-                    "low": c.low,
-                    "close": c.close,
-                    "volume": c.volume,
-                    "trade_count": c.trade_count,
-                    "vwap": c.vwap,
-                    "spread": c.spread,
-                    "buy_volume": c.buy_volume,
-                    "sell_volume": c.sell_volume,
-                    "outcome": getattr(c, "outcome", ""),
-                }
-            )
+    def _store_for_dir(self, directory: Path) -> SegmentStore:
+        with self._stores_lock:
+            store = self._segment_stores.get(directory)
+            if store is None:
+                store = SegmentStore(directory)
+                self._segment_stores[directory] = store
+            return store
+
+    def _get_segment_store(self, asset_id: str) -> SegmentStore:
+        if self.layout == LAYOUT_EVENT:
+            return self._store_for_dir(self._get_file_path(asset_id).parent)
+        return self._store_for_dir(self._get_file_path(asset_id).with_suffix(""))
+
+    def _event_and_market(self, asset_id: str) -> tuple[str, str]:
+        info = self._market(asset_id)
+        if info:
+            return info.event_slug, info.market_slug
+        return "unknown", asset_id[:16]
+
+    def append_candles(self, candles: CandleBatch | list) -> int:
+        """Buffer a CandleBatch (or a list of OHLCVCandle objects) for the next flush."""
+        if not isinstance(candles, CandleBatch):
+            candles = CandleBatch.from_candles(candles)
+        if self._wal is not None:
+            self._wal.append(candles, self._markets())
+        self._buffer.add(candles)
         return len(candles)
 
+    def buffered_candles(self) -> CandleBatch:
+        """Every candle waiting for the next flush (after startup: those recovered from the WAL)."""
+        return self._buffer.batch()
+
+    def sync_wal(self):
+        """fsync the candles appended to the WAL since the last call."""
+        if self._wal is not None:
+            try:
+                self._wal.sync()
+            except Exception:
+                logger.exception(f"Error syncing {self._wal.path}")
+
+    def close(self):
+        if self._wal is not None:
+            self._wal.close()
+
+    def append_gaps(self, records: list[GapRecord]):
+        """Buffer outage records; safe to call from the WebSocket threads."""
+        with self._gaps_lock:
+            self._gaps.extend(records)
+
+    def _flush_gaps(self):
+        with self._gaps_lock:
+            records, self._gaps = self._gaps, []
+        if not records:
+            return
+        df = gaps_to_frame(records, self._markets())
+        events = [self._event_and_market(aid)[0] for aid in df["asset_id"]]
+        try:
+            for event_slug, event_df in df.groupby(pd.Series(events, index=df.index), sort=False):
+                path = self.data_dir / str(event_slug) / GAPS_FILE_NAME
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if path.exists():
+                    event_df = pd.concat([read_gaps(path), event_df], ignore_index=True)
+                    event_df = event_df.drop_duplicates(subset=GAP_KEYS, keep="last")
+                event_df = event_df.sort_values(["start", "asset_id"]).reset_index(drop=True)
+                atomic_write_parquet(event_df, path, to_table=to_gap_table)
+            logger.info(f"Recorded {len(records)} gap records")
+        except Exception:
+            logger.exception("Error writing gap records, retained for retry")
+            with self._gaps_lock:
+                self._gaps[:0] = records
+
+    def load_gaps(self, event_slug: str) -> pd.DataFrame | None:
+        path = self.data_dir / event_slug / GAPS_FILE_NAME
+        if path.exists():
+            return read_gaps(path)
+        return None
+
     def flush_to_disk(self):
+        self._flush_gaps()
         if not self._buffer:
             logger.debug("Nothing to flush")
             return
 
-        df = pd.DataFrame(self._buffer)
+        df = self._buffer.to_frame()
+
+        if self.layout == LAYOUT_EVENT:
+            self._flush_events(df)
+            return
+
         # group by asset_id and outcome so we keep separate rows per outcome
         grouped = df.groupby(["asset_id", "outcome"])
+        # rows already on disk, dropped from the buffer if a later group fails
+        written = np.zeros(len(df), dtype=bool)
 
         try:
             for (raw_key, outcome), group_df in grouped:
                 aid = str(raw_key)
+
+                self._reopen_if_sealed(self._event_and_market(aid)[0])
+                if self.layout == LAYOUT_SEGMENTED:
+                    self._get_segment_store(aid).append(group_df)
+                    written[group_df.index] = True
+                    info = self._market(aid)
+                    label = f"{info.event_slug}/{info.market_slug}/{outcome}" if info else f"{aid[:16]}/{outcome}"
+                    logger.info(f"Flushed {len(group_df)} candles -> {label} (segment)")
+                    continue
+
                 file_path = self._get_file_path(aid)
 
                 if file_path.exists():
                     existing = pd.read_parquet(file_path)
                     combined = pd.concat([existing, group_df], ignore_index=True)
-                    combined = combined.drop_duplicates(
-                        subset=["asset_id", "outcome", "timestamp"], keep="last"
-                    )
+                    if self._dedup_next_flush:
+                        # the aggregator emits each candle once, but a WAL replayed after a
+                        # crash mid-flush can repeat candles already written: keep those
+                        combined = combined.drop_duplicates(subset=["asset_id", "outcome", "timestamp"], keep="first")
                     combined = combined.sort_values(["timestamp", "outcome"]).reset_index(drop=True)
-                    combined.to_parquet(file_path, index=False, engine="pyarrow")
+                    atomic_write_parquet(combined, file_path)
                 else:
-                    group_df.to_parquet(file_path, index=False, engine="pyarrow")
+                    atomic_write_parquet(group_df, file_path)
+                written[group_df.index] = True
 
-                info = self.market_lookup.get(aid)
+                info = self._market(aid)
                 label = f"{info.event_slug}/{info.market_slug}/{outcome}" if info else f"{aid[:16]}/{outcome}"
                 logger.info(f"Flushed {len(group_df)} candles -> {label}")
 
             flushed_count = len(self._buffer)
-            self._buffer = []
+            self._flushed()
             logger.info(f"Flush complete: {flushed_count} candles written to disk")
         except Exception:
-            logger.exception("Error flushing to disk, buffer retained for retry")
+            logger.exception("Error flushing to disk, unwritten candles retained for retry")
+            if written.any():
+                self._partially_flushed(written)
+
+    def _flush_events(self, df: pd.DataFrame):
+        """Append one segment per event, holding every market flushed for that event."""
+        keys = [self._event_and_market(str(aid)) for aid in df["asset_id"]]
+        df["event_slug"] = [k[0] for k in keys]
+        df["market_slug"] = [k[1] for k in keys]
+        written = np.zeros(len(df), dtype=bool)
+
+        try:
+            for event_slug, event_df in df.groupby("event_slug", sort=False):
+                event_df = event_df.sort_values(["market_slug", "timestamp", "outcome"], kind="stable")
+                event_df = event_df.astype({c: "category" for c in EVENT_DICT_COLUMNS})
+                self._reopen_if_sealed(str(event_slug))
+                store = self._store_for_dir(self.data_dir / str(event_slug))
+                store.append(event_df.reset_index(drop=True))
+                written[event_df.index] = True
+                logger.info(
+                    f"Flushed {len(event_df)} candles ({event_df['market_slug'].nunique()} markets) "
+                    f"-> {event_slug} (event segment)"
+                )
+
+            flushed_count = len(self._buffer)
+            self._flushed()
+            logger.info(f"Flush complete: {flushed_count} candles written to disk")
+        except Exception:
+            logger.exception("Error flushing to disk, unwritten candles retained for retry")
+            if written.any():
+                self._partially_flushed(written)
+
+    def is_sealed(self, event_slug: str) -> bool:
+        return (self.data_dir / event_slug / SEALED_MARKER).exists()
+
+    def seal_event(self, event_slug: str, reason: str = "closed") -> bool:
+        """Mark an event's files as final once all of its markets have closed.
+
+        Writes ``<event>/_sealed.json`` and seals every segment store under the event, so
+        compaction merges each into a single file. Call after the final flush of the
+        event's candles. Returns False if the event has no data directory.
+        """
+        event_dir = self.data_dir / event_slug
+        if not event_dir.is_dir():
+            return False
+        for manifest in event_dir.rglob(MANIFEST_NAME):
+            self._store_for_dir(manifest.parent).seal()
+        marker = {"event_slug": event_slug, "sealed_at": time.time(), "reason": reason}
+        atomic_write_bytes(event_dir / SEALED_MARKER, json.dumps(marker, indent=1).encode())
+        logger.info(f"Sealed event {event_slug} ({reason})")
+        return True
+
+    def _reopen_if_sealed(self, event_slug: str):
+        marker = self.data_dir / event_slug / SEALED_MARKER
+        if marker.exists():
+            logger.warning(f"New candles for sealed event {event_slug}, reopening it")
+            marker.unlink(missing_ok=True)
 
     def load_existing(self, asset_id: str) -> pd.DataFrame | None:
+        store = self._get_segment_store(asset_id)
+        if store.exists():
+            df = store.read()
+            if self.layout == LAYOUT_EVENT and not df.empty:
+                df = df[df["asset_id"].astype(str) == asset_id].reset_index(drop=True)
+            return with_reader_columns(df) if not df.empty else None
         file_path = self._get_file_path(asset_id)
         if file_path.exists():
-            return pd.read_parquet(file_path)
+            return with_reader_columns(pd.read_parquet(file_path))
         return None
 
-    def archive(self, archive_path: str = "data.zip"):
-        """Zip the data directory, writing to a temp file then replacing atomically."""
-        archive_dest = Path(archive_path)
-        
-        try:
-            with tempfile.NamedTemporaryFile(
-                dir=archive_dest.parent, suffix=".zip", delete=False
-            ) as tmp:
-                tmp_path = Path(tmp.name)
-
-            # shutil.make_archive wants the base name without extension
-            shutil.make_archive(
-                str(tmp_path.with_suffix("")), "zip", root_dir=".", base_dir=str(self.data_dir)
-            )
-            # make_archive appends .zip to the base name
-            created = tmp_path.with_suffix("").with_suffix(".zip")
-            
-            # Create backups before overwriting, but only if new archive is not smaller in size
-            if archive_dest.exists():
-                new_size = created.stat().st_size
-                old_size = archive_dest.stat().st_size
-                if new_size >= old_size:
-                    backup1 = archive_dest.parent / "data_backup_1.zip"
-                    backup2 = archive_dest.parent / "data_backup_2.zip"
-                    if backup1.exists():
-                        if not backup2.exists() or backup1.stat().st_size > backup2.stat().st_size:
-                            backup1.replace(backup2)  # Move backup1 to backup2 only if larger
-                        else:
-                            logger.info("Skipping backup1 to backup2 move: backup1 not larger than backup2")
-                    archive_dest.replace(backup1)  # Move current to backup1
-                else:
-                    logger.warning(f"New archive ({new_size} bytes) is smaller than existing ({old_size} bytes), skipping backup creation")
-            
-            created.replace(archive_dest)
-            tmp_path.unlink(missing_ok=True)
+    def iter_segment_stores(self):
+        """Yield a SegmentStore for every segmented market directory under data_dir."""
+        for manifest in sorted(self.data_dir.rglob(MANIFEST_NAME)):
+            yield self._store_for_dir(manifest.parent)
 
-            size_mb = archive_dest.stat().st_size / (1024 * 1024)
-            logger.info(f"Archive updated: {archive_dest} ({size_mb:.1f} MB)")
+    def materialize(self, dest_dir: str) -> int:
+        """Produce the single-file layout (<event>/<market>.parquet) from segments under dest_dir.
 
-            # chmod: rw-r--- (640)
-            Path("data.zip").chmod(0o640)
-            logger.info(f"Archive permissions set to 640")
-        except Exception:
-            logger.exception("Error creating archive")
-            if 'tmp_path' in locals():
-                tmp_path.unlink(missing_ok=True)
+        Returns the number of market files written.
+        """
+        dest = Path(dest_dir)
+        written = 0
+        for store in self.iter_segment_stores():
+            rel = store.directory.relative_to(self.data_dir)
+            if len(rel.parts) == 1:
+                # consolidated event dataset: split it back into one file per market
+                df = store.read()
+                if df.empty:
+                    continue
+                (dest / rel).mkdir(parents=True, exist_ok=True)
+                for market_slug, market_df in df.groupby("market_slug", observed=True):
+                    market_df = market_df.drop(columns=["event_slug", "market_slug"])
+                    atomic_write_parquet(market_df.reset_index(drop=True), dest / rel / f"{market_slug}.parquet")
+                    written += 1
+                continue
+            rows = store.materialize(dest / rel.with_suffix(".parquet"))
+            if rows:
+                written += 1
+                logger.debug(f"Materialized {rows} candles -> {rel}.parquet")
+        logger.info(f"Materialized {written} market files into {dest}")
+        return written
+
+    def archive(self, archive_path: str = "data.zip", delta: bool = False):
+        """Bring the zip of the data directory up to date, replacing it atomically.
+
+        Only files that changed since the previous call are read from disk; with
+        ``delta`` a ``<name>-delta-<seq>.zip`` holding just those files is written too.
+        """
+        archiver = self._archivers.get(archive_path)
+        if archiver is None:
+            archiver = IncrementalArchiver(self.data_dir, archive_path)
+            self._archivers[archive_path] = archiver
+
+        with self.io_lock:
+            try:
+                files = archiver.scan()
+                archiver.build(files)
+                if delta:
+                    archiver.build_delta(files)
+            except Exception:
+                logger.exception("Error creating archive")
 
     def get_buffer_size(self) -> int:
         return len(self._buffer)
@@ -0,0 +1,113 @@
+import math
+import threading
+from array import array
+
+import numpy as np
+import pyarrow as pa
+
+NAN = math.nan
+
+QUOTE_COLUMNS = ("bid", "ask", "bid_size", "ask_size")
+
+
+class TopOfBookStore:
+    """Latest best bid/ask per asset in parallel typed arrays indexed by interned slot.
+
+    Replaces keeping the last raw WebSocket message per asset: one quote costs five
+    machine words instead of a dict of strings (or a whole ``book`` level list). Sizes
+    are NaN when the feed did not carry them (``best_bid_ask`` has prices only).
+
+    The store has no interning of its own: ``slots`` and ``asset_ids`` are the owner's
+    (OHLCVAggregator's) asset -> slot map and slot -> asset list, and the owner calls
+    ``grow`` for every new slot and ``clear`` when it evicts one, under its own lock.
+
+    ``snapshot()`` returns NumPy columns for every live asset in one locked copy of the
+    numeric buffers, and ``to_arrow()`` wraps the same columns in a pyarrow Table, so
+    readers never iterate per-asset dicts.
+    """
+
+    def __init__(self, slots: dict[str, int], asset_ids: list[str]):
+        self.lock = threading.Lock()
+        self._slots = slots
+        self._asset_ids = asset_ids
+        self._bid = array("d")
+        self._ask = array("d")
+        self._bid_size = array("d")
+        self._ask_size = array("d")
+        # -1 for slots without a quote
+        self._updated_ms = array("q")
+
+    def __len__(self) -> int:
+        with self.lock:
+            return int(np.count_nonzero(np.frombuffer(self._updated_ms, dtype=np.int64) >= 0))
+
+    def __contains__(self, asset_id: str) -> bool:
+        slot = self._slots.get(asset_id)
+        return slot is not None and slot < len(self._updated_ms) and self._updated_ms[slot] >= 0
+
+    def grow(self):
+        """Add a slot without a quote (the owner interned a new asset)."""
+        with self.lock:
+            for col in (self._bid, self._ask, self._bid_size, self._ask_size):
+                col.append(NAN)
+            self._updated_ms.append(-1)
+
+    def clear(self, slot: int):
+        """Drop the quote of ``slot`` (its asset was evicted)."""
+        with self.lock:
+            for col in (self._bid, self._ask, self._bid_size, self._ask_size):
+                col[slot] = NAN
+            self._updated_ms[slot] = -1
+
+    def update_many(self, quotes: list[tuple]):
+        """Apply ``(slot, timestamp_ms, bid, ask, bid_size, ask_size)`` tuples under one lock.
+
+        Older quotes than the stored one are ignored, so out-of-order frames (several
+        ingest workers) never roll a quote back. A NaN size keeps the stored size while
+        that side's price is unchanged.
+        """
+        with self.lock:
+            updated = self._updated_ms
+            for slot, timestamp_ms, bid, ask, bid_size, ask_size in quotes:
+                if timestamp_ms < updated[slot]:
+                    continue
+                if bid_size == bid_size or self._bid[slot] != bid:
+                    self._bid_size[slot] = bid_size
+                if ask_size == ask_size or self._ask[slot] != ask:
+                    self._ask_size[slot] = ask_size
+                self._bid[slot] = bid
+                self._ask[slot] = ask
+                updated[slot] = timestamp_ms
+
+    def get(self, asset_id: str) -> tuple[float, float, float, float, int] | None:
+        """(bid, ask, bid_size, ask_size, updated_ms) for one asset, or None."""
+        with self.lock:
+            slot = self._slots.get(asset_id)
+            if slot is None or slot >= len(self._updated_ms) or self._updated_ms[slot] < 0:
+                return None
+            return (self._bid[slot], self._ask[slot], self._bid_size[slot], self._ask_size[slot],
+                    self._updated_ms[slot])
+
+    def snapshot(self) -> dict[str, np.ndarray]:
+        """Current quotes of every live asset as NumPy columns (copies, safe to keep).
+
+        Columns: asset_id (object), bid, ask, bid_size, ask_size, mid, spread (float64)
+        and updated_ms (int64).
+        """
+        with self.lock:
+            updated = np.frombuffer(self._updated_ms, dtype=np.int64)
+            live = np.flatnonzero(updated >= 0)
+            out = {"updated_ms": updated[live]}
+            for name in QUOTE_COLUMNS:
+                out[name] = np.frombuffer(getattr(self, f"_{name}"), dtype=np.float64)[live]
+            ids = self._asset_ids
+            out["asset_id"] = np.array([ids[i] for i in live.tolist()], dtype=object)
+            del updated  # release the buffer export before the arrays can grow again
+        out["mid"] = (out["bid"] + out["ask"]) / 2
+        out["spread"] = out["ask"] - out["bid"]
+        return out
+
+    def to_arrow(self) -> pa.Table:
+        snap = self.snapshot()
+        columns = ["asset_id", "bid", "ask", "bid_size", "ask_size", "mid", "spread", "updated_ms"]
+        return pa.table({name: snap[name] for name in columns})
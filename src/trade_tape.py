@@ -0,0 +1,271 @@
+"""Append-only trade tape: every ``last_trade_price`` print, kept next to the candles.
+
+Trades are buffered in typed arrays and written on flush as immutable parquet segments
+partitioned by event and UTC day (``trades/<event>/<YYYY-MM-DD>/part-<seq>.parquet``).
+Once a day has closed its parts are merged into one file. Nothing is deduplicated:
+two prints with the same price, size and timestamp are two trades.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from src.archive import IncrementalArchiver
+from src.segments import atomic_write_parquet
+
+logger = logging.getLogger(__name__)
+
+_DICT_STRING = pa.dictionary(pa.int32(), pa.string())
+
+TRADE_SCHEMA = pa.schema([
+    pa.field("asset_id", _DICT_STRING),
+    pa.field("market_slug", _DICT_STRING),
+    pa.field("outcome", _DICT_STRING),
+    pa.field("timestamp_ms", pa.int64()),  # exchange timestamp, Unix milliseconds UTC
+    pa.field("price", pa.float64()),
+    pa.field("size", pa.float64()),
+    pa.field("side", _DICT_STRING),  # aggressor side: BUY, SELL or ""
+])
+TRADE_STRING_COLUMNS = ("asset_id", "market_slug", "outcome", "side")
+
+# side codes in the typed buffer
+_SIDES = np.array(["", "BUY", "SELL"], dtype=object)
+_SIDE_CODES = {"BUY": 1, "SELL": 2}
+_PART_RE = re.compile(r"^part-(\d+)\.parquet$")
+# a day's merged parts, complete but not yet renamed over the last part
+_MERGE_RE = re.compile(r"^_merge-(\d+)\.parquet$")
+_MS_PER_DAY = 86_400_000
+
+
+def to_trade_table(df: pd.DataFrame) -> pa.Table:
+    table = pa.Table.from_pandas(df[TRADE_SCHEMA.names], preserve_index=False)
+    return table.cast(TRADE_SCHEMA)
+
+
+def read_trades(directory: str | Path, event_slug: str | None = None) -> pd.DataFrame:
+    """Every recorded trade under ``directory`` (optionally one event), oldest first,
+    with plain string columns and an 'event_slug' column."""
+    root = Path(directory)
+    pattern = f"{event_slug}/*/part-*.parquet" if event_slug else "*/*/part-*.parquet"
+    frames = []
+    for path in sorted(root.glob(pattern)):
+        df = pd.read_parquet(path).astype({c: str for c in TRADE_STRING_COLUMNS})
+        df.insert(0, "event_slug", path.parent.parent.name)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=["event_slug", *TRADE_SCHEMA.names])
+    out = pd.concat(frames, ignore_index=True)
+    return out.sort_values("timestamp_ms", kind="stable").reset_index(drop=True)
+
+
+class TradeTape:
+    """Buffers trades in typed columns and flushes them as event/day parquet segments.
+
+    ``record_many`` is called by OHLCVAggregator after it has released its own lock, so
+    recording only ever contends with the (pointer-swap) start of a flush. The event,
+    market and outcome of an asset are resolved through ``market_lookup`` when its
+    first trade is recorded, so trades of a market retired before the flush still land
+    in the right partition.
+
+    After each flush the parts of every day that has closed (UTC, by the wall clock)
+    are merged into one file, so a day ends up as a single ``part-<seq>.parquet`` and
+    a late trade for it only adds one part until the next flush merges it in.
+    """
+
+    def __init__(self, data_dir: str = "trades", market_lookup: dict | None = None):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.market_lookup = market_lookup if market_lookup is not None else {}
+        self.lock = threading.Lock()
+        self._new_buffers()
+        # asset_id -> (event_slug, market_slug, outcome)
+        self._info: dict[str, tuple[str, str, str]] = {}
+        # frames whose write failed, retried on the next flush
+        self._pending: list[pd.DataFrame] = []
+        # next part number per day directory written in this run
+        self._next_seq: dict[Path, int] = {}
+        # closed days left with several parts (or an unfinished merge) by earlier runs
+        self._unmerged: set[Path] = {
+            directory for directory in self.data_dir.glob("*/*")
+            if directory.is_dir() and self._needs_merge(directory)
+        }
+        self._archivers: dict[str, IncrementalArchiver] = {}
+        self.recorded = 0
+
+    def _new_buffers(self):
+        self._asset_ids: list[str] = []
+        self._timestamp_ms = array("q")
+        self._price = array("d")
+        self._size = array("d")
+        self._side = array("b")
+
+    def __len__(self) -> int:
+        return len(self._asset_ids) + sum(len(df) for df in self._pending)
+
+    def _describe(self, asset_id: str) -> tuple[str, str, str]:
+        info = self.market_lookup.get(asset_id)
+        if info is None:
+            return "_unknown", asset_id[:16], ""
+        return info.event_slug, info.market_slug, getattr(info, "outcome_label", "") or ""
+
+    def record_many(self, trades: list[tuple]):
+        """Append ``(asset_id, timestamp_ms, price, size, side)`` tuples."""
+        with self.lock:
+            info = self._info
+            for asset_id, timestamp_ms, price, size, side in trades:
+                if asset_id not in info:
+                    info[asset_id] = self._describe(asset_id)
+                self._asset_ids.append(asset_id)
+                self._timestamp_ms.append(timestamp_ms)
+                self._price.append(price)
+                self._size.append(size)
+                self._side.append(_SIDE_CODES.get(side.upper(), 0))
+            self.recorded += len(trades)
+
+    def _drain(self) -> pd.DataFrame | None:
+        with self.lock:
+            if not self._asset_ids:
+                return None
+            asset_ids, timestamp_ms = self._asset_ids, self._timestamp_ms
+            price, size, side = self._price, self._size, self._side
+            self._new_buffers()
+            info = dict(self._info)
+            # assets no longer tracked will not trade again; their last trades are in hand
+            for asset_id in [a for a in self._info if a not in self.market_lookup]:
+                del self._info[asset_id]
+
+        ids = np.array(asset_ids, dtype=object)
+        unique, inverse = np.unique(ids, return_inverse=True)
+        described = [info[a] for a in unique.tolist()]
+        return pd.DataFrame({
+            "event_slug": np.array([d[0] for d in described], dtype=object)[inverse],
+            "market_slug": np.array([d[1] for d in described], dtype=object)[inverse],
+            "outcome": np.array([d[2] for d in described], dtype=object)[inverse],
+            "asset_id": ids,
+            "timestamp_ms": np.frombuffer(timestamp_ms, dtype=np.int64),
+            "price": np.frombuffer(price, dtype=np.float64),
+            "size": np.frombuffer(size, dtype=np.float64),
+            "side": _SIDES[np.frombuffer(side, dtype=np.int8)],
+        })
+
+    def _part_path(self, directory: Path) -> Path:
+        seq = self._next_seq.get(directory)
+        if seq is None:
+            existing = [int(m.group(1)) for p in directory.glob("part-*.parquet") if (m := _PART_RE.match(p.name))]
+            seq = max(existing, default=0) + 1
+        self._next_seq[directory] = seq + 1
+        return directory / f"part-{seq:06d}.parquet"
+
+    @staticmethod
+    def _parts(directory: Path) -> list[tuple[int, Path]]:
+        return sorted(
+            (int(m.group(1)), p) for p in directory.glob("part-*.parquet") if (m := _PART_RE.match(p.name))
+        )
+
+    @classmethod
+    def _needs_merge(cls, directory: Path) -> bool:
+        return any(_MERGE_RE.match(p.name) for p in directory.glob("_merge-*.parquet")) or len(cls._parts(directory)) > 1
+
+    def _merge_day(self, directory: Path) -> int:
+        """Merge the parts of one day into a single file. Returns the number of parts merged.
+
+        The merged rows are first written as ``_merge-<last>.parquet``; the parts it
+        covers are then deleted and it is renamed to ``part-<last>.parquet``. A merge
+        interrupted after that first write is finished by the next one, so no trade is
+        ever lost or read twice.
+        """
+        pending = sorted(
+            (int(m.group(1)), p) for p in directory.glob("_merge-*.parquet") if (m := _MERGE_RE.match(p.name))
+        )
+        if pending:
+            last, merge_path = pending[-1]
+        else:
+            parts = self._parts(directory)
+            if len(parts) < 2:
+                return 0
+            last = parts[-1][0]
+            df = pd.concat([pd.read_parquet(p) for _, p in parts], ignore_index=True)
+            df = df.sort_values("timestamp_ms", kind="stable")
+            merge_path = directory / f"_merge-{last:06d}.parquet"
+            atomic_write_parquet(df, merge_path, to_table=to_trade_table)
+        merged = [p for seq, p in self._parts(directory) if seq <= last]
+        for path in merged:
+            path.unlink(missing_ok=True)
+        os.replace(merge_path, directory / f"part-{last:06d}.parquet")
+        for _, stale in pending[:-1]:
+            stale.unlink(missing_ok=True)
+        return len(merged)
+
+    def merge_closed_days(self, now: float | None = None) -> int:
+        """Merge the parts of every day before today (UTC) and forget their part numbers.
+
+        Returns the number of days merged.
+        """
+        today = time.strftime("%Y-%m-%d", time.gmtime(time.time() if now is None else now))
+        merged = 0
+        for directory in [d for d in (*self._next_seq, *self._unmerged) if d.name < today]:
+            try:
+                # a second round picks up parts written after an interrupted merge
+                count = 0
+                while rounds := self._merge_day(directory):
+                    count += rounds
+            except Exception:
+                logger.exception(f"Error merging trades in {directory}, retried after the next flush")
+                self._unmerged.add(directory)
+                continue
+            self._next_seq.pop(directory, None)
+            self._unmerged.discard(directory)
+            if count:
+                merged += 1
+                logger.info(f"Merged {count} trade parts in {directory}")
+        return merged
+
+    def flush(self) -> int:
+        """Write buffered trades, one segment per event and day, then merge the days that
+        have closed. Returns the number of trades written."""
+        df = self._drain()
+        frames = self._pending + ([df] if df is not None else [])
+        self._pending = []
+        if not frames:
+            self.merge_closed_days()
+            return 0
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        day = pd.to_datetime(df["timestamp_ms"] // _MS_PER_DAY * _MS_PER_DAY, unit="ms", utc=True)
+        df["day"] = day.dt.strftime("%Y-%m-%d")
+
+        written = 0
+        for (event_slug, day), part in df.groupby(["event_slug", "day"], sort=False):
+            try:
+                directory = self.data_dir / str(event_slug) / str(day)
+                directory.mkdir(parents=True, exist_ok=True)
+                part = part.sort_values("timestamp_ms", kind="stable")
+                atomic_write_parquet(part, self._part_path(directory), to_table=to_trade_table)
+                written += len(part)
+            except Exception:
+                logger.exception(f"Error writing trades for {event_slug}/{day}, retained for retry")
+                self._pending.append(part.drop(columns=["day"]))
+        if written:
+            logger.info(f"Flushed {written} trades to {self.data_dir}")
+        self.merge_closed_days()
+        return written
+
+    def archive(self, archive_path: str = "trades.zip", delta: bool = False):
+        """Bring the zip of the trade tape up to date (see ParquetStorage.archive)."""
+        archiver = self._archivers.get(archive_path)
+        if archiver is None:
+            archiver = self._archivers[archive_path] = IncrementalArchiver(self.data_dir, archive_path)
+        try:
+            files = archiver.scan()
+            archiver.build(files)
+            if delta:
+                archiver.build_delta(files)
+        except Exception:
+            logger.exception("Error creating trade archive")
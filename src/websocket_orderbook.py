@@ -1,25 +1,147 @@
 from websocket import WebSocketApp
 import json
 import logging
+import random
 import threading
+import time
+
+from src.decoding import DECODE_ERRORS, get_decoder
+from src.gaps import GapRecord
+from src.messages import MarketResolvedMessage
 
 logger = logging.getLogger(__name__)
 
 MARKET_CHANNEL = "market"
 USER_CHANNEL = "user"
 
+# a connection that stayed up this long resets the reconnect backoff
+STABLE_CONNECTION_SECONDS = 60
+# 2**32 times any sane backoff_initial is far beyond backoff_max
+MAX_BACKOFF_EXPONENT = 32
+
+# market-channel events handed to the aggregator
+FORWARDED_EVENTS = frozenset({
+    "book",
+    "price_change",
+    "tick_size_change",
+    "last_trade_price",
+    "best_bid_ask",
+})
+
+
+class FrameRouter:
+    """Decodes raw market-channel frames and routes their events to the callbacks.
+
+    One router can be shared by several connections (see ShardedConnectionManager) so
+    every shard feeds the same aggregation pipeline. Nothing is retained per asset: the
+    latest quotes live in the aggregator's TopOfBookStore.
+    """
+
+    def __init__(self, message_callback=None, verbose=False, new_market_callback=None,
+                 batch_callback=None, decoder=None, resolved_callback=None):
+        self.message_callback = message_callback
+        # called once per frame with every forwarded event; takes precedence over message_callback
+        self.batch_callback = batch_callback
+        self.new_market_callback = new_market_callback
+        # called with each market_resolved event (its assets_ids are then retired)
+        self.resolved_callback = resolved_callback
+        self.verbose = verbose
+        self.decoder_name, self._decode = get_decoder(decoder)
+        # event type -> route(item, batch); built once instead of per frame
+        self._routes = {event: self._route_forward for event in FORWARDED_EVENTS}
+        self._routes["new_market"] = self._route_new_market
+        self._routes["market_resolved"] = self._route_resolved
+
+    def handle_frame(self, message):
+        """Decode one raw frame and route its events to the callbacks."""
+        if len(message) < 8 and message.strip() in ("PONG", b"PONG"):
+            if self.verbose:
+                logger.debug("Pong received")
+            return
+        try:
+            data = self._decode(message)
+        except DECODE_ERRORS:
+            logger.warning(f"Non-JSON message: {message}")
+            return
+
+        if isinstance(data, list):
+            items = data
+        elif isinstance(data, dict):
+            items = (data,)
+        else:
+            logger.warning(f"Unexpected JSON data type: {type(data)}")
+            return
+
+        batch = []
+        routes = self._routes
+        verbose = self.verbose
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            event_type = item.get("event") or item.get("event_type")
+            route = routes.get(event_type)
+            if route is None:
+                if verbose and event_type is not None:
+                    logger.debug(f"Ignored event: {event_type}")
+                continue
+            route(item, batch)
+            if verbose:
+                logger.debug(f"Processed: {item}")
+
+        if batch:
+            if self.batch_callback:
+                self.batch_callback(batch)
+            elif self.message_callback:
+                for item in batch:
+                    self.message_callback(item)
+
+    def _route_forward(self, item: dict, batch: list):
+        batch.append(item)
+
+    def _route_new_market(self, item: dict, batch: list):
+        if self.new_market_callback:
+            self.new_market_callback(item)
+
+    def _route_resolved(self, item: MarketResolvedMessage, batch: list):
+        if self.resolved_callback:
+            self.resolved_callback(item)
+
 
 class WebSocketOrderBook:
-    def __init__(self, channel_type, url, data, auth, message_callback, verbose, new_market_callback=None):
+    def __init__(self, channel_type, url, data, auth, message_callback, verbose, new_market_callback=None,
+                 batch_callback=None, frame_callback=None, decoder=None, router=None, name="websocket",
+                 gap_callback=None, backoff_initial=1.0, backoff_max=60.0, resubscribe_chunk_size=100):
         self.channel_type = channel_type
         self.url = url
         self.data = list(data)  # Copy so we can append dynamically
         self.auth = auth
-        self.message_callback = message_callback
-        self.new_market_callback = new_market_callback
+        # when set, raw frames are handed to it (e.g. IngestPipeline.put) instead of being
+        # parsed on the socket thread; the consumer then calls handle_frame
+        self.frame_callback = frame_callback
         self.verbose = verbose
+        self.name = name
+        if router is None:
+            router = FrameRouter(
+                message_callback=message_callback,
+                verbose=verbose,
+                new_market_callback=new_market_callback,
+                batch_callback=batch_callback,
+                decoder=decoder,
+            )
+        self.router = router
+        self.decoder_name = router.decoder_name
+        self.handle_frame = router.handle_frame
+        # called with a list of GapRecord (one per asset) after every reconnect
+        self.gap_callback = gap_callback
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.resubscribe_chunk_size = max(1, resubscribe_chunk_size)
+        self.reconnects = 0
+        self._opened_at: float | None = None  # set while the current connection is up
+        self._connected_since: float | None = None  # last successful open, for backoff resets
+        self._disconnected_at: float | None = None
+        self._gap_assets: list[str] = []
         self._stop_event = threading.Event()
-        self.orderbooks = {}
         self._init_ws()
 
     def _init_ws(self):
@@ -33,78 +155,48 @@ class WebSocketOrderBook:
         )
 
     def on_message(self, ws, message):
-        try:
-            data = json.loads(message)
-            desired_events = {
-                "book",
-                "price_change",
-                "tick_size_change",
-                "last_trade_price",
-                "best_bid_ask",
-                "new_market",
-            }
-
-            def get_event_type(d):
-                return d.get("event") or d.get("event_type")
-
-            if isinstance(data, list):
-                for item in data:
-                    event_type = get_event_type(item)
-                    if isinstance(item, dict) and event_type in desired_events:
-                        if event_type == "new_market":
-                            if self.new_market_callback:
-                                self.new_market_callback(item)
-                        else:
-                            asset_id = item.get("asset_id")
-                            if asset_id:
-                                self.orderbooks[asset_id] = item
-                            if self.message_callback:
-                                self.message_callback(item)
-                        if self.verbose:
-                            logger.debug(f"Processed: {item}")
-                    elif isinstance(item, dict) and self.verbose and event_type is not None:
-                        logger.debug(f"Ignored event: {event_type}")
-            elif isinstance(data, dict):
-                event_type = get_event_type(data)
-                if event_type in desired_events:
-                    if event_type == "new_market":
-                        if self.new_market_callback:
-                            self.new_market_callback(data)
-                    else:
-                        asset_id = data.get("asset_id")
-                        if asset_id:
-                            self.orderbooks[asset_id] = data
-                        if self.message_callback:
-                            self.message_callback(data)
-                    if self.verbose:
-                        logger.debug(f"Processed: {data}")
-                elif self.verbose and event_type is not None:
-                    logger.debug(f"Ignored event: {event_type}")
-            else:
-                logger.warning(f"Unexpected JSON data type: {type(data)}")
-        except json.JSONDecodeError:
-            if message.strip() == "PONG":
-                if self.verbose:
-                    logger.debug("Pong received")
-            else:
-                logger.warning(f"Non-JSON message: {message}")
+        if self.frame_callback is not None:
+            self.frame_callback(message)
+        else:
+            self.handle_frame(message)
 
     def on_error(self, ws, error):
-        logger.error(f"WebSocket error: {error}")
+        logger.error(f"[{self.name}] WebSocket error: {error}")
 
     def on_close(self, ws, close_status_code, close_msg):
-        logger.warning(f"WebSocket closed: {close_status_code} {close_msg}")
-        if not self._stop_event.is_set():
-            logger.info("Reconnecting in 5 seconds...")
-            self._stop_event.wait(5)
-            if not self._stop_event.is_set():
-                self._init_ws()
-                self.ws.run_forever()
+        logger.warning(f"[{self.name}] WebSocket closed: {close_status_code} {close_msg}")
+        self._mark_disconnected()
+
+    def _mark_disconnected(self):
+        # Only an established connection opens a gap; failed reconnects extend it.
+        if self._opened_at is not None and self._disconnected_at is None:
+            self._disconnected_at = time.time()
+            self._gap_assets = list(self.data)
+        self._opened_at = None
+
+    def _emit_gaps(self):
+        started, assets = self._disconnected_at, self._gap_assets
+        self._disconnected_at, self._gap_assets = None, []
+        if started is None or not assets or self.gap_callback is None:
+            return
+        ended = time.time()
+        logger.info(f"[{self.name}] Outage of {ended - started:.1f}s for {len(assets)} assets")
+        try:
+            self.gap_callback([GapRecord(a, started, ended, connection=self.name) for a in assets])
+        except Exception:
+            logger.exception("Error recording gap")
 
     def on_open(self, ws):
+        self._opened_at = self._connected_since = time.time()
         if self.channel_type == MARKET_CHANNEL:
-            ws.send(json.dumps({"assets_ids": self.data, "type": MARKET_CHANNEL, "custom_feature_enabled": True}))
-            logger.info(f"Subscribed to {len(self.data)} assets")
+            # Initial subscribe carries the first chunk, the rest follow as subscribe operations.
+            size = self.resubscribe_chunk_size
+            assets = list(self.data)
+            ws.send(json.dumps({"assets_ids": assets[:size], "type": MARKET_CHANNEL, "custom_feature_enabled": True}))
+            for i in range(size, len(assets), size):
+                ws.send(json.dumps({"assets_ids": assets[i:i + size], "operation": "subscribe"}))
+            logger.info(f"[{self.name}] Subscribed to {len(assets)} assets")
+            self._emit_gaps()
         elif self.channel_type == USER_CHANNEL and self.auth:
             ws.send(
                 json.dumps(
@@ -121,18 +213,27 @@ class WebSocketOrderBook:
 
     def subscribe_to_tokens_ids(self, assets_ids):
         if self.channel_type == MARKET_CHANNEL:
-            self.ws.send(
-                json.dumps({"assets_ids": assets_ids, "operation": "subscribe"})
-            )
+            # Record first: if the socket is down the ids go out with the next on_open.
             self.data.extend(assets_ids)
-            logger.info(f"Subscribed to {len(assets_ids)} new assets")
+            try:
+                self.ws.send(
+                    json.dumps({"assets_ids": assets_ids, "operation": "subscribe"})
+                )
+            except Exception as e:
+                logger.warning(f"[{self.name}] Subscribe deferred until reconnect: {e}")
+                return
+            logger.info(f"[{self.name}] Subscribed to {len(assets_ids)} new assets")
 
     def unsubscribe_to_tokens_ids(self, assets_ids):
         if self.channel_type == MARKET_CHANNEL:
-            self.ws.send(
-                json.dumps({"assets_ids": assets_ids, "operation": "unsubscribe"})
-            )
-            self.data = [a for a in self.data if a not in set(assets_ids)]
+            removed = set(assets_ids)
+            self.data = [a for a in self.data if a not in removed]
+            try:
+                self.ws.send(
+                    json.dumps({"assets_ids": assets_ids, "operation": "unsubscribe"})
+                )
+            except Exception as e:
+                logger.warning(f"[{self.name}] Unsubscribe not sent (socket down): {e}")
 
     def ping(self, ws):
         while not self._stop_event.is_set():
@@ -146,5 +247,39 @@ class WebSocketOrderBook:
         self._stop_event.set()
         self.ws.close()
 
+    def backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter: uniform in [d/2, d] for d = initial * 2^attempt, capped."""
+        # the exponent is clamped so a long outage never overflows the float conversion
+        delay = min(self.backoff_max, self.backoff_initial * (2 ** min(attempt, MAX_BACKOFF_EXPONENT)))
+        return random.uniform(delay / 2, delay)
+
     def run(self):
-        self.ws.run_forever()
+        """Supervise the connection until stop(): reconnect with backoff, in a flat loop.
+
+        Any error in the supervision itself is logged and retried after a backoff, so
+        the shard never stops reconnecting before stop().
+        """
+        attempt = 0
+        while not self._stop_event.is_set():
+            try:
+                self.ws.run_forever()
+            except Exception:
+                logger.exception(f"[{self.name}] WebSocket loop failed")
+            try:
+                self._mark_disconnected()
+                if self._stop_event.is_set():
+                    break
+                if self._connected_since is not None and time.time() - self._connected_since >= STABLE_CONNECTION_SECONDS:
+                    attempt = 0
+                self._connected_since = None
+                delay = self.backoff_delay(attempt)
+                attempt += 1
+                self.reconnects += 1
+                logger.info(f"[{self.name}] Reconnecting in {delay:.1f}s (attempt {attempt})")
+                if self._stop_event.wait(delay):
+                    break
+                self._init_ws()
+            except Exception:
+                logger.exception(f"[{self.name}] Error preparing reconnect")
+                if self._stop_event.wait(self.backoff_max):
+                    break
@@ -0,0 +1,95 @@
+"""DiscoveryCache behaviour through MarketDiscovery against the local Gamma stand-in."""
+
+import threading
+import time
+
+import pytest
+
+from scripts.gamma_stub_server import serve
+from src.discovery_cache import DiscoveryCache
+from src.market_discovery import MarketDiscovery
+
+SLUG = "highest-temperature-in-nyc-on-january-1"
+
+
+@pytest.fixture
+def gamma():
+    server = serve(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _discovery(gamma, cache: DiscoveryCache) -> MarketDiscovery:
+    return MarketDiscovery(max_workers=1, cache=cache, base_url=f"http://127.0.0.1:{gamma.server_port}")
+
+
+def _event(discovery: MarketDiscovery, slug: str = SLUG, **kwargs):
+    return discovery._get_json(discovery.events_url, {"slug": slug}, **kwargs)
+
+
+def test_expired_entry_is_revalidated_with_304(gamma):
+    discovery = _discovery(gamma, DiscoveryCache())
+    first = _event(discovery)
+    assert first[0]["slug"] == SLUG
+    # ttl 0: every call asks the server, which answers the conditional request with 304
+    assert _event(discovery) == first
+    assert discovery.cache.stats()["revalidated"] == 1
+    assert gamma.stub.requests == 2
+    discovery.close()
+
+
+def test_failed_revalidation_serves_the_cached_value(gamma):
+    discovery = _discovery(gamma, DiscoveryCache())
+    first = _event(discovery)
+    gamma.stub.fail_rate = 1.0
+    assert _event(discovery, negative=True) == first
+    entry, _ = discovery.cache.get(f"{discovery.events_url}?slug={SLUG}", ttl=0)
+    assert entry is not None and not entry.negative
+    discovery.close()
+
+
+def test_negative_entry_expires(gamma):
+    discovery = _discovery(gamma, DiscoveryCache(negative_ttl_seconds=0.2))
+    gamma.stub.fail_rate = 1.0
+    assert _event(discovery, ttl=60, negative=True) is None
+    assert _event(discovery, ttl=60, negative=True) is None
+    assert gamma.stub.requests == 1
+
+    gamma.stub.fail_rate = 0.0
+    time.sleep(0.25)
+    assert _event(discovery, ttl=60, negative=True)[0]["slug"] == SLUG
+    assert gamma.stub.requests == 2
+    discovery.close()
+
+
+def test_lru_keeps_the_most_recently_used_entries(gamma):
+    discovery = _discovery(gamma, DiscoveryCache(max_entries=2))
+    for slug in ("a", "b"):
+        _event(discovery, slug, ttl=60)
+    _event(discovery, "a", ttl=60)  # a is now the most recent
+    _event(discovery, "c", ttl=60)
+    assert len(discovery.cache) == 2
+    requests = gamma.stub.requests
+    _event(discovery, "a", ttl=60)
+    _event(discovery, "c", ttl=60)
+    assert gamma.stub.requests == requests
+    _event(discovery, "b", ttl=60)
+    assert gamma.stub.requests == requests + 1
+    discovery.close()
+
+
+def test_cache_persists_across_instances(gamma, tmp_path):
+    path = str(tmp_path / "discovery_cache.json")
+    discovery = _discovery(gamma, DiscoveryCache(path))
+    first = _event(discovery)
+    discovery.close()
+
+    restarted = _discovery(gamma, DiscoveryCache(path))
+    assert len(restarted.cache) == 1
+    assert _event(restarted) == first
+    assert restarted.cache.stats()["revalidated"] == 1
+    assert gamma.stub.requests == 2
+    restarted.close()
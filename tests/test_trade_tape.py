@@ -0,0 +1,57 @@
+"""TradeTape merging of closed days."""
+
+import calendar
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+from src.segments import atomic_write_parquet
+from src.trade_tape import TradeTape, read_trades, to_trade_table
+
+DAY_MS = 86_400_000
+JAN_1 = calendar.timegm((2026, 1, 1, 0, 0, 0)) * 1000
+INFO = {"a": SimpleNamespace(event_slug="ev", market_slug="m", outcome_label="Yes")}
+
+
+def test_closed_day_parts_are_merged(tmp_path, monkeypatch):
+    monkeypatch.setattr(time, "time", lambda: JAN_1 / 1000 + 3600)
+    tape = TradeTape(str(tmp_path), market_lookup=INFO)
+    for i in range(3):
+        tape.record_many([("a", JAN_1 + 1000 * i, 0.5, 1.0, "BUY")])
+        tape.flush()
+    day = tmp_path / "ev" / "2026-01-01"
+    assert len(list(day.glob("part-*.parquet"))) == 3
+
+    # the next day: the first flush merges January 1st and forgets its part numbers
+    monkeypatch.setattr(time, "time", lambda: (JAN_1 + DAY_MS) / 1000 + 60)
+    tape.record_many([("a", JAN_1 + DAY_MS, 0.6, 1.0, "SELL")])
+    tape.flush()
+    assert [p.name for p in day.glob("part-*.parquet")] == ["part-000003.parquet"]
+    assert day not in tape._next_seq
+    # a late trade for the closed day is merged in by the same flush
+    tape.record_many([("a", JAN_1 + 5000, 0.55, 2.0, "BUY")])
+    tape.flush()
+    assert [p.name for p in day.glob("part-*.parquet")] == ["part-000004.parquet"]
+    assert read_trades(tmp_path, "ev")["timestamp_ms"].tolist() == [
+        JAN_1, JAN_1 + 1000, JAN_1 + 2000, JAN_1 + 5000, JAN_1 + DAY_MS
+    ]
+
+
+def test_interrupted_merge_is_finished_on_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(time, "time", lambda: JAN_1 / 1000 + 3600)
+    tape = TradeTape(str(tmp_path), market_lookup=INFO)
+    for i in range(3):
+        tape.record_many([("a", JAN_1 + 1000 * i, 0.5, 1.0, "BUY")])
+        tape.flush()
+    day = tmp_path / "ev" / "2026-01-01"
+    # crash after the merged file was written and one covered part deleted
+    merged = pd.concat([pd.read_parquet(p) for p in sorted(day.glob("part-*.parquet"))], ignore_index=True)
+    atomic_write_parquet(merged, day / "_merge-000003.parquet", to_table=to_trade_table)
+    (day / "part-000001.parquet").unlink()
+
+    monkeypatch.setattr(time, "time", lambda: (JAN_1 + DAY_MS) / 1000)
+    restarted = TradeTape(str(tmp_path), market_lookup=INFO)
+    restarted.flush()
+    assert [p.name for p in day.iterdir()] == ["part-000003.parquet"]
+    assert read_trades(tmp_path, "ev")["timestamp_ms"].tolist() == [JAN_1, JAN_1 + 1000, JAN_1 + 2000]
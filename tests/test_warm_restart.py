@@ -0,0 +1,145 @@
+"""Crash recovery with both the candle WAL and the warm-restart snapshot enabled."""
+
+import pandas as pd
+
+from src.market_discovery import MarketDiscovery, MarketInfo
+from src.ohlcv_aggregator import OHLCVAggregator
+from src.rollup import CandleRollup, MultiResolutionStorage
+from src.snapshot import load_snapshot, save_snapshot
+from src.storage import ParquetStorage
+
+T0 = 1_700_000_040  # a minute boundary
+
+
+def _trade(asset_id: str, seconds: float, price: float) -> dict:
+    return {
+        "event_type": "last_trade_price", "asset_id": asset_id, "timestamp": str(int(seconds * 1000)),
+        "price": str(price), "size": "1", "side": "BUY",
+    }
+
+
+def _recorder(tmp_path):
+    discovery = MarketDiscovery(max_workers=1)
+    aggregator = OHLCVAggregator(
+        60, tracked_assets=discovery.known_assets, market_lookup=discovery.known_assets,
+        fill_empty=True, allowed_lateness=2,
+    )
+    storage = ParquetStorage(
+        str(tmp_path / "data"), market_lookup=discovery.known_assets, wal_dir=str(tmp_path / "wal")
+    )
+    return discovery, aggregator, storage
+
+
+def _advance(aggregator, storage, now: float):
+    aggregator.flush_stale_candles(now)
+    completed = aggregator.drain_completed_candles()
+    if completed:
+        storage.append_candles(completed)
+
+
+def test_wal_and_snapshot_restore_each_candle_once(tmp_path):
+    discovery, aggregator, storage = _recorder(tmp_path)
+    for i in range(2):
+        discovery.known_assets[f"a{i}"] = MarketInfo(f"a{i}", "ev", f"m{i}", "E", "c", "yes")
+
+    aggregator.on_messages([_trade("a0", T0, 0.5), _trade("a1", T0 + 1, 0.6)])
+    # snapshot right after a flush, while the first minute is still open
+    _advance(aggregator, storage, T0 + 5)
+    storage.flush_to_disk()
+    save_snapshot(tmp_path / "state", discovery, aggregator, ["a0", "a1"])
+
+    # the open minute and the next one are finalized into the WAL, then the process dies
+    aggregator.on_messages([_trade("a0", T0 + 70, 0.55), _trade("a1", T0 + 71, 0.65)])
+    _advance(aggregator, storage, T0 + 130)
+    storage.sync_wal()
+    expected = storage.buffered_candles()
+    assert len(expected) == 4
+
+    discovery, aggregator, storage = _recorder(tmp_path)
+    snapshot = load_snapshot(tmp_path / "state")
+    restored = snapshot.restore(discovery, aggregator, emitted=storage.buffered_candles())
+    assert restored == 0
+    assert len(storage.buffered_candles()) == 4
+
+    aggregator.on_messages([_trade("a0", T0 + 200, 0.7)])
+    _advance(aggregator, storage, T0 + 400)
+    storage.flush_to_disk()
+
+    df = pd.concat([pd.read_parquet(p) for p in (tmp_path / "data").rglob("*.parquet")])
+    assert not df.duplicated(["asset_id", "timestamp"]).any()
+    real = df[~df["synthetic"]].set_index(["asset_id", "timestamp"]).sort_index()
+    assert real.loc[("a0", 1_700_000_040), "close"] == 0.5
+    assert real.loc[("a0", 1_700_000_100), "close"] == 0.55
+    # carry-forward resumes from the WAL's candles, not the stale snapshot
+    filled = df[df["synthetic"] & (df["asset_id"] == "a1")].sort_values("timestamp")
+    assert filled["timestamp"].iloc[0] == 1_700_000_160
+    assert (filled["close"] == 0.65).all()
+
+
+def _rollup_recorder(tmp_path):
+    discovery, aggregator, base = _recorder(tmp_path)
+    return discovery, aggregator, MultiResolutionStorage(base, CandleRollup(60, [3600], delay=2))
+
+
+def _advance_rollup(aggregator, storage, now: float):
+    _advance(aggregator, storage, now)
+    storage.finalize_rollups(now)
+
+
+def test_open_rollup_candle_survives_restart(tmp_path):
+    hour = T0 - T0 % 3600
+    discovery, aggregator, storage = _rollup_recorder(tmp_path)
+    discovery.known_assets["a0"] = MarketInfo("a0", "ev", "m0", "E", "c", "yes")
+
+    # two minutes of the hour are folded into the open 1h candle before the snapshot
+    aggregator.on_messages([_trade("a0", T0, 0.5), _trade("a0", T0 + 60, 0.9)])
+    _advance_rollup(aggregator, storage, T0 + 125)
+    storage.flush_to_disk()
+    save_snapshot(tmp_path / "state", discovery, aggregator, ["a0"], rollup=storage.rollup)
+
+    # a third minute only reaches the base WAL before the crash
+    aggregator.on_messages([_trade("a0", T0 + 130, 0.3)])
+    _advance_rollup(aggregator, storage, T0 + 185)
+    storage.sync_wal()
+
+    discovery, aggregator, storage = _rollup_recorder(tmp_path)
+    snapshot = load_snapshot(tmp_path / "state")
+    snapshot.restore(discovery, aggregator, emitted=storage.base.buffered_candles(),
+                     rollup=storage.rollup, emitted_rollups=storage.recovered_rollups())
+    aggregator.on_messages([_trade("a0", T0 + 190, 0.6)])
+    _advance_rollup(aggregator, storage, hour + 3600 + 5)
+    storage.flush_to_disk()
+
+    df = pd.concat([pd.read_parquet(p) for p in (tmp_path / "data_1h").rglob("*.parquet")])
+    assert len(df) == 1
+    bar = df.iloc[0]
+    assert bar["timestamp"] == hour
+    assert (bar["open"], bar["high"], bar["low"], bar["close"]) == (0.5, 0.9, 0.3, 0.6)
+    assert bar["trade_count"] == 4
+
+
+def test_flush_after_snapshot_is_not_reopened(tmp_path):
+    discovery, aggregator, storage = _recorder(tmp_path)
+    discovery.known_assets["a0"] = MarketInfo("a0", "ev", "m0", "E", "c", "yes")
+
+    aggregator.on_messages([_trade("a0", T0, 0.5)])
+    save_snapshot(tmp_path / "state", discovery, aggregator, ["a0"])
+
+    # the minute completes and is flushed (emptying the WAL), then the process dies
+    aggregator.on_messages([_trade("a0", T0 + 10, 0.9)])
+    _advance(aggregator, storage, T0 + 65)
+    storage.flush_to_disk()
+    assert len(storage.buffered_candles()) == 0
+
+    discovery, aggregator, storage = _recorder(tmp_path)
+    snapshot = load_snapshot(tmp_path / "state")
+    restored = snapshot.restore(discovery, aggregator, emitted=storage.buffered_candles(),
+                                flushed=storage.flushed_candles())
+    assert restored == 0
+    _advance(aggregator, storage, T0 + 200)
+    storage.flush_to_disk()
+
+    df = pd.concat([pd.read_parquet(p) for p in (tmp_path / "data").rglob("*.parquet")])
+    assert not df.duplicated(["asset_id", "timestamp"]).any()
+    minute = df.set_index("timestamp").loc[T0]
+    assert (minute["close"], minute["high"], minute["trade_count"]) == (0.9, 0.9, 2)